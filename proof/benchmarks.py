@@ -0,0 +1,407 @@
+"""
+Benchmarks for the Mind in Focus backend.
+
+Usage:
+    python benchmarks.py workers [video_path] [num_frames]
+    python benchmarks.py frames [video_path] [num_frames]
+    python benchmarks.py replay [trace.jsonl] [num_sessions]
+    python benchmarks.py camera [device_or_url] [num_frames]
+    python benchmarks.py drowsiness [trace.jsonl] [num_frames]
+    python benchmarks.py render [video_path] [num_frames]
+
+Without a video, synthetic frames are used. FaceMesh finds no face in them, so
+use a short recording of a face for representative numbers. Without a trace
+(see SESSION_TRACE_DIR), replay uses a synthetic 30-minute session. The
+camera benchmark uses the CAMERA_* settings and needs a real device. The
+render benchmark times the window itself only when a display is available.
+"""
+
+import gc
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import cv2
+import numpy as np
+
+import mind_in_focus as mif
+
+
+def load_frames(video_path: str | None, count: int, shape=(720, 1280, 3)) -> list:
+    """Decode `count` frames from a video (looping), or make synthetic ones."""
+    if not video_path:
+        rng = np.random.default_rng(0)
+        distinct = [rng.integers(0, 256, size=shape, dtype=np.uint8) for _ in range(8)]
+        return [distinct[i % len(distinct)] for i in range(count)]
+
+    cap = cv2.VideoCapture(video_path)
+    frames = []
+    while len(frames) < count:
+        ret, frame = cap.read()
+        if not ret:
+            if not frames:
+                raise SystemExit(f"Could not read frames from {video_path}")
+            cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+            continue
+        frames.append(frame)
+    cap.release()
+    return frames
+
+
+def bench_inline(frames: list) -> float:
+    """Frames per second analyzing in the calling process (the default mode)."""
+    h, w = frames[0].shape[:2]
+    with mif.mp_face_mesh.FaceMesh(
+        max_num_faces=1,
+        refine_landmarks=True,
+        min_detection_confidence=0.5,
+        min_tracking_confidence=0.5
+    ) as face_mesh:
+        start = time.perf_counter()
+        for i, frame in enumerate(frames, start=1):
+            rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+            results = face_mesh.process(rgb)
+            if results.multi_face_landmarks:
+                mif.compute_ear(results.multi_face_landmarks[0].landmark, mif.LEFT_EYE_IDX, w, h)
+            if i % mif.DETECT_EVERY_N_FRAMES == 0:
+                mif.detect_items(frame)
+        return len(frames) / (time.perf_counter() - start)
+
+
+def bench_pool(frames: list, workers: int) -> float:
+    """Frames per second through a VisionWorkerPool, submitting as fast as slots free up."""
+    pool = mif.VisionWorkerPool(frames[0].shape, workers)
+    try:
+        # Warm-up: model/graph initialization in every worker
+        for frame in frames[:workers * 2]:
+            pool.submit(frame, time.time(), block=True)
+        pool.drain()
+
+        start = time.perf_counter()
+        for i, frame in enumerate(frames, start=1):
+            pool.submit(frame, time.time(), detect=i % mif.DETECT_EVERY_N_FRAMES == 0, block=True)
+            pool.results()
+        pool.drain()
+        return len(frames) / (time.perf_counter() - start)
+    finally:
+        pool.close()
+
+
+def run_workers(video_path: str | None, num_frames: int):
+    frames = load_frames(video_path, num_frames)
+    print(f"[BENCH] {len(frames)} frames of {frames[0].shape[1]}x{frames[0].shape[0]}")
+
+    baseline = bench_inline(frames)
+    print(f"[BENCH] inline:    {baseline:7.1f} FPS")
+    for workers in (1, 2, 4):
+        fps = bench_pool(frames, workers)
+        print(f"[BENCH] workers={workers}: {fps:7.1f} FPS (x{fps / baseline:.2f} vs inline)")
+
+
+class _ReplayCapture:
+    """Stands in for cv2.VideoCapture with the same read(image=...) semantics."""
+
+    def __init__(self, frames: list):
+        self.frames = frames
+        self.index = 0
+
+    def read(self, image=None):
+        src = self.frames[self.index % len(self.frames)]
+        self.index += 1
+        if image is None or image.shape != src.shape:
+            return True, src.copy()
+        np.copyto(image, src)
+        return True, image
+
+
+def _measure_alloc(step, num_frames: int) -> dict:
+    """Run step() per frame; return bytes allocated, GC pauses and wall time."""
+    pauses = []
+    starts = {}
+
+    def on_gc(phase, info):
+        if phase == "start":
+            starts[info["generation"]] = time.perf_counter()
+        elif info["generation"] in starts:
+            pauses.append(time.perf_counter() - starts.pop(info["generation"]))
+
+    gc.callbacks.append(on_gc)
+    tracemalloc.start()
+    allocated = 0
+    start = time.perf_counter()
+    try:
+        for _ in range(num_frames):
+            before = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+            step()
+            allocated += tracemalloc.get_traced_memory()[1] - before
+    finally:
+        elapsed = time.perf_counter() - start
+        tracemalloc.stop()
+        gc.callbacks.remove(on_gc)
+    return {"allocated": allocated, "elapsed": elapsed, "pauses": pauses}
+
+
+def run_frames(video_path: str | None, num_frames: int, fps: float = 30.0):
+    """Allocation churn of capture + color conversion: fresh arrays vs FramePool."""
+    frames = load_frames(video_path, min(num_frames, 120))
+    shape = frames[0].shape
+
+    cap = _ReplayCapture(frames)
+
+    def fresh_step():
+        ret, frame = cap.read()
+        cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+
+    pool = mif.FramePool(shape)
+
+    def pooled_step():
+        buf = pool.read(cap)
+        buf.to_rgb()
+        buf.release()
+
+    print(f"[BENCH] {num_frames} frames of {shape[1]}x{shape[0]}, rates scaled to {fps:.0f} FPS")
+    for name, step in (("fresh", fresh_step), ("pooled", pooled_step)):
+        stats = _measure_alloc(step, num_frames)
+        per_frame = stats["allocated"] / num_frames
+        pauses = stats["pauses"]
+        print(
+            f"[BENCH] {name:6}: {per_frame / 1024:9.1f} KiB/frame allocated "
+            f"({per_frame * fps / 1e6:7.1f} MB/s), "
+            f"{stats['elapsed'] / num_frames * 1000:.2f} ms/frame, "
+            f"GC: {len(pauses)} pauses, total {sum(pauses) * 1000:.2f} ms, "
+            f"max {max(pauses, default=0.0) * 1000:.2f} ms"
+        )
+    print(f"[BENCH] pool buffers allocated: {pool.allocated}")
+
+def synthetic_trace(path: str, minutes: float = 30.0, fps: float = 30.0, seed: int = 0):
+    """Write a plausible session trace: blinks, look-aways, a drink, a time-up prompt."""
+    rng = random.Random(seed)
+    start = 1_700_000_000.0
+    writer = mif.SessionTraceWriter(path, {"start": start, "planned_minutes": minutes * 0.8,
+                                           "open_ear_baseline": 0.30})
+    frames = int(minutes * 60 * fps)
+    blink_until = away_until = -1
+    for i in range(frames):
+        ts = start + i / fps
+        if i > away_until and rng.random() < 0.0005:
+            away_until = i + int(rng.uniform(2, 30) * fps)
+        if i > blink_until and rng.random() < 0.01:
+            blink_until = i + 4
+        face = i > away_until
+        ear = None if not face else (0.08 if i <= blink_until else rng.gauss(0.30, 0.015))
+        detect = i % mif.DETECT_EVERY_N_FRAMES == 0
+        drink = (frames // 3 < i < frames // 2) if detect else None
+        writer.write(mif.SessionEvent(ts, "observation", mif.VisionResult(i, ts, face, ear, drink, False if detect else None)))
+        writer.write(mif.SessionEvent(ts, "clock", None))
+        if i == int(minutes * 0.8 * 60 * fps) + 90:
+            writer.write(mif.SessionEvent(ts, "input", ""))
+    writer.close()
+
+
+def run_replay(trace_path: str | None, num_sessions: int):
+    """Replay speed of the session engine, alone and with many sessions interleaved."""
+    tmp = None
+    if not trace_path:
+        tmp = tempfile.TemporaryDirectory()
+        trace_path = os.path.join(tmp.name, "synthetic.jsonl")
+        synthetic_trace(trace_path)
+    try:
+        header, events = mif.read_session_trace(trace_path)
+    finally:
+        if tmp is not None:
+            tmp.cleanup()
+    span = events[-1].ts - events[0].ts if events else 0.0
+    print(f"[BENCH] {len(events)} events covering {span / 60:.1f} min")
+
+    def new_engine():
+        return mif.engine_for_trace(header)
+
+    start = time.perf_counter()
+    engine = new_engine()
+    effects = engine.run(events)
+    elapsed = time.perf_counter() - start
+    again = new_engine()
+    assert again.run(events) == effects and again.avg_focus == engine.avg_focus, "replay is not deterministic"
+    print(f"[BENCH] single replay: {elapsed * 1000:.0f} ms, {len(events) / elapsed / 1000:.0f}k events/s, "
+          f"x{span / elapsed:.0f} real time, {len(effects)} effects, avg focus {engine.avg_focus:.1f}, "
+          f"ended={engine.end_reason}")
+
+    # Interleave sessions event by event, as a server handling many cameras would
+    tracemalloc.start()
+    engines = [new_engine() for _ in range(num_sessions)]
+    per_engine = tracemalloc.get_traced_memory()[0] / max(num_sessions, 1)
+    tracemalloc.stop()
+    start = time.perf_counter()
+    for event in events:
+        for e in engines:
+            e.step(event)
+    elapsed = time.perf_counter() - start
+    total = len(events) * num_sessions
+    print(f"[BENCH] {num_sessions} interleaved sessions: {total / elapsed / 1000:.0f}k events/s, "
+          f"{per_engine / 1024:.1f} KiB per engine, "
+          f"{num_sessions * 30 * 2 / (total / elapsed) * 100:.2f}% of one core at 30 FPS each")
+
+
+def run_camera(source: str | None, num_frames: int, analysis_ms: float = 50.0):
+    """
+    Delivered FPS and capture-to-analysis latency of the configured camera,
+    with a consumer slower than the camera (analysis_ms per frame), for a
+    1-frame driver buffer vs the usual 4: deeper buffers hand out stale frames.
+    """
+    for buffersize in (1, 4):
+        camera = mif.Camera(source=source or mif.CAMERA_SOURCE, buffersize=buffersize)
+        if not camera.open():
+            raise SystemExit(f"Could not open camera {source or mif.CAMERA_SOURCE}")
+        try:
+            for _ in range(10):  # let auto-exposure and the stream settle
+                camera.read()
+            camera.reset_stats()
+            for _ in range(num_frames):
+                ret, _frame = camera.read()
+                if not ret:
+                    break
+                time.sleep(analysis_ms / 1000.0)
+                camera.analyzed(camera.capture_ts)
+        finally:
+            camera.release()
+        print(f"[BENCH] buffersize={buffersize}: {camera.summary_line()}")
+
+
+def synthetic_ear_series(num_frames: int, fps: float = 60.0, seed: int = 0):
+    """60 FPS EAR samples with ~15 blinks/min (100-300 ms) and a drowsy last third."""
+    rng = random.Random(seed)
+    ts, ears, blinks = [], [], 0
+    closed_until = -1.0
+    for i in range(num_frames):
+        t = i / fps
+        drowsy = i > num_frames * 2 // 3
+        if t > closed_until:
+            if rng.random() < (15 / 60) / fps:
+                closed_until = t + rng.uniform(0.1, 0.3)
+                blinks += 1
+            elif drowsy and rng.random() < (4 / 60) / fps:
+                closed_until = t + rng.uniform(1.0, 3.0)
+        ts.append(t)
+        ears.append(rng.gauss(0.07, 0.01) if t <= closed_until else rng.gauss(0.30, 0.015))
+    return ts, ears, blinks
+
+
+def run_drowsiness(trace_path: str | None, num_frames: int, fps: float = 60.0):
+    """Per-frame cost of DrowsinessAnalyzer and of a full engine step, against a 60 FPS budget."""
+    if trace_path:
+        header, events = mif.read_session_trace(trace_path)
+        obs = [e.data for e in events if e.kind == "observation"][:num_frames]
+        ts = [o.ts for o in obs]
+        ears = [o.ear if o.face_present else None for o in obs]
+        baseline, injected = header["open_ear_baseline"], None
+    else:
+        num_frames = max(num_frames, int(10 * 60 * fps))  # at least 10 minutes
+        ts, ears, injected = synthetic_ear_series(num_frames, fps)
+        baseline = 0.30
+    budget_us = 1e6 / fps
+
+    analyzer = mif.DrowsinessAnalyzer()
+    threshold = baseline * 0.5
+    start = time.perf_counter()
+    for t, ear in zip(ts, ears):
+        analyzer.update(t, ear, threshold)
+    per_frame = (time.perf_counter() - start) / len(ts) * 1e6
+    summary = analyzer.summary()
+    print(f"[BENCH] {len(ts)} frames, analyzer: {per_frame:.2f} us/frame "
+          f"({per_frame / budget_us:.3%} of a {fps:.0f} FPS frame)")
+    print(f"[BENCH] blinks {summary['blinks']}" + (f" (injected {injected})" if injected is not None else "")
+          + f", {summary['blink_rate']:.1f}/min, mean {summary['mean_blink_ms'] or 0:.0f} ms, "
+          f"PERCLOS {summary['perclos']:.3f} (peak {summary['peak_perclos']:.3f}), "
+          f"{summary['long_closures']} long closures")
+
+    engine = mif.SessionEngine(ts[0], 10_000, baseline)
+    events = [mif.SessionEvent(t, "observation", mif.VisionResult(i, t, ear is not None, ear, None, None))
+              for i, (t, ear) in enumerate(zip(ts, ears))]
+    start = time.perf_counter()
+    for event in events:
+        engine.step(event)
+    per_frame = (time.perf_counter() - start) / len(events) * 1e6
+    print(f"[BENCH] full engine step: {per_frame:.2f} us/frame ({per_frame / budget_us:.3%} of a frame), "
+          f"avg focus {engine.avg_focus:.1f}")
+
+
+def _face_landmarks(frame):
+    """FaceMesh landmarks of the frame's face, or a synthetic face-sized mesh if none is found."""
+    from mediapipe.framework.formats import landmark_pb2
+
+    with mif.mp_face_mesh.FaceMesh(max_num_faces=1, refine_landmarks=True) as face_mesh:
+        results = face_mesh.process(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
+    if results.multi_face_landmarks:
+        return results.multi_face_landmarks[0], "detected"
+    rng = np.random.default_rng(0)
+    angle = rng.uniform(0, 2 * np.pi, 478)
+    radius = np.sqrt(rng.uniform(0, 1, 478))
+    mesh = landmark_pb2.NormalizedLandmarkList()
+    for a, r in zip(angle, radius):
+        mesh.landmark.add(x=0.5 + 0.15 * r * np.cos(a), y=0.5 + 0.22 * r * np.sin(a), z=0.0)
+    return mesh, "synthetic"
+
+
+def run_render(video_path: str | None, num_frames: int, fps: float = 30.0):
+    """Overlay/preview CPU per analyzed frame for each render mode, on the same frames."""
+    frames = load_frames(video_path, min(num_frames, 120), shape=(480, 640, 3))
+    landmarks, source = _face_landmarks(frames[0])
+    headless = sys.platform.startswith("linux") and not os.environ.get("DISPLAY")
+    if headless:
+        # No window to show: time drawing and compositing, skip the display calls
+        cv2.imshow = lambda *args: None
+        cv2.waitKey = lambda delay=0: -1
+
+    print(f"[BENCH] {num_frames} frames of {frames[0].shape[1]}x{frames[0].shape[0]} analyzed at {fps:.0f} FPS, "
+          f"{source} face mesh" + (", window display excluded (no $DISPLAY)" if headless else ""))
+    work = np.empty_like(frames[0])
+    results = {}
+    for mode, max_fps in (("full", 0.0), ("full", mif.RENDER_FPS), ("minimal", mif.RENDER_FPS),
+                          ("off", mif.RENDER_FPS)):
+        renderer = mif.OverlayRenderer(mode=mode, max_fps=max_fps)
+        cpu = 0.0
+        for i in range(num_frames):
+            now = i / fps
+            np.copyto(work, frames[i % len(frames)])
+            lines = [
+                (f"Face: Yes | EAR: {0.28 + 0.01 * (i % 7):.3f} | Focus: {60 + (i % 40) / 2:.1f}", 0.6, (0, 255, 0)),
+                (f"Session time: {now / 60.0:.1f} min", 0.6, (255, 255, 0)),
+                (f"Energy drinks: {i // 900}", 0.6, (0, 200, 255)) if i >= 900 else None,
+                None,
+                ("Tip: Caffeine peaks about 45 minutes after a drink.", 0.5, (255, 255, 255)),
+            ]
+            start = time.process_time()
+            if renderer.due(now):
+                renderer.render(work, lines, now, face_landmarks=landmarks)
+            cpu += time.process_time() - start
+        label = f"{mode} @ {f'{max_fps:.0f} FPS cap' if max_fps else 'every frame'}"
+        results[label] = cpu / num_frames * 1000.0
+        shown = cpu / renderer.frames_rendered * 1000.0 if renderer.frames_rendered else 0.0
+        print(f"[BENCH] {label:<22}: {results[label]:6.3f} ms/frame analyzed "
+              f"({results[label] / (1000.0 / fps):6.2%} of the frame budget), "
+              f"{renderer.frames_rendered:5d} shown at {shown:.3f} ms each")
+    baseline = next(iter(results.values()))
+    for label, ms in list(results.items())[1:]:
+        print(f"[BENCH] {label:<22}: saves {baseline - ms:.3f} ms/frame ({1 - ms / baseline:.0%}) vs drawing every frame")
+
+
+def main():
+    # name -> (runner, default count)
+    commands = {"workers": (run_workers, 300), "frames": (run_frames, 300), "replay": (run_replay, 100),
+                "camera": (run_camera, 300), "drowsiness": (run_drowsiness, 36000),
+                "render": (run_render, 900)}
+    if len(sys.argv) < 2 or sys.argv[1] not in commands:
+        print(__doc__)
+        return
+    run, default_count = commands[sys.argv[1]]
+    path = sys.argv[2] if len(sys.argv) > 2 else None
+    count = int(sys.argv[3]) if len(sys.argv) > 3 else default_count
+    run(path, count)
+
+
+if __name__ == "__main__":
+    main()
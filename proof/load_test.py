@@ -0,0 +1,197 @@
+"""
+Load test for the network paths taken when sessions end: Firebase sign-in,
+saving the session and test, and quiz generation.
+
+Simulated students run that flow at the same moment (think: the end of a
+class period) against the local stubs from stub_servers.py, with injected
+latency and error rates. Reports throughput, per-call latency percentiles,
+failures, retries and quiz fallbacks to the offline generator.
+
+Usage:
+    python load_test.py [--users 200] [--concurrency 200]
+                        [--latency 0.05] [--jitter 0.1] [--error-rate 0.05]
+                        [--llm-latency 0.8] [--llm-error-rate 0.05] [--verbose]
+
+The last line is machine-readable (LOAD_TEST: {...}) for tracking results
+across changes.
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+import mind_in_focus as mif
+from stub_servers import AuthStub, OpenAIStub, RTDBStub
+
+OPERATIONS = ("sign_in", "save_session", "save_test", "quiz")
+
+NOTES = """
+Photosynthesis converts light energy into chemical energy stored in glucose.
+It takes place in the chloroplasts of plant cells, which contain the green pigment chlorophyll.
+The light-dependent reactions occur in the thylakoid membranes and produce ATP and NADPH.
+The Calvin cycle runs in the stroma and uses ATP and NADPH to fix carbon dioxide into sugars.
+Cellular respiration breaks glucose down in the mitochondria to release usable energy.
+Glycolysis happens in the cytoplasm and splits one glucose molecule into two pyruvate molecules.
+"""
+
+
+class Recorder:
+    """Thread-safe per-operation latency and outcome log."""
+
+    def __init__(self):
+        self.samples = {op: [] for op in OPERATIONS}   # (seconds, ok)
+        self.quiz_sources = {"openai": 0, "local": 0, "none": 0}
+        self._lock = threading.Lock()
+
+    def record(self, op: str, seconds: float, ok: bool):
+        with self._lock:
+            self.samples[op].append((seconds, ok))
+
+    def quiz_source(self, questions):
+        if not questions:
+            source = "none"
+        elif questions[0]["question"].startswith("Fill in the blank"):
+            source = "local"
+        else:
+            source = "openai"
+        with self._lock:
+            self.quiz_sources[source] += 1
+
+
+def timed(recorder: Recorder, op: str, fn, *args):
+    start = time.perf_counter()
+    try:
+        result = fn(*args)
+    except Exception:
+        result = None
+    recorder.record(op, time.perf_counter() - start, bool(result))
+    return result
+
+
+def student_flow(i: int, recorder: Recorder):
+    user = timed(recorder, "sign_in", mif.firebase_sign_in, f"student{i}@example.com", "correct horse")
+    if not user:
+        return
+    now = time.time()
+    timed(recorder, "save_session", mif.firebase_save_session, user, {
+        "reason": "Load test", "category": "Test", "planned_minutes": 50, "actual_minutes": 48.5,
+        "avg_focus_score": 70.0, "energy_drinks": 0, "snacks": 1, "prior_knowledge": 5, "interest": 6,
+        "start_time": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(now - 2910)),
+        "end_time": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(now)),
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(now)),
+    })
+    timed(recorder, "save_test", mif.firebase_save_test, user, {
+        "title": "Biology midterm", "test_datetime": "2030-01-15T09:00:00",
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(now)),
+    })
+    # Unique material per student, so the response cache doesn't hide the load
+    questions = timed(recorder, "quiz", mif.generate_quiz_from_material, f"{NOTES}\nNotes of student {i}.")
+    recorder.quiz_source(questions)
+
+
+def summarize(recorder: Recorder, elapsed: float) -> dict:
+    ops = {}
+    for op, samples in recorder.samples.items():
+        if not samples:
+            continue
+        seconds = np.array([s for s, _ in samples]) * 1000.0
+        ok = sum(1 for _, good in samples if good)
+        ops[op] = {
+            "calls": len(samples),
+            "ok": ok,
+            "failed": len(samples) - ok,
+            "p50_ms": float(np.percentile(seconds, 50)),
+            "p95_ms": float(np.percentile(seconds, 95)),
+            "p99_ms": float(np.percentile(seconds, 99)),
+            "max_ms": float(seconds.max()),
+        }
+    calls = sum(op["calls"] for op in ops.values())
+    return {
+        "elapsed_s": elapsed,
+        "flows_per_s": len(recorder.samples["sign_in"]) / elapsed if elapsed else 0.0,
+        "calls_per_s": calls / elapsed if elapsed else 0.0,
+        "ops": ops,
+        "quiz_sources": dict(recorder.quiz_sources),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=200, help="simulated students")
+    parser.add_argument("--concurrency", type=int, default=200, help="flows in flight at once")
+    parser.add_argument("--latency", type=float, default=0.05, help="Firebase stub latency (s)")
+    parser.add_argument("--jitter", type=float, default=0.1, help="extra uniform latency (s)")
+    parser.add_argument("--error-rate", type=float, default=0.05, help="Firebase stub error fraction")
+    parser.add_argument("--error-status", type=int, default=503, help="status of injected errors")
+    parser.add_argument("--llm-latency", type=float, default=0.8, help="OpenAI stub latency (s)")
+    parser.add_argument("--llm-error-rate", type=float, default=0.05, help="OpenAI stub error fraction")
+    parser.add_argument("--quiz-deadline", type=float, default=mif.QUIZ_DEADLINE,
+                        help="seconds before the quiz falls back to the offline generator")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--verbose", action="store_true", help="show the backend's own output")
+    args = parser.parse_args()
+
+    faults = {"latency": args.latency, "jitter": args.jitter, "error_rate": args.error_rate,
+              "error_status": args.error_status, "seed": args.seed}
+    auth = AuthStub(**faults).start()
+    rtdb = RTDBStub(**faults).start()
+    openai_stub = OpenAIStub(latency=args.llm_latency, jitter=args.llm_latency / 2,
+                             error_rate=args.llm_error_rate, error_status=args.error_status,
+                             seed=args.seed + 1).start()
+
+    mif.FIREBASE_API_KEY = "stub-key"
+    mif.FIREBASE_AUTH_URL = auth.url + "/v1"
+    mif.DB_URL = rtdb.url
+    mif.QUIZ_DEADLINE = args.quiz_deadline
+    # Every real student has their own client and rate budget, so don't throttle the shared one
+    mif.llm = mif.LLMClient("stub-key", base_url=openai_stub.url + "/v1",
+                            rate=1e6, burst=args.users, concurrency=args.users)
+
+    print(f"[LOAD] {args.users} students, {args.concurrency} concurrent; Firebase stubs "
+          f"{args.latency * 1000:.0f}ms + U(0, {args.jitter * 1000:.0f}ms), {args.error_rate:.0%} -> {args.error_status}; "
+          f"OpenAI stub {args.llm_latency * 1000:.0f}ms, {args.llm_error_rate:.0%} errors")
+
+    recorder = Recorder()
+    output = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(io.StringIO())
+    start = time.perf_counter()
+    try:
+        with output, ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+            list(pool.map(lambda i: student_flow(i, recorder), range(args.users)))
+    finally:
+        elapsed = time.perf_counter() - start
+        for stub in (auth, rtdb, openai_stub):
+            stub.stop()
+
+    report = summarize(recorder, elapsed)
+    firebase_calls = sum(report["ops"].get(op, {}).get("calls", 0) for op in ("sign_in", "save_session", "save_test"))
+    quiz_metrics = mif.llm.metrics.get("quiz")
+    report["retries"] = {
+        "firebase": auth.requests + rtdb.requests - firebase_calls,
+        "firebase_injected_errors": auth.injected_errors + rtdb.injected_errors,
+        "openai": quiz_metrics.retries if quiz_metrics else 0,
+        "openai_injected_errors": openai_stub.injected_errors,
+    }
+
+    print(f"[LOAD] finished in {elapsed:.2f}s: {report['flows_per_s']:.1f} flows/s, "
+          f"{report['calls_per_s']:.1f} calls/s")
+    print(f"[LOAD] {'call':<13}{'calls':>7}{'ok':>7}{'failed':>8}{'p50':>9}{'p95':>9}{'p99':>9}{'max':>9}")
+    for op, stats in report["ops"].items():
+        print(f"[LOAD] {op:<13}{stats['calls']:>7}{stats['ok']:>7}{stats['failed']:>8}"
+              f"{stats['p50_ms']:>7.0f}ms{stats['p95_ms']:>7.0f}ms{stats['p99_ms']:>7.0f}ms{stats['max_ms']:>7.0f}ms")
+    retries = report["retries"]
+    print(f"[LOAD] retries: firebase {retries['firebase']} (injected errors {retries['firebase_injected_errors']}), "
+          f"openai {retries['openai']} (injected errors {retries['openai_injected_errors']})")
+    sources = report["quiz_sources"]
+    print(f"[LOAD] quizzes: {sources['openai']} from OpenAI, {sources['local']} from the offline fallback, "
+          f"{sources['none']} missing")
+    print("LOAD_TEST:", json.dumps(report))
+
+
+if __name__ == "__main__":
+    main()
@@ -2,15 +2,34 @@ import cv2
 import time
 import math
 import json
+import multiprocessing
 import os
+import queue
+import random
+import re
+import sqlite3
+import sys
 import textwrap
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
 from datetime import datetime, timedelta
 
+import asyncio
+import atexit
+import gc
+import hashlib
+import heapq
 import webbrowser  # <-- added for lofi music
+from collections import deque, namedtuple
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from multiprocessing import shared_memory
 
 import mediapipe as mp
+import numpy as np
 import openai
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 # -----------------------------
 # CONFIG
@@ -18,15 +37,77 @@ import requests
 
 DB_URL = os.getenv("FIREBASE_DB_URL")  # e.g. https://your-project-id.firebaseio.com
 FIREBASE_API_KEY = os.getenv("FIREBASE_API_KEY")
+FIREBASE_AUTH_URL = os.getenv("FIREBASE_AUTH_URL") or "https://identitytoolkit.googleapis.com/v1"
+FIREBASE_TIMEOUT = float(os.getenv("FIREBASE_TIMEOUT") or 10)       # seconds per request
+FIREBASE_MAX_RETRIES = int(os.getenv("FIREBASE_MAX_RETRIES") or 3)
 
 # IMPORTANT: don't hard-code your key; use env var instead.
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY") or ""
 
-client = openai.OpenAI(api_key=OPENAI_API_KEY) if OPENAI_API_KEY else None
+OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL")   # e.g. a local fake server for offline testing
+OPENAI_MODEL = os.getenv("OPENAI_MODEL") or "gpt-4.1-mini"
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT") or 30)          # seconds per request
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES") or 3)
+LLM_RATE = float(os.getenv("LLM_RATE") or 2)                 # sustained requests per second
+LLM_BURST = int(os.getenv("LLM_BURST") or 5)
+LLM_CONCURRENCY = int(os.getenv("LLM_CONCURRENCY") or 4)
+LLM_CACHE_SIZE = int(os.getenv("LLM_CACHE_SIZE") or 128)
+LLM_CACHE_TTL = float(os.getenv("LLM_CACHE_TTL") or 3600)    # seconds
+
+# Quiz generation: "auto" (OpenAI, local fallback), "openai" or "local" (offline, CPU only)
+QUIZ_BACKEND = (os.getenv("QUIZ_BACKEND") or "auto").strip().lower()
+if QUIZ_BACKEND not in ("auto", "openai", "local"):
+    print(f"[QUIZ] Unknown QUIZ_BACKEND '{QUIZ_BACKEND}', using 'auto'.")
+    QUIZ_BACKEND = "auto"
+QUIZ_DEADLINE = float(os.getenv("QUIZ_DEADLINE") or 20)  # seconds to wait for OpenAI in "auto" mode
+
+# Local state (calibration profiles, caches) lives here
+LOCAL_DATA_DIR = os.getenv("MIND_IN_FOCUS_HOME") or os.path.join(os.path.expanduser("~"), ".mind_in_focus")
 
 NO_FACE_TIMEOUT = 20 * 60      # 20 minutes (seconds)
 EYES_CLOSED_TIMEOUT = 5 * 60   # 5 minutes (seconds)
 
+# Overlay rendering: "off" (headless), "minimal" (text only) or "full" (text + face mesh)
+RENDER_MODE = (os.getenv("RENDER_MODE") or "full").strip().lower()
+if RENDER_MODE not in ("off", "minimal", "full"):
+    print(f"[RENDER] Unknown RENDER_MODE '{RENDER_MODE}', using 'full'.")
+    RENDER_MODE = "full"
+RENDER_FPS = float(os.getenv("RENDER_FPS") or 15)  # display rate cap, independent of analysis
+
+# Live stream for the desktop UI (server-sent events on 127.0.0.1); STREAM_PORT=0 disables it
+STREAM_PORT = int(os.getenv("STREAM_PORT", "8765") or 0)
+# Browser origins allowed to read the stream (the desktop UI; Vite dev server by default)
+STREAM_ORIGINS = {o.strip() for o in (os.getenv("STREAM_ORIGINS")
+                                       or "http://localhost:3000,http://127.0.0.1:3000").split(",") if o.strip()}
+STREAM_HZ = float(os.getenv("STREAM_HZ") or 10)     # max state updates per second per client
+
+# Camera capture: device index (or a video file / stream URL) and the format to negotiate
+CAMERA_SOURCE = os.getenv("CAMERA_SOURCE") or "0"
+CAMERA_BACKEND = (os.getenv("CAMERA_BACKEND") or "auto").strip().lower()  # auto / v4l2 / gstreamer
+CAMERA_WIDTH = int(os.getenv("CAMERA_WIDTH") or 640)
+CAMERA_HEIGHT = int(os.getenv("CAMERA_HEIGHT") or 480)
+CAMERA_FPS = float(os.getenv("CAMERA_FPS") or 30)
+CAMERA_FOURCC = os.getenv("CAMERA_FOURCC", "MJPG")        # "" keeps the driver's pixel format
+CAMERA_BUFFERSIZE = int(os.getenv("CAMERA_BUFFERSIZE") or 1)  # driver-side queue; 1 = freshest frame
+CAMERA_GST_DECODER = os.getenv("CAMERA_GST_DECODER") or "jpegdec"  # e.g. vaapijpegdec, v4l2jpegdec, nvjpegdec
+CAMERA_GST_PIPELINE = os.getenv("CAMERA_GST_PIPELINE")    # full custom pipeline ending in appsink
+
+# Vision analysis in worker processes (0 = analyze inside the session loop)
+VISION_WORKERS = int(os.getenv("VISION_WORKERS") or 0)
+DETECT_EVERY_N_FRAMES = 15
+
+# Crash safety: in-progress sessions are journaled here and recovered on the next launch
+CHECKPOINT_DIR = os.path.join(LOCAL_DATA_DIR, "sessions")
+CHECKPOINT_SEC = float(os.getenv("CHECKPOINT_SEC") or 15)
+
+# Record every session's event stream (JSONL) here for replay; disabled when unset
+SESSION_TRACE_DIR = os.getenv("SESSION_TRACE_DIR")
+
+# Hot-path instrumentation (off by default; near-zero cost when off)
+PROFILE_ENABLED = (os.getenv("PROFILE") or "").strip().lower() in ("1", "true", "yes", "on")
+PROFILE_TRACE = os.getenv("PROFILE_TRACE")  # optional Chrome-trace/Perfetto JSON output path
+PROFILE_SUMMARY_SEC = float(os.getenv("PROFILE_SUMMARY_SEC") or 30)
+
 # YOLO-related: we’ll try to import it safely
 try:
     from ultralytics import YOLO
@@ -48,10 +129,682 @@ if YOLO_AVAILABLE:
         YOLO_AVAILABLE = False
 
 
+# -----------------------------
+# PROFILING
+# -----------------------------
+
+class _NoopSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NOOP_SPAN = _NoopSpan()
+
+
+class _Span:
+    __slots__ = ("profiler", "name", "start")
+
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc):
+        self.profiler.record(self.name, self.start, time.perf_counter_ns())
+        return False
+
+
+class Histogram:
+    """
+    Log2-bucketed latency histogram (microsecond resolution).
+    Recording is O(1); percentiles are approximate (bucket upper bound).
+    """
+
+    BUCKETS = 32
+
+    def __init__(self):
+        self.counts = [0] * self.BUCKETS
+        self.count = 0
+        self.total_us = 0
+        self.max_us = 0
+
+    def add(self, us: int):
+        self.counts[min(us.bit_length(), self.BUCKETS - 1)] += 1
+        self.count += 1
+        self.total_us += us
+        if us > self.max_us:
+            self.max_us = us
+
+    def percentile(self, q: float) -> int:
+        target = q * self.count
+        seen = 0
+        for bucket, n in enumerate(self.counts):
+            seen += n
+            if n and seen >= target:
+                return min(1 << bucket, self.max_us)
+        return self.max_us
+
+
+class Profiler:
+    """
+    Named spans around hot-path stages, feeding per-name histograms.
+
+    Usage:
+        with profiler.span("facemesh"):
+            results = face_mesh.process(rgb)
+
+    When disabled, span() returns a shared no-op context manager, so the cost
+    is one attribute check per span. When enabled, spans can also be written
+    as Chrome-trace JSON (open in chrome://tracing or ui.perfetto.dev), and a
+    summary line is printed every `summary_every` seconds via maybe_report().
+    """
+
+    MAX_TRACE_EVENTS = 1_000_000
+
+    def __init__(self, enabled: bool = False, trace_path: str | None = None, summary_every: float = 30.0):
+        self.enabled = enabled
+        self.trace_path = trace_path if enabled else None
+        self.summary_every = summary_every
+        self.histograms = {}
+        self._trace = []
+        self._lock = threading.Lock()
+        self._last_report = time.time()
+        self._pid = os.getpid()
+
+    def span(self, name: str):
+        if not self.enabled:
+            return _NOOP_SPAN
+        return _Span(self, name)
+
+    def record(self, name: str, start_ns: int, end_ns: int):
+        dur_us = (end_ns - start_ns) // 1000
+        with self._lock:
+            hist = self.histograms.get(name)
+            if hist is None:
+                hist = self.histograms[name] = Histogram()
+            hist.add(dur_us)
+            if self.trace_path and len(self._trace) < self.MAX_TRACE_EVENTS:
+                self._trace.append({
+                    "name": name,
+                    "ph": "X",
+                    "ts": start_ns // 1000,
+                    "dur": dur_us,
+                    "pid": self._pid,
+                    "tid": threading.get_ident(),
+                })
+
+    def summary_line(self) -> str:
+        with self._lock:
+            parts = []
+            for name, hist in sorted(self.histograms.items()):
+                if not hist.count:
+                    continue
+                mean_ms = hist.total_us / hist.count / 1000.0
+                parts.append(
+                    f"{name} n={hist.count} mean={mean_ms:.2f}ms "
+                    f"p50={hist.percentile(0.5) / 1000.0:.2f}ms "
+                    f"p99={hist.percentile(0.99) / 1000.0:.2f}ms "
+                    f"max={hist.max_us / 1000.0:.2f}ms"
+                )
+        return "[PROFILE] " + (" | ".join(parts) if parts else "no spans recorded")
+
+    def maybe_report(self, now: float):
+        """Print the summary line if `summary_every` seconds have passed."""
+        if self.enabled and now - self._last_report >= self.summary_every:
+            self._last_report = now
+            print(self.summary_line())
+
+    def export_trace(self):
+        if not self.trace_path:
+            return
+        with self._lock:
+            events = list(self._trace)
+        try:
+            with open(self.trace_path, "w", encoding="utf-8") as f:
+                json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+            print(f"[PROFILE] Wrote {len(events)} trace events to {self.trace_path}")
+        except OSError as e:
+            print(f"[PROFILE] Could not write trace file: {e}")
+
+
+profiler = Profiler(PROFILE_ENABLED, PROFILE_TRACE, PROFILE_SUMMARY_SEC)
+atexit.register(profiler.export_trace)
+
+
+_gc_starts = {}
+
+
+def _gc_callback(phase, info):
+    if phase == "start":
+        _gc_starts[info["generation"]] = time.perf_counter_ns()
+    else:
+        start = _gc_starts.pop(info["generation"], None)
+        if start is not None:
+            profiler.record(f"gc.gen{info['generation']}", start, time.perf_counter_ns())
+
+
+if profiler.enabled:
+    gc.callbacks.append(_gc_callback)  # GC pauses show up next to the other spans
+
+
+# -----------------------------
+# FRAME BUFFERS
+# -----------------------------
+
+class FrameBuffer:
+    """
+    One reusable capture buffer: `bgr` is filled by cap.read(image=...),
+    `rgb` by cv2.cvtColor(..., dst=...). Returned to its pool when the last
+    holder calls release(). Buffers are used from the session thread only.
+    """
+
+    __slots__ = ("pool", "bgr", "rgb", "refs")
+
+    def __init__(self, pool, shape):
+        self.pool = pool
+        self.bgr = np.empty(shape, dtype=np.uint8)
+        self.rgb = np.empty(shape, dtype=np.uint8)
+        self.refs = 0
+
+    def retain(self):
+        self.refs += 1
+        return self
+
+    def release(self):
+        self.refs -= 1
+        if self.refs == 0:
+            self.pool._recycle(self)
+
+    def to_rgb(self):
+        """Convert bgr into the preallocated rgb buffer and return it."""
+        cv2.cvtColor(self.bgr, cv2.COLOR_BGR2RGB, dst=self.rgb)
+        return self.rgb
+
+
+class FramePool:
+    """
+    Preallocated frame buffers recycled by reference count, so steady-state
+    capture and color conversion allocate nothing per frame.
+    """
+
+    def __init__(self, shape: tuple, size: int = 4):
+        self.shape = tuple(shape)
+        self.allocated = 0
+        self._free = []
+        for _ in range(size):
+            self._free.append(self._new_buffer())
+
+    def _new_buffer(self) -> FrameBuffer:
+        self.allocated += 1
+        return FrameBuffer(self, self.shape)
+
+    def acquire(self) -> FrameBuffer:
+        buf = self._free.pop() if self._free else self._new_buffer()
+        return buf.retain()
+
+    def _recycle(self, buf: FrameBuffer):
+        if buf.bgr.shape == self.shape:
+            self._free.append(buf)
+
+    def resize(self, shape: tuple):
+        """Switch to a new frame size; buffers of the old size are dropped."""
+        self.shape = tuple(shape)
+        self._free.clear()
+
+    def read(self, cap) -> FrameBuffer | None:
+        """
+        Read the next frame from `cap` straight into a pooled buffer.
+        Returns the buffer (caller must release()) or None if the read failed.
+        """
+        buf = self.acquire()
+        ret, frame = cap.read(image=buf.bgr)
+        if not ret:
+            buf.release()
+            return None
+        if frame is not buf.bgr:
+            # The driver delivered another size, so OpenCV allocated a new array
+            buf.release()
+            self.resize(frame.shape)
+            buf = self.acquire()
+            np.copyto(buf.bgr, frame)
+        return buf
+
+
+# -----------------------------
+# CAMERA CAPTURE
+# -----------------------------
+
+class Camera:
+    """
+    cv2.VideoCapture opened with an explicit backend and format.
+
+    Requests FOURCC (MJPG by default, so USB webcams can deliver full frame
+    rate instead of bandwidth-limited raw YUYV), resolution, FPS and a
+    1-frame driver buffer so reads return the newest frame rather than a
+    stale queued one. Backends:
+      - "v4l2": OpenCV's V4L2 backend (Linux)
+      - "gstreamer": v4l2src -> CAMERA_GST_DECODER -> appsink pipeline; pick
+        a hardware JPEG decoder (vaapijpegdec, v4l2jpegdec, nvjpegdec) to
+        move MJPEG decode off the CPU, or pass CAMERA_GST_PIPELINE
+      - "auto": V4L2 for device indexes on Linux, OpenCV's default otherwise
+    Falls back to OpenCV's default backend if the requested one cannot open.
+
+    read(image=...) matches VideoCapture.read, so FramePool.read() and
+    calibration work unchanged. Every read is measured: delivered FPS, time
+    blocked in read(), and - with analyzed() - capture-to-analysis latency.
+    On V4L2 the capture time comes from the driver's buffer timestamp, so
+    that latency includes driver queueing ("glass to analysis").
+    """
+
+    def __init__(self, source: str = CAMERA_SOURCE, backend: str = CAMERA_BACKEND,
+                 width: int = CAMERA_WIDTH, height: int = CAMERA_HEIGHT, fps: float = CAMERA_FPS,
+                 fourcc: str = CAMERA_FOURCC, buffersize: int = CAMERA_BUFFERSIZE,
+                 gst_decoder: str = CAMERA_GST_DECODER, gst_pipeline: str | None = CAMERA_GST_PIPELINE):
+        self.source = int(source) if str(source).isdigit() else source
+        self.width = width
+        self.height = height
+        self.fps = fps
+        self.fourcc = (fourcc or "").strip().upper()
+        self.buffersize = buffersize
+        self.gst_decoder = gst_decoder
+        self.gst_pipeline = gst_pipeline
+        self.backend = self._resolve_backend(backend)
+        self.cap = None
+        self.capture_ts = None        # wall-clock capture time of the last frame
+        self.driver_timestamps = False
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.frames = 0
+        self.read_wait = Histogram()  # us blocked in read()
+        self.interval = Histogram()   # us between delivered frames
+        self.latency = Histogram()    # us from capture to analyzed()
+        self._first_read = None
+        self._last_read = None
+
+    def _resolve_backend(self, backend: str) -> str:
+        if backend not in ("auto", "v4l2", "gstreamer"):
+            print(f"[CAMERA] Unknown CAMERA_BACKEND '{backend}', using 'auto'.")
+            backend = "auto"
+        if backend == "auto":
+            if self.gst_pipeline:
+                return "gstreamer"
+            return "v4l2" if sys.platform.startswith("linux") and isinstance(self.source, int) else "any"
+        if backend == "gstreamer" and not cv2.videoio_registry.hasBackend(cv2.CAP_GSTREAMER):
+            print("[CAMERA] This OpenCV build has no GStreamer support; using the default backend.")
+            return "any"
+        return backend
+
+    def gst_pipeline_string(self) -> str:
+        if self.gst_pipeline:
+            return self.gst_pipeline
+        device = f"/dev/video{self.source}" if isinstance(self.source, int) else self.source
+        rate = f"{int(round(self.fps))}/1"
+        if self.fourcc == "MJPG":
+            caps = f"image/jpeg,width={self.width},height={self.height},framerate={rate} ! {self.gst_decoder}"
+        else:
+            caps = f"video/x-raw,width={self.width},height={self.height},framerate={rate}"
+        return (f"v4l2src device={device} ! {caps} ! videoconvert ! video/x-raw,format=BGR ! "
+                f"appsink drop=true max-buffers={max(self.buffersize, 1)} sync=false")
+
+    def open(self) -> bool:
+        if self.backend == "gstreamer":
+            self.cap = cv2.VideoCapture(self.gst_pipeline_string(), cv2.CAP_GSTREAMER)
+        elif self.backend == "v4l2":
+            self.cap = cv2.VideoCapture(self.source, cv2.CAP_V4L2)
+        else:
+            self.cap = cv2.VideoCapture(self.source)
+        if not self.cap.isOpened() and self.backend != "any":
+            print(f"[CAMERA] Could not open {self.source} with {self.backend}; trying the default backend.")
+            self.backend = "any"
+            self.cap = cv2.VideoCapture(self.source)
+        if not self.cap.isOpened():
+            return False
+
+        if self.backend != "gstreamer" and isinstance(self.source, int):  # pipelines and files fix their own format
+            # FOURCC first: on V4L2 it decides which sizes and rates are available
+            if self.fourcc:
+                self.cap.set(cv2.CAP_PROP_FOURCC, cv2.VideoWriter_fourcc(*self.fourcc))
+            self.cap.set(cv2.CAP_PROP_FRAME_WIDTH, self.width)
+            self.cap.set(cv2.CAP_PROP_FRAME_HEIGHT, self.height)
+            self.cap.set(cv2.CAP_PROP_FPS, self.fps)
+            self.cap.set(cv2.CAP_PROP_BUFFERSIZE, self.buffersize)
+        print(f"[CAMERA] {self.describe()}")
+        return True
+
+    def describe(self) -> str:
+        code = int(self.get(cv2.CAP_PROP_FOURCC))
+        fourcc = "".join(chr((code >> (8 * i)) & 0xFF) for i in range(4)).strip("\0 ") or "?"
+        return (f"{self.source} via {self.cap.getBackendName()}: "
+                f"{int(self.get(cv2.CAP_PROP_FRAME_WIDTH))}x{int(self.get(cv2.CAP_PROP_FRAME_HEIGHT))} "
+                f"{fourcc} @ {self.get(cv2.CAP_PROP_FPS):.1f} FPS "
+                f"(requested {self.width}x{self.height} {self.fourcc or 'driver default'} @ {self.fps:.1f}), "
+                f"buffer={int(self.get(cv2.CAP_PROP_BUFFERSIZE))}")
+
+    def isOpened(self) -> bool:
+        return self.cap is not None and self.cap.isOpened()
+
+    def get(self, prop: int) -> float:
+        return self.cap.get(prop)
+
+    def set(self, prop: int, value) -> bool:
+        return self.cap.set(prop, value)
+
+    def read(self, image=None):
+        start = time.perf_counter_ns()
+        ret, frame = self.cap.read(image=image)
+        end = time.perf_counter_ns()
+        if not ret:
+            return ret, frame
+
+        self.read_wait.add((end - start) // 1000)
+        if profiler.enabled:
+            profiler.record("capture.read", start, end)
+        if self._last_read is not None:
+            self.interval.add((end - self._last_read) // 1000)
+        else:
+            self._first_read = end
+        self._last_read = end
+        self.frames += 1
+
+        wall = time.time()
+        self.capture_ts = wall
+        if self.backend == "v4l2":
+            # V4L2 buffer timestamps are CLOCK_MONOTONIC milliseconds
+            age = time.monotonic() - self.cap.get(cv2.CAP_PROP_POS_MSEC) / 1000.0
+            self.driver_timestamps = 0.0 <= age < 5.0
+            if self.driver_timestamps:
+                self.capture_ts = wall - age
+        return ret, frame
+
+    def analyzed(self, capture_ts: float, now: float | None = None):
+        """Record that the frame captured at capture_ts has been analyzed."""
+        now = time.time() if now is None else now
+        self.latency.add(max(0, int((now - capture_ts) * 1_000_000)))
+
+    def delivered_fps(self) -> float:
+        if self.frames < 2:
+            return 0.0
+        return (self.frames - 1) / ((self._last_read - self._first_read) / 1e9)
+
+    def summary_line(self) -> str:
+        if not self.frames:
+            return "[CAMERA] no frames"
+        line = (f"[CAMERA] delivered {self.delivered_fps():.1f} FPS (requested {self.fps:.0f}), "
+                f"interval p50 {self.interval.percentile(0.5) / 1000:.0f}ms p99 {self.interval.percentile(0.99) / 1000:.0f}ms, "
+                f"read wait mean {self.read_wait.total_us / self.read_wait.count / 1000:.1f}ms")
+        if self.latency.count:
+            source = "driver timestamps" if self.driver_timestamps else "read return"
+            line += (f", capture-to-analysis p50 {self.latency.percentile(0.5) / 1000:.0f}ms "
+                     f"p99 {self.latency.percentile(0.99) / 1000:.0f}ms ({source})")
+        return line
+
+    def release(self):
+        if self.cap is not None:
+            self.cap.release()
+
+
+# -----------------------------
+# LLM ACCESS LAYER
+# -----------------------------
+
+class TokenBucket:
+    """Async token-bucket rate limiter: `rate` tokens/second, bursts up to `capacity`."""
+
+    def __init__(self, rate: float, capacity: int):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+
+    async def acquire(self):
+        while True:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1.0:
+                self.tokens -= 1.0
+                return
+            await asyncio.sleep((1.0 - self.tokens) / self.rate)
+
+
+class TTLCache:
+    """Small LRU cache whose entries also expire after `ttl` seconds."""
+
+    def __init__(self, max_size: int, ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._data = {}  # key -> (expires_at, value); dicts keep insertion order for LRU
+
+    def get(self, key):
+        entry = self._data.pop(key, None)
+        if entry is None or entry[0] < time.monotonic():
+            return None
+        self._data[key] = entry  # move to the most-recently-used end
+        return entry[1]
+
+    def put(self, key, value):
+        self._data.pop(key, None)
+        self._data[key] = (time.monotonic() + self.ttl, value)
+        while len(self._data) > self.max_size:
+            self._data.pop(next(iter(self._data)))
+
+
+class LLMMetrics:
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.retries = 0
+        self.cache_hits = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.latency = Histogram()
+
+
+class LLMClient:
+    """
+    Shared access to the chat-completions API.
+
+    Requests run on one background asyncio loop with an AsyncOpenAI client:
+    per-request timeout, a token-bucket rate limit plus a concurrency cap,
+    retries with full-jitter exponential backoff on timeouts, connection
+    errors, 429s and 5xx, and an LRU/TTL response cache. Latency and token
+    usage are tracked per call name. Point base_url at a local fake server
+    (see stub_servers.OpenAIStub) to run everything offline.
+
+    complete() is the blocking entry point for regular code; acomplete() and
+    complete_many() are for callers that want concurrency.
+    """
+
+    RETRYABLE = (openai.APITimeoutError, openai.APIConnectionError,
+                 openai.RateLimitError, openai.InternalServerError)
+
+    def __init__(self, api_key: str, base_url: str | None = None, model: str = OPENAI_MODEL,
+                 timeout: float = LLM_TIMEOUT, max_retries: int = LLM_MAX_RETRIES,
+                 rate: float = LLM_RATE, burst: int = LLM_BURST, concurrency: int = LLM_CONCURRENCY,
+                 cache_size: int = LLM_CACHE_SIZE, cache_ttl: float = LLM_CACHE_TTL,
+                 backoff_base: float = 0.5, backoff_cap: float = 8.0):
+        self.api_key = api_key
+        self.base_url = base_url
+        self.model = model
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self.cache = TTLCache(cache_size, cache_ttl)
+        self.metrics = {}
+        self._rate = rate
+        self._burst = burst
+        self._concurrency = concurrency
+        self._loop = None
+        self._client = None
+        self._bucket = None
+        self._semaphore = None
+        self._lock = threading.Lock()
+
+    def _ensure_loop(self):
+        with self._lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                threading.Thread(target=self._loop.run_forever, name="llm", daemon=True).start()
+        return self._loop
+
+    def _setup(self):
+        # Runs on the loop thread, so the async primitives bind to that loop
+        if self._client is None:
+            self._client = openai.AsyncOpenAI(api_key=self.api_key, base_url=self.base_url,
+                                              timeout=self.timeout, max_retries=0)
+            self._bucket = TokenBucket(self._rate, self._burst)
+            self._semaphore = asyncio.Semaphore(self._concurrency)
+
+    def _metrics(self, name: str) -> LLMMetrics:
+        m = self.metrics.get(name)
+        if m is None:
+            m = self.metrics[name] = LLMMetrics()
+        return m
+
+    async def acomplete(self, messages: list, max_tokens: int, temperature: float = 0.7,
+                        name: str = "chat", use_cache: bool = True) -> str:
+        """Return the reply text. Raises the last error once retries are exhausted."""
+        self._setup()
+        metrics = self._metrics(name)
+        metrics.calls += 1
+
+        key = None
+        if use_cache:
+            key = hashlib.sha256(json.dumps(
+                [self.model, messages, max_tokens, temperature], sort_keys=True
+            ).encode("utf-8")).hexdigest()
+            cached = self.cache.get(key)
+            if cached is not None:
+                metrics.cache_hits += 1
+                return cached
+
+        attempt = 0
+        while True:
+            await self._bucket.acquire()
+            start = time.perf_counter_ns()
+            try:
+                async with self._semaphore:
+                    resp = await self._client.chat.completions.create(
+                        model=self.model,
+                        messages=messages,
+                        max_tokens=max_tokens,
+                        temperature=temperature,
+                    )
+            except self.RETRYABLE as e:
+                if attempt >= self.max_retries:
+                    metrics.errors += 1
+                    raise
+                delay = random.uniform(0, min(self.backoff_cap, self.backoff_base * 2 ** attempt))
+                attempt += 1
+                metrics.retries += 1
+                print(f"[LLM] {name}: {type(e).__name__}, retry {attempt}/{self.max_retries} in {delay:.1f}s")
+                await asyncio.sleep(delay)
+                continue
+            except Exception:
+                metrics.errors += 1
+                raise
+            finally:
+                end = time.perf_counter_ns()
+                metrics.latency.add((end - start) // 1000)
+                if profiler.enabled:
+                    profiler.record(f"net.openai.{name}", start, end)
+
+            usage = getattr(resp, "usage", None)
+            if usage is not None:
+                metrics.prompt_tokens += usage.prompt_tokens or 0
+                metrics.completion_tokens += usage.completion_tokens or 0
+            text = resp.choices[0].message.content
+            if key is not None:
+                self.cache.put(key, text)
+            return text
+
+    def complete(self, messages: list, max_tokens: int, temperature: float = 0.7,
+                 name: str = "chat", use_cache: bool = True, deadline: float | None = None) -> str:
+        """
+        Blocking wrapper around acomplete(), safe to call from any thread.
+        With a deadline (seconds, retries included) the request is cancelled
+        and concurrent.futures.TimeoutError raised once it runs out (the
+        built-in TimeoutError only from Python 3.11 on).
+        """
+        future = asyncio.run_coroutine_threadsafe(
+            self.acomplete(messages, max_tokens, temperature, name, use_cache), self._ensure_loop()
+        )
+        try:
+            return future.result(timeout=deadline)
+        except FutureTimeoutError:
+            future.cancel()
+            self._metrics(name).errors += 1
+            raise
+
+    def complete_many(self, requests_: list) -> list:
+        """
+        Run several acomplete(**kwargs) requests concurrently (still rate limited).
+        Returns replies in order; failed requests come back as the exception.
+        """
+        async def run_all():
+            return await asyncio.gather(*(self.acomplete(**kw) for kw in requests_), return_exceptions=True)
+
+        return asyncio.run_coroutine_threadsafe(run_all(), self._ensure_loop()).result()
+
+    def summary_line(self) -> str:
+        parts = []
+        for name, m in sorted(self.metrics.items()):
+            mean_ms = m.latency.total_us / m.latency.count / 1000.0 if m.latency.count else 0.0
+            parts.append(
+                f"{name} calls={m.calls} cache_hits={m.cache_hits} retries={m.retries} errors={m.errors} "
+                f"mean={mean_ms:.0f}ms p99={m.latency.percentile(0.99) / 1000.0:.0f}ms "
+                f"tokens={m.prompt_tokens}+{m.completion_tokens}"
+            )
+        return "[LLM] " + (" | ".join(parts) if parts else "no calls")
+
+
+llm = LLMClient(OPENAI_API_KEY, OPENAI_BASE_URL) if OPENAI_API_KEY not in ("", "YOUR_OPENAI_API_KEY_HERE") else None
+if llm is not None and profiler.enabled:
+    atexit.register(lambda: print(llm.summary_line()))
+
+
 # -----------------------------
 # FIREBASE HELPERS
 # -----------------------------
 
+def _make_firebase_http() -> requests.Session:
+    """
+    Pooled keep-alive session for Firebase calls. Retries with exponential
+    backoff only where the request was not processed (connection failures,
+    429, 503), so a retried push cannot store a session twice.
+    """
+    retry = Retry(
+        total=FIREBASE_MAX_RETRIES,
+        connect=FIREBASE_MAX_RETRIES,
+        read=0,
+        status=FIREBASE_MAX_RETRIES,
+        status_forcelist=(429, 503),
+        allowed_methods=None,        # POSTs too: these statuses mean nothing was written
+        backoff_factor=0.3,
+        backoff_jitter=0.2,
+        respect_retry_after_header=True,
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(max_retries=retry, pool_connections=4, pool_maxsize=64)
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+firebase_http = _make_firebase_http()
+
+
 def firebase_sign_in(email: str, password: str) -> dict | None:
     """
     Sign in a user with email/password using Firebase Auth REST API.
@@ -61,7 +814,7 @@ def firebase_sign_in(email: str, password: str) -> dict | None:
         print("[FIREBASE] FIREBASE_API_KEY not set. Cannot sign in.")
         return None
 
-    url = f"https://identitytoolkit.googleapis.com/v1/accounts:signInWithPassword?key={FIREBASE_API_KEY}"
+    url = f"{FIREBASE_AUTH_URL.rstrip('/')}/accounts:signInWithPassword?key={FIREBASE_API_KEY}"
     payload = {
         "email": email,
         "password": password,
@@ -69,7 +822,8 @@ def firebase_sign_in(email: str, password: str) -> dict | None:
     }
 
     try:
-        resp = requests.post(url, json=payload)
+        with profiler.span("net.firebase_sign_in"):
+            resp = firebase_http.post(url, json=payload, timeout=FIREBASE_TIMEOUT)
         if resp.status_code != 200:
             print(f"[FIREBASE] Sign-in failed: {resp.status_code} {resp.text}")
             return None
@@ -84,13 +838,14 @@ def firebase_sign_in(email: str, password: str) -> dict | None:
         return None
 
 
-def firebase_save_session(user: dict, session_data: dict):
+def firebase_save_session(user: dict, session_data: dict) -> bool:
     """
     Save session data under /users/{localId}/sessions in Realtime Database.
+    Returns True if the session was stored.
     """
     if not DB_URL:
         print("[FIREBASE] FIREBASE_DB_URL not set. Skipping save.")
-        return
+        return False
 
     local_id = user["localId"]
     id_token = user["idToken"]
@@ -102,13 +857,16 @@ def firebase_save_session(user: dict, session_data: dict):
     data["email"] = user["email"]
 
     try:
-        resp = requests.post(url, json=data)
+        with profiler.span("net.firebase_save_session"):
+            resp = firebase_http.post(url, json=data, timeout=FIREBASE_TIMEOUT)
         if resp.status_code not in (200, 201):
             print(f"[FIREBASE] Failed to save session: {resp.status_code} {resp.text}")
-        else:
-            print("[FIREBASE] Session saved successfully.")
+            return False
+        print("[FIREBASE] Session saved successfully.")
+        return True
     except Exception as e:
         print(f"[FIREBASE] Error saving session: {e}")
+        return False
 
 
 def firebase_save_test(user: dict, test_data: dict):
@@ -127,7 +885,8 @@ def firebase_save_test(user: dict, test_data: dict):
     data["email"] = user["email"]
 
     try:
-        resp = requests.post(url, json=data)
+        with profiler.span("net.firebase_save_test"):
+            resp = firebase_http.post(url, json=data, timeout=FIREBASE_TIMEOUT)
         if resp.status_code not in (200, 201):
             print(f"[FIREBASE] Failed to save test: {resp.status_code} {resp.text}")
             return None
@@ -139,6 +898,511 @@ def firebase_save_test(user: dict, test_data: dict):
         return None
 
 
+# -----------------------------
+# SESSION HISTORY & ANALYTICS
+# -----------------------------
+
+HISTORY_DB = os.path.join(LOCAL_DATA_DIR, "history.sqlite3")
+SUCCESS_FOCUS_THRESHOLD = 70.0   # a session "succeeds" with avg focus >= this...
+SUCCESS_MIN_COMPLETION = 0.8     # ...and at least this share of the planned minutes
+MIN_SESSIONS_FOR_MODEL = 5
+
+
+class HistoryReplica:
+    """
+    Local SQLite replica of a user's /sessions and /tests.
+
+    sync() only asks Firebase for records created at or after the stored
+    high-water mark (orderBy="created_at"&startAt=...), so each startup
+    downloads new records only. Firebase needs ".indexOn": "created_at" on
+    both nodes for this query; without it, sync falls back to a full
+    download. Sessions are indexed by start_time and category, tests by
+    test_datetime.
+    """
+
+    SCHEMA_VERSION = 2
+    COLLECTIONS = ("sessions", "tests")
+
+    def __init__(self, path: str = HISTORY_DB, db_url: str | None = None):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.db_url = db_url or DB_URL
+        self.db = sqlite3.connect(path)
+        self._migrate()
+
+    def _migrate(self):
+        version = self.db.execute("PRAGMA user_version").fetchone()[0]
+        with self.db:
+            self.db.executescript("""
+                CREATE TABLE IF NOT EXISTS sessions (
+                    user_id    TEXT NOT NULL,
+                    key        TEXT NOT NULL,
+                    created_at TEXT,
+                    data       TEXT NOT NULL,
+                    PRIMARY KEY (user_id, key)
+                );
+                CREATE TABLE IF NOT EXISTS tests (
+                    user_id       TEXT NOT NULL,
+                    key           TEXT NOT NULL,
+                    created_at    TEXT,
+                    test_datetime TEXT,
+                    title         TEXT,
+                    data          TEXT NOT NULL,
+                    PRIMARY KEY (user_id, key)
+                );
+                CREATE TABLE IF NOT EXISTS sync_state (
+                    user_id    TEXT NOT NULL,
+                    collection TEXT NOT NULL,
+                    high_water TEXT,
+                    PRIMARY KEY (user_id, collection)
+                );
+            """)
+            if version < 2:
+                columns = {row[1] for row in self.db.execute("PRAGMA table_info(sessions)")}
+                for column in ("start_time", "category"):
+                    if column not in columns:
+                        self.db.execute(f"ALTER TABLE sessions ADD COLUMN {column} TEXT")
+                self.db.execute("""
+                    UPDATE sessions
+                    SET start_time = json_extract(data, '$.start_time'),
+                        category = json_extract(data, '$.category')
+                """)
+            self.db.executescript(f"""
+                CREATE INDEX IF NOT EXISTS idx_sessions_start ON sessions (user_id, start_time);
+                CREATE INDEX IF NOT EXISTS idx_sessions_category ON sessions (user_id, category, start_time);
+                CREATE INDEX IF NOT EXISTS idx_tests_datetime ON tests (user_id, test_datetime);
+                PRAGMA user_version = {self.SCHEMA_VERSION};
+            """)
+
+    def close(self):
+        self.db.close()
+
+    def _high_water(self, user_id: str, collection: str) -> str | None:
+        row = self.db.execute(
+            "SELECT high_water FROM sync_state WHERE user_id = ? AND collection = ?",
+            (user_id, collection),
+        ).fetchone()
+        return row[0] if row else None
+
+    def _fetch(self, user: dict, collection: str, high_water: str | None) -> dict | None:
+        url = f"{self.db_url.rstrip('/')}/users/{user['localId']}/{collection}.json"
+        params = {"auth": user["idToken"], "orderBy": '"created_at"'}
+        if high_water:
+            params["startAt"] = json.dumps(high_water)
+
+        try:
+            with profiler.span(f"net.firebase_sync_{collection}"):
+                resp = firebase_http.get(url, params=params, timeout=FIREBASE_TIMEOUT)
+                if resp.status_code == 400 and "index" in resp.text.lower():
+                    print(f"[HISTORY] No .indexOn for created_at on {collection}; downloading everything.")
+                    resp = firebase_http.get(url, params={"auth": user["idToken"]}, timeout=FIREBASE_TIMEOUT)
+            if resp.status_code != 200:
+                print(f"[HISTORY] Sync of {collection} failed: {resp.status_code} {resp.text}")
+                return None
+            return resp.json() or {}
+        except Exception as e:
+            print(f"[HISTORY] Error syncing {collection}: {e}")
+            return None
+
+    def sync(self, user: dict, collection: str = "sessions") -> int:
+        """Pull new records of one collection. Returns the number of records received."""
+        if not self.db_url:
+            return 0
+        local_id = user["localId"]
+        high_water = self._high_water(local_id, collection)
+        records = self._fetch(user, collection, high_water)
+        if not records:
+            return 0
+
+        records = {k: v for k, v in records.items() if isinstance(v, dict)}
+        with self.db:
+            # startAt is inclusive, so the boundary record comes back again; the key dedupes it
+            if collection == "sessions":
+                self.db.executemany(
+                    "INSERT OR REPLACE INTO sessions (user_id, key, created_at, start_time, category, data) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    [(local_id, key, rec.get("created_at"), rec.get("start_time"), rec.get("category"),
+                      json.dumps(rec)) for key, rec in records.items()],
+                )
+            else:
+                self.db.executemany(
+                    "INSERT OR REPLACE INTO tests (user_id, key, created_at, test_datetime, title, data) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    [(local_id, key, rec.get("created_at"), rec.get("test_datetime"), rec.get("title"),
+                      json.dumps(rec)) for key, rec in records.items()],
+                )
+            newest = max((rec["created_at"] for rec in records.values() if rec.get("created_at")),
+                         default=high_water)
+            if newest:
+                self.db.execute(
+                    "INSERT OR REPLACE INTO sync_state (user_id, collection, high_water) VALUES (?, ?, ?)",
+                    (local_id, collection, newest),
+                )
+        return len(records)
+
+    def sync_all(self, user: dict) -> dict:
+        return {collection: self.sync(user, collection) for collection in self.COLLECTIONS}
+
+    def sessions(self, user_id: str, since: str | None = None, category: str | None = None) -> list:
+        """Sessions ordered by start_time, optionally from `since` (ISO time) and/or one category."""
+        sql = "SELECT key, data FROM sessions WHERE user_id = ?"
+        args = [user_id]
+        if category is not None:
+            sql += " AND category = ?"
+            args.append(category)
+        if since is not None:
+            sql += " AND start_time >= ?"
+            args.append(since)
+        sql += " ORDER BY start_time"
+        return [dict(json.loads(data), key=key) for key, data in self.db.execute(sql, args)]
+
+    def tests(self, user_id: str, after: str | None = None) -> list:
+        """Tests ordered by test_datetime, optionally only those after `after` (ISO time)."""
+        sql = "SELECT key, data FROM tests WHERE user_id = ?"
+        args = [user_id]
+        if after is not None:
+            sql += " AND test_datetime > ?"
+            args.append(after)
+        sql += " ORDER BY test_datetime"
+        return [dict(json.loads(data), key=key) for key, data in self.db.execute(sql, args)]
+
+
+def _session_columns(records: list) -> dict:
+    """Turn session dicts into NumPy columns (one array per field)."""
+    def number(value, default):
+        # Hand-edited or legacy records can hold strings, lists, NaN...
+        try:
+            value = float(value)
+        except (TypeError, ValueError):
+            return default
+        return value if math.isfinite(value) else default
+
+    def col(name, default=0.0):
+        return np.array([number(r.get(name) or default, default) for r in records], dtype=np.float64)
+
+    hours = []
+    for r in records:
+        try:
+            hours.append(datetime.fromisoformat(r["start_time"]).hour)
+        except (KeyError, TypeError, ValueError):
+            hours.append(-1)
+
+    return {
+        "focus": col("avg_focus_score"),
+        "planned": col("planned_minutes"),
+        "actual": col("actual_minutes"),
+        "drinks": col("energy_drinks"),
+        "prior": col("prior_knowledge", 5),
+        "interest": col("interest", 5),
+        "music": np.array([1.0 if r.get("play_music") else 0.0 for r in records]),
+        "hour": np.array(hours),
+        "category": np.array([r.get("category") or "Other" for r in records]),
+    }
+
+
+def _grouped_focus(labels, codes, focus, minlength) -> dict:
+    counts = np.bincount(codes, minlength=minlength)
+    sums = np.bincount(codes, weights=focus, minlength=minlength)
+    return {
+        label: {"sessions": int(n), "avg_focus": round(float(total / n), 1)}
+        for label, n, total in zip(labels, counts, sums)
+        if n
+    }
+
+
+def compute_session_analytics(records: list) -> dict:
+    """
+    Aggregate focus over session history: by category, time of day,
+    background music, and energy-drink count. Vectorized with NumPy.
+    """
+    if not records:
+        return {"sessions": 0}
+    c = _session_columns(records)
+    focus = c["focus"]
+
+    categories, cat_codes = np.unique(c["category"], return_inverse=True)
+
+    # -1 = unknown, then night (<5), morning (5-11), afternoon (12-16), evening (17-21), night (22+)
+    tod_labels = ["unknown", "night", "morning", "afternoon", "evening", "night"]
+    tod_codes = np.digitize(c["hour"], [0, 5, 12, 17, 22])
+    tod_codes[tod_codes == 5] = 1  # fold late night into night
+
+    drink_codes = np.minimum(c["drinks"], 3).astype(np.int64)
+
+    return {
+        "sessions": len(records),
+        "avg_focus": round(float(focus.mean()), 1),
+        "total_minutes": round(float(c["actual"].sum()), 1),
+        "by_category": _grouped_focus(categories, cat_codes, focus, len(categories)),
+        "by_time_of_day": _grouped_focus(tod_labels[:5], tod_codes, focus, 5),
+        "by_music": _grouped_focus(["off", "on"], c["music"].astype(np.int64), focus, 2),
+        "by_energy_drinks": _grouped_focus(["0", "1", "2", "3+"], drink_codes, focus, 4),
+    }
+
+
+def _success_features(prior, interest, planned, music, drinks):
+    return np.column_stack([
+        np.ones_like(prior),
+        prior / 10.0,
+        interest / 10.0,
+        np.minimum(planned / 150.0, 1.0),
+        music,
+        np.minimum(drinks, 3.0) / 3.0,
+    ])
+
+
+SUCCESS_FEATURES = ["bias", "prior_knowledge", "interest", "planned_time", "music", "energy_drinks"]
+
+
+def fit_success_model(records: list, l2: float = 1.0, iterations: int = 25) -> dict | None:
+    """
+    Fit a logistic regression of session success (see SUCCESS_FOCUS_THRESHOLD)
+    with a few Newton steps. Returns {"weights", "features", "samples",
+    "success_rate"}, or None with too little history.
+    """
+    if len(records) < MIN_SESSIONS_FOR_MODEL:
+        return None
+    c = _session_columns(records)
+    X = _success_features(c["prior"], c["interest"], c["planned"], c["music"], c["drinks"])
+    completion = np.divide(c["actual"], c["planned"], out=np.zeros_like(c["actual"]), where=c["planned"] > 0)
+    y = ((c["focus"] >= SUCCESS_FOCUS_THRESHOLD) & (completion >= SUCCESS_MIN_COMPLETION)).astype(np.float64)
+
+    w = np.zeros(X.shape[1])
+    reg = l2 * np.eye(X.shape[1])
+    reg[0, 0] = 0.0  # don't shrink the intercept
+    for _ in range(iterations):
+        p = 1.0 / (1.0 + np.exp(-(X @ w)))
+        grad = X.T @ (p - y) + reg @ w
+        hess = (X * (p * (1.0 - p))[:, None]).T @ X + reg
+        step = np.linalg.solve(hess, grad)
+        w -= step
+        if np.abs(step).max() < 1e-6:
+            break
+
+    return {
+        "weights": [round(float(v), 4) for v in w],
+        "features": SUCCESS_FEATURES,
+        "samples": len(records),
+        "success_rate": round(float(y.mean()), 3),
+    }
+
+
+def predict_success(model: dict, session_meta: dict) -> float:
+    """Probability (0-1) that a planned session succeeds, from fit_success_model()."""
+    x = _success_features(
+        np.array([float(session_meta["prior_knowledge"])]),
+        np.array([float(session_meta["interest"])]),
+        np.array([float(session_meta["planned_minutes"])]),
+        np.array([1.0 if session_meta.get("play_music") else 0.0]),
+        np.array([0.0]),
+    )[0]
+    return float(1.0 / (1.0 + np.exp(-(x @ np.array(model["weights"])))))
+
+
+def refresh_history_analytics(user: dict) -> dict:
+    """
+    Sync history, then print aggregates and the fitted success model as one
+    ANALYTICS: JSON line for the front-end. Returns the same dict.
+    """
+    replica = HistoryReplica()
+    try:
+        replica.sync_all(user)
+        records = replica.sessions(user["localId"])
+    finally:
+        replica.close()
+
+    with profiler.span("analytics"):
+        analytics = compute_session_analytics(records)
+        analytics["success_model"] = fit_success_model(records)
+    print("ANALYTICS:", json.dumps(analytics))
+    return analytics
+
+
+# -----------------------------
+# TEST REMINDER SCHEDULER
+# -----------------------------
+
+REMINDERS_DB = os.path.join(LOCAL_DATA_DIR, "reminders.sqlite3")
+# (seconds before the test, wording)
+TEST_REMINDER_OFFSETS = [(3600, "about 1 hour"), (600, "about 10 minutes")]
+
+
+class ReminderScheduler:
+    """
+    Persistent scheduler for test reminders.
+
+    Pending reminders live in SQLite (so they survive restarts) and in a
+    min-heap keyed by due time. A single thread sleeps on a condition until
+    the earliest deadline instead of polling; schedule() and cancel() are
+    O(log n) and O(1) (cancelled entries are skipped lazily when popped).
+    callback(reminder: dict) runs on the scheduler thread with keys
+    id, user_id, due_ts, test_ts, message.
+    """
+
+    def __init__(self, callback, path: str = REMINDERS_DB):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.callback = callback
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        with self._db:
+            self._db.executescript("""
+                CREATE TABLE IF NOT EXISTS reminders (
+                    id      TEXT PRIMARY KEY,
+                    user_id TEXT NOT NULL,
+                    due_ts  REAL NOT NULL,
+                    test_ts REAL NOT NULL,
+                    message TEXT NOT NULL,
+                    fired   INTEGER NOT NULL DEFAULT 0
+                );
+                CREATE INDEX IF NOT EXISTS idx_reminders_pending ON reminders (fired, user_id, due_ts);
+            """)
+        self._cond = threading.Condition()
+        self._heap = []          # (due_ts, id)
+        self._pending = {}       # id -> reminder dict
+        self._thread = None
+        self._stopped = False
+
+    def load(self, user_id: str | None = None) -> int:
+        """Load unfired reminders from disk (one user, or all). Returns how many."""
+        sql = "SELECT id, user_id, due_ts, test_ts, message FROM reminders WHERE fired = 0"
+        args = ()
+        if user_id is not None:
+            sql += " AND user_id = ?"
+            args = (user_id,)
+        with self._cond:
+            rows = self._db.execute(sql, args).fetchall()
+            for rid, uid, due_ts, test_ts, message in rows:
+                if rid not in self._pending:
+                    self._pending[rid] = {"id": rid, "user_id": uid, "due_ts": due_ts,
+                                          "test_ts": test_ts, "message": message}
+                    self._heap.append((due_ts, rid))
+            heapq.heapify(self._heap)
+            self._cond.notify()
+        return len(rows)
+
+    def schedule(self, reminder_id: str, user_id: str, due_ts: float, test_ts: float, message: str):
+        """Add one reminder. Re-scheduling an id that already exists (or fired) is a no-op."""
+        self.schedule_many([(reminder_id, user_id, due_ts, test_ts, message)])
+
+    def schedule_many(self, reminders: list):
+        """Add (id, user_id, due_ts, test_ts, message) tuples in one transaction."""
+        with self._cond:
+            earliest = self._heap[0][0] if self._heap else None
+            with self._db:
+                for reminder_id, user_id, due_ts, test_ts, message in reminders:
+                    cur = self._db.execute(
+                        "INSERT OR IGNORE INTO reminders (id, user_id, due_ts, test_ts, message) "
+                        "VALUES (?, ?, ?, ?, ?)",
+                        (reminder_id, user_id, due_ts, test_ts, message),
+                    )
+                    if cur.rowcount == 0 or reminder_id in self._pending:
+                        continue
+                    self._pending[reminder_id] = {"id": reminder_id, "user_id": user_id, "due_ts": due_ts,
+                                                  "test_ts": test_ts, "message": message}
+                    heapq.heappush(self._heap, (due_ts, reminder_id))
+            if self._heap and (earliest is None or self._heap[0][0] < earliest):
+                self._cond.notify()  # new earliest deadline: wake the thread to re-arm
+
+    def schedule_test(self, user_id: str, test_key: str, title: str, test_datetime: datetime):
+        """Schedule the standard reminders before a test."""
+        test_ts = test_datetime.timestamp()
+        self.schedule_many([
+            (f"{user_id}|{test_key}|{offset}", user_id, test_ts - offset, test_ts,
+             f"📅 Reminder: Your test is in {wording} ({title}).")
+            for offset, wording in TEST_REMINDER_OFFSETS
+        ])
+
+    def cancel(self, reminder_id: str):
+        with self._cond:
+            self._pending.pop(reminder_id, None)
+            with self._db:
+                self._db.execute("DELETE FROM reminders WHERE id = ?", (reminder_id,))
+
+    def __len__(self):
+        return len(self._pending)
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="reminders", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        with self._cond:
+            self._stopped = True
+            self._cond.notify()
+        if self._thread is not None:
+            self._thread.join(timeout=2.0)
+
+    def _pop_due(self, now: float) -> list:
+        due = []
+        while self._heap and self._heap[0][0] <= now:
+            due_ts, rid = heapq.heappop(self._heap)
+            reminder = self._pending.get(rid)
+            if reminder is None or reminder["due_ts"] != due_ts:
+                continue  # cancelled, or a stale entry of an id that was cancelled and scheduled again
+            del self._pending[rid]
+            due.append(reminder)
+        if due:
+            with self._db:
+                self._db.executemany("UPDATE reminders SET fired = 1 WHERE id = ?", [(r["id"],) for r in due])
+        return due
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._stopped:
+                    if not self._heap:
+                        self._cond.wait()
+                        continue
+                    delay = self._heap[0][0] - time.time()
+                    if delay <= 0:
+                        break
+                    self._cond.wait(timeout=delay)
+                if self._stopped:
+                    return
+                due = self._pop_due(time.time())
+
+            for reminder in due:
+                if reminder["test_ts"] <= time.time():
+                    continue  # the test already happened (e.g. the app was closed)
+                try:
+                    self.callback(reminder)
+                except Exception as e:
+                    print(f"[REMINDER] Callback error: {e}")
+
+
+_reminder_scheduler = None
+
+
+def get_reminder_scheduler() -> ReminderScheduler:
+    """Process-wide scheduler that delivers reminders through the notification bus."""
+    global _reminder_scheduler
+    if _reminder_scheduler is None:
+        _reminder_scheduler = ReminderScheduler(
+            lambda r: get_notifications().publish("test_reminder", r["message"], user_id=r["user_id"])
+        ).start()
+    return _reminder_scheduler
+
+
+def schedule_saved_test_reminders(user: dict) -> ReminderScheduler:
+    """Load this user's pending reminders and schedule any upcoming tests in the local replica."""
+    scheduler = get_reminder_scheduler()
+    scheduler.load(user["localId"])
+    replica = HistoryReplica()
+    try:
+        upcoming = replica.tests(user["localId"], after=datetime.now().isoformat())
+    finally:
+        replica.close()
+    for test in upcoming:
+        try:
+            test_dt = datetime.fromisoformat(test["test_datetime"])
+        except (KeyError, TypeError, ValueError):
+            continue
+        scheduler.schedule_test(user["localId"], test["key"], test.get("title") or "Your test", test_dt)
+    return scheduler
+
+
 # -----------------------------
 # MEDIAPIPE / EAR HELPERS
 # -----------------------------
@@ -182,22 +1446,35 @@ def compute_ear(landmarks, eye_indices, image_width, image_height):
     return ear
 
 
-def calibrate_open_ear(cap, face_mesh, duration_sec=3):
+CALIBRATION_MIN_SAMPLES = 15    # open-eye EAR samples (~0.5 s) needed for a usable calibration
+
+
+def calibrate_open_ear(cap, face_mesh, duration_sec=3, render_mode=RENDER_MODE, frame_pool=None):
     """
     Ask user to look at camera with eyes open. Collect EAR for a few seconds
-    and compute baseline.
+    and compute baseline. The preview window is skipped when render_mode is "off".
+    Frames are read into `frame_pool` buffers when one is given.
+    Returns (baseline, ok); ok is False when too few samples were collected
+    (no face, or cut short with 'q') and the baseline is only a stand-in.
     """
     print("\nCalibration: Please look at the camera with eyes open for ~3 seconds...")
     ears = []
     start = time.time()
 
     while time.time() - start < duration_sec:
-        ret, frame = cap.read()
-        if not ret:
-            break
+        if frame_pool is not None:
+            buf = frame_pool.read(cap)
+            if buf is None:
+                break
+            frame, rgb = buf.bgr, buf.to_rgb()
+        else:
+            buf = None
+            ret, frame = cap.read()
+            if not ret:
+                break
+            rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
 
         h, w, _ = frame.shape
-        rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
         results = face_mesh.process(rgb)
 
         if results.multi_face_landmarks:
@@ -206,20 +1483,29 @@ def calibrate_open_ear(cap, face_mesh, duration_sec=3):
             if ear is not None:
                 ears.append(ear)
 
-        cv2.putText(frame, "Calibrating... Keep eyes open", (20, 30),
-                    cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 255, 255), 2)
-        cv2.imshow("Mind in Focus", frame)
-        if cv2.waitKey(1) & 0xFF == ord('q'):
+        if render_mode != "off":
+            cv2.putText(frame, "Calibrating... Keep eyes open", (20, 30),
+                        cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 255, 255), 2)
+            cv2.imshow("Mind in Focus", frame)
+            key = cv2.waitKey(1) & 0xFF
+        else:
+            key = -1
+        if buf is not None:
+            buf.release()
+        if key == ord('q'):
             break
 
     if not ears:
         # Fallback default
         print("Calibration failed, using default EAR baseline 0.28")
-        return 0.28
+        return 0.28, False
 
     baseline = sum(ears) / len(ears)
+    if len(ears) < CALIBRATION_MIN_SAMPLES:
+        print(f"Calibration cut short ({len(ears)} samples), using EAR baseline {baseline:.3f} for now")
+        return baseline, False
     print(f"Calibration done. Open-eye EAR baseline: {baseline:.3f}")
-    return baseline
+    return baseline, True
 
 
 def compute_focus_score(ear, face_present, open_ear_baseline, closed_ratio=0.5):
@@ -247,6 +1533,408 @@ def compute_focus_score(ear, face_present, open_ear_baseline, closed_ratio=0.5):
     return ratio * 100.0
 
 
+# -----------------------------
+# DROWSINESS METRICS
+# -----------------------------
+
+DROWSY_WINDOW_SEC = 60          # sliding window for PERCLOS and blink rate
+BLINK_MAX_SEC = 0.5             # longer closures are "long closures" (microsleeps), not blinks
+PERCLOS_ALERT = 0.08            # up to this closed fraction the focus score is not reduced
+PERCLOS_DROWSY = 0.15           # closed 15%+ of the window: drowsy
+DROWSY_ALERT_COOLDOWN = 5 * 60  # seconds between "you look drowsy" notifications
+
+
+class SlidingWindowSums:
+    """
+    Per-channel sums over the last `span` seconds, kept in a ring of
+    `resolution`-second buckets with running totals. add() and reading
+    totals are O(1); advancing clears only the buckets that fell out of the
+    window, so no past samples are ever rescanned.
+    """
+
+    def __init__(self, span: float, channels: int, resolution: float = 1.0):
+        self.span = span
+        self.resolution = resolution
+        self.size = max(1, int(math.ceil(span / resolution)))
+        self.buckets = [[0.0] * channels for _ in range(self.size)]
+        self.totals = [0.0] * channels
+        self._slot = None   # absolute index of the newest bucket
+
+    def advance(self, ts: float):
+        slot = int(ts // self.resolution)
+        if self._slot is None:
+            self._slot = slot
+        elif slot > self._slot:
+            for k in range(1, min(slot - self._slot, self.size) + 1):
+                bucket = self.buckets[(self._slot + k) % self.size]
+                for c, v in enumerate(bucket):
+                    if v:
+                        self.totals[c] -= v
+                        bucket[c] = 0.0
+            self._slot = slot
+
+    def add(self, channel: int, value: float):
+        """Add to the newest bucket (call advance() first)."""
+        self.buckets[self._slot % self.size][channel] += value
+        self.totals[channel] += value
+
+    def total(self, channel: int) -> float:
+        return max(0.0, self.totals[channel])  # running float sums can dip just below 0
+
+
+class DrowsinessAnalyzer:
+    """
+    Streaming blink and eye-closure metrics over the per-frame EAR series.
+
+    Each update() is O(1): eye closures are tracked by a small state machine
+    (with hysteresis, so noise around the threshold isn't counted as several
+    blinks) and windowed values live in SlidingWindowSums. Windowed metrics:
+      perclos        fraction of observed time with the eyes closed (an attribute)
+      blink_rate     blinks per minute of observed time
+      mean_blink_ms  mean blink duration
+      long_closures  closures longer than BLINK_MAX_SEC
+    Session-wide totals are kept for summary().
+    """
+
+    OBSERVED, CLOSED, BLINKS, BLINK_TIME, LONG_CLOSURES = range(5)
+    MIN_OBSERVED_SEC = 10.0   # below this the windowed rates are not meaningful
+
+    def __init__(self, window_sec: float = DROWSY_WINDOW_SEC, blink_max_sec: float = BLINK_MAX_SEC,
+                 max_gap_sec: float = 0.5):
+        self.window = SlidingWindowSums(window_sec, 5)
+        self.blink_max_sec = blink_max_sec
+        self.max_gap_sec = max_gap_sec   # longer gaps between frames are not counted as observed
+        self.closed_since = None
+        self.perclos = 0.0
+        self.peak_perclos = 0.0
+        self.totals = [0.0] * 5
+        self._prev_ts = None
+
+    def _add(self, channel: int, value: float):
+        self.window.add(channel, value)
+        self.totals[channel] += value
+
+    def update(self, ts: float, ear: float | None, closed_threshold: float, reopen_ratio: float = 1.15):
+        """Feed one frame. ear is None when no face (or no eye) was found."""
+        dt = 0.0 if self._prev_ts is None else ts - self._prev_ts
+        self._prev_ts = ts
+        self.window.advance(ts)
+        if ear is None:
+            self.closed_since = None  # lost the face: whatever closure was running is unknown
+            return
+
+        if 0.0 < dt <= self.max_gap_sec:
+            self._add(self.OBSERVED, dt)
+            if self.closed_since is not None:  # the time since the previous frame was spent closed
+                self._add(self.CLOSED, dt)
+
+        if self.closed_since is None:
+            if ear < closed_threshold:
+                self.closed_since = ts
+        elif ear > closed_threshold * reopen_ratio:
+            duration = ts - self.closed_since
+            self.closed_since = None
+            if duration <= self.blink_max_sec:
+                self._add(self.BLINKS, 1.0)
+                self._add(self.BLINK_TIME, duration)
+            else:
+                self._add(self.LONG_CLOSURES, 1.0)
+
+        observed = self.window.total(self.OBSERVED)
+        if observed >= self.MIN_OBSERVED_SEC:
+            self.perclos = self.window.total(self.CLOSED) / observed
+            if observed >= self.window.span / 2 and self.perclos > self.peak_perclos:
+                self.peak_perclos = self.perclos
+        else:
+            self.perclos = 0.0
+
+    def in_blink(self, ts: float) -> bool:
+        """Eyes closed, but not (yet) for longer than a blink."""
+        return self.closed_since is not None and ts - self.closed_since <= self.blink_max_sec
+
+    @property
+    def blink_rate(self) -> float | None:
+        observed = self.window.total(self.OBSERVED)
+        if observed < self.MIN_OBSERVED_SEC:
+            return None
+        return self.window.total(self.BLINKS) * 60.0 / observed
+
+    @property
+    def mean_blink_ms(self) -> float | None:
+        blinks = self.window.total(self.BLINKS)
+        return self.window.total(self.BLINK_TIME) * 1000.0 / blinks if blinks else None
+
+    @property
+    def long_closures(self) -> int:
+        return int(round(self.window.total(self.LONG_CLOSURES)))
+
+    def focus_factor(self) -> float:
+        """1.0 while alert, falling linearly to 0.5 at twice the drowsy PERCLOS."""
+        excess = (self.perclos - PERCLOS_ALERT) / (2 * PERCLOS_DROWSY - PERCLOS_ALERT)
+        return 1.0 - 0.5 * max(0.0, min(1.0, excess))
+
+    def summary(self) -> dict:
+        observed, closed, blinks, blink_time, long_closures = self.totals
+        return {
+            "blinks": int(blinks),
+            "blink_rate": blinks * 60.0 / observed if observed else None,
+            "mean_blink_ms": blink_time * 1000.0 / blinks if blinks else None,
+            "perclos": closed / observed if observed else None,
+            "peak_perclos": self.peak_perclos,
+            "long_closures": int(long_closures),
+        }
+
+
+# -----------------------------
+# OVERLAY RENDERING
+# -----------------------------
+
+OVERLAY_LINE_HEIGHT = 30   # pixels between overlay text baselines
+OVERLAY_LINES = 5          # status, session time, drinks, snacks, tip
+
+
+class OverlayRenderer:
+    """
+    Draws the session overlay and shows the preview window.
+
+    Rendering is decoupled from analysis: the window is refreshed at most
+    max_fps times per second, and not at all in "off" mode. Text lines are
+    rasterized into a cached layer only when their text changes, then copied
+    onto the frame with a single masked copy.
+    """
+
+    def __init__(self, mode=RENDER_MODE, max_fps=RENDER_FPS, window="Mind in Focus - Session"):
+        self.mode = mode
+        self.window = window
+        self.min_interval = 1.0 / max_fps if max_fps > 0 else 0.0
+        self.next_render = 0.0
+        self.frames_rendered = 0
+        self.cpu_seconds = 0.0
+        self._lines = [None] * OVERLAY_LINES
+        self._layer = None
+        self._mask = None
+        self._mesh_spec = mp_drawing.DrawingSpec(thickness=1, circle_radius=1)
+
+    def due(self, now: float) -> bool:
+        """True if a new frame should be shown at time `now`."""
+        # 1 ms of slack: frames at exactly the cap's period must not miss it to float rounding
+        return self.mode != "off" and now >= self.next_render - 1e-3
+
+    def _update_layer(self, width: int, lines: list):
+        band_h = OVERLAY_LINES * OVERLAY_LINE_HEIGHT + 8
+        if self._layer is None or self._layer.shape[1] != width:
+            self._layer = np.zeros((band_h, width, 3), dtype=np.uint8)
+            self._mask = np.zeros((band_h, width), dtype=np.uint8)
+            self._lines = [None] * OVERLAY_LINES
+
+        for slot, line in enumerate(lines):
+            if line == self._lines[slot]:
+                continue
+            self._lines[slot] = line
+
+            top = slot * OVERLAY_LINE_HEIGHT + 8
+            bottom = top + OVERLAY_LINE_HEIGHT
+            self._layer[top:bottom] = 0
+            self._mask[top:bottom] = 0
+            if line is None:
+                continue
+
+            text, scale, color = line
+            origin = (10, (slot + 1) * OVERLAY_LINE_HEIGHT)
+            cv2.putText(self._layer, text, origin, cv2.FONT_HERSHEY_SIMPLEX, scale, color, 2)
+            cv2.putText(self._mask, text, origin, cv2.FONT_HERSHEY_SIMPLEX, scale, 255, 2)
+
+    def render(self, frame, lines: list, now: float, face_landmarks=None) -> int:
+        """
+        Draw `lines` (one (text, scale, color) tuple or None per slot) and the
+        optional face mesh onto `frame`, then show it.
+        Returns the pressed key code, or -1 if nothing was shown/pressed.
+        """
+        if not self.due(now):
+            return -1
+
+        cpu_start = time.process_time()
+        # Pace from the schedule, not the frame that happened to be shown, so camera jitter
+        # doesn't round the rate down; after a stall, start over rather than catch up
+        self.next_render = max(self.next_render, now - self.min_interval) + self.min_interval
+
+        if self.mode == "full" and face_landmarks is not None:
+            mp_drawing.draw_landmarks(
+                frame,
+                face_landmarks,
+                mp_face_mesh.FACEMESH_TESSELATION,
+                landmark_drawing_spec=None,
+                connection_drawing_spec=self._mesh_spec
+            )
+
+        self._update_layer(frame.shape[1], lines)
+        band = frame[:self._layer.shape[0]]
+        cv2.copyTo(self._layer[:band.shape[0]], self._mask[:band.shape[0]], band)
+
+        cv2.imshow(self.window, frame)
+        key = cv2.waitKey(1) & 0xFF
+
+        self.frames_rendered += 1
+        self.cpu_seconds += time.process_time() - cpu_start
+        return key
+
+    def summary(self) -> str:
+        per_frame = (self.cpu_seconds / self.frames_rendered * 1000.0) if self.frames_rendered else 0.0
+        return (f"[RENDER] mode={self.mode}: {self.frames_rendered} frames shown, "
+                f"{self.cpu_seconds:.2f}s CPU ({per_frame:.2f} ms/frame shown)")
+
+
+# -----------------------------
+# CALIBRATION PROFILES
+# -----------------------------
+
+CALIBRATION_FILE = os.path.join(LOCAL_DATA_DIR, "calibration.json")
+EAR_DRIFT_RATIO = 0.25          # relative change of the live baseline that triggers re-calibration
+EAR_MIN_SAMPLES = 300           # ~10 s at 30 FPS before the live estimate is trusted
+
+
+def _read_json_file(path: str, default):
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return default
+    except (OSError, json.JSONDecodeError) as e:
+        print(f"[LOCAL] Could not read {path}: {e}")
+        return default
+
+
+def _write_json_file(path: str, data):
+    """Write JSON atomically (temp file + rename) so a crash never leaves a torn file."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f"{path}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=2)
+    os.replace(tmp, path)
+
+
+def load_calibration_profile(local_id: str, camera_id: str) -> dict | None:
+    """
+    Return the saved calibration profile for this user + camera, or None.
+    Profile keys: open_ear_baseline, needs_recalibration, updated_at.
+    """
+    profiles = _read_json_file(CALIBRATION_FILE, {})
+    return profiles.get(f"{local_id}|{camera_id}")
+
+
+def save_calibration_profile(local_id: str, camera_id: str, baseline: float, needs_recalibration: bool = False):
+    profiles = _read_json_file(CALIBRATION_FILE, {})
+    profiles[f"{local_id}|{camera_id}"] = {
+        "open_ear_baseline": baseline,
+        "needs_recalibration": needs_recalibration,
+        "updated_at": datetime.now().isoformat(),
+    }
+    try:
+        _write_json_file(CALIBRATION_FILE, profiles)
+    except OSError as e:
+        print(f"[CALIBRATION] Could not save profile: {e}")
+
+
+class P2Quantile:
+    """
+    Streaming quantile estimate with the P-square algorithm (Jain & Chlamtac):
+    O(1) memory and time per sample, no history kept.
+    """
+
+    def __init__(self, p: float):
+        self.p = p
+        self.count = 0
+        self._q = []                                   # marker heights
+        self._n = [0, 1, 2, 3, 4]                      # marker positions
+        self._desired = [0, 2 * p, 4 * p, 2 + 2 * p, 4]
+        self._inc = [0, p / 2, p, (1 + p) / 2, 1]
+
+    def add(self, x: float):
+        self.count += 1
+        q, n = self._q, self._n
+        if len(q) < 5:
+            q.append(x)
+            q.sort()
+            return
+
+        if x < q[0]:
+            q[0] = x
+            k = 0
+        elif x >= q[4]:
+            q[4] = x
+            k = 3
+        else:
+            k = 0
+            while x >= q[k + 1]:
+                k += 1
+
+        for i in range(k + 1, 5):
+            n[i] += 1
+        for i in range(5):
+            self._desired[i] += self._inc[i]
+
+        for i in (1, 2, 3):
+            d = self._desired[i] - n[i]
+            if (d >= 1 and n[i + 1] - n[i] > 1) or (d <= -1 and n[i - 1] - n[i] < -1):
+                d = 1 if d > 0 else -1
+                # Piecewise-parabolic prediction, linear fallback
+                qp = q[i] + d / (n[i + 1] - n[i - 1]) * (
+                    (n[i] - n[i - 1] + d) * (q[i + 1] - q[i]) / (n[i + 1] - n[i])
+                    + (n[i + 1] - n[i] - d) * (q[i] - q[i - 1]) / (n[i] - n[i - 1])
+                )
+                if not q[i - 1] < qp < q[i + 1]:
+                    qp = q[i] + d * (q[i + d] - q[i]) / (n[i + d] - n[i])
+                q[i] = qp
+                n[i] += d
+
+    def value(self) -> float | None:
+        if not self._q:
+            return None
+        if len(self._q) < 5:
+            return self._q[min(len(self._q) - 1, int(self.p * len(self._q)))]
+        return self._q[2]
+
+
+class EarBaselineEstimator:
+    """
+    Refines the open-eye EAR baseline online during a session.
+
+    Samples below the current closed threshold (blinks, closed eyes) are
+    ignored; the median of the rest is tracked with P2Quantile. The baseline
+    follows that median slowly, and if it moves more than EAR_DRIFT_RATIO away
+    from the starting baseline the profile is flagged for a fresh calibration.
+    """
+
+    def __init__(self, baseline: float, closed_ratio: float = 0.5, smoothing: float = 0.05):
+        self.initial = baseline
+        self.baseline = baseline
+        self.closed_ratio = closed_ratio
+        self.smoothing = smoothing
+        self.drifted = False
+        self._median = P2Quantile(0.5)
+
+    def update(self, ear: float) -> bool:
+        """Feed one EAR sample. Returns True when the baseline changed."""
+        if ear < self.baseline * self.closed_ratio:
+            return False
+        self._median.add(ear)
+        count = self._median.count
+        if count < EAR_MIN_SAMPLES or count % 30:
+            return False
+
+        estimate = self._median.value()
+        self.baseline += self.smoothing * (estimate - self.baseline)
+        if not self.drifted and abs(estimate - self.initial) > EAR_DRIFT_RATIO * self.initial:
+            self.drifted = True
+            print(f"[CALIBRATION] EAR baseline drifted ({self.initial:.3f} -> {estimate:.3f}); "
+                  "will re-calibrate next session.")
+        return True
+
+    @property
+    def samples(self) -> int:
+        return self._median.count
+
+
 # -----------------------------
 # MUSIC HELPER
 # -----------------------------
@@ -266,70 +1954,575 @@ def start_lofi_music():
 
 
 # -----------------------------
-# YOLO ENERGY DRINK & SNACK DETECTION
+# YOLO ENERGY DRINK & SNACK DETECTION
+# -----------------------------
+
+def detect_items(frame):
+    """
+    Run YOLO on the frame and return (drink_detected, snack_detected).
+    If YOLO is unavailable or errors, returns (False, False).
+    """
+    if not YOLO_AVAILABLE or yolo_model is None:
+        return False, False
+
+    try:
+        with profiler.span("yolo"):
+            results = yolo_model(frame, verbose=False)[0]
+        drink_detected = False
+        snack_detected = False
+
+        for box in results.boxes:
+            cls_id = int(box.cls.item())
+            cls_name = results.names[cls_id]
+            conf = float(box.conf.item())
+            if conf < 0.5:
+                continue
+
+            if cls_name in ENERGY_DRINK_CLASSES:
+                drink_detected = True
+            if cls_name in SNACK_CLASSES:
+                snack_detected = True
+
+        return drink_detected, snack_detected
+    except Exception as e:
+        # Just log and fall back to "no detections" so the app doesn't crash
+        print(f"[YOLO] Error during detection: {e}")
+        return False, False
+
+
+def get_quick_fact_for_energy_drink(drink_count: int) -> str | None:
+    """
+    Use OpenAI to get a short, student-friendly fact about
+    energy drinks & studying. Returns None if API key missing or error.
+    """
+    if llm is None:
+        return None
+
+    try:
+        fact = llm.complete(
+            [
+                {
+                    "role": "user",
+                    "content": (
+                        "Give me one short, student-friendly fact about how energy drinks "
+                        "affect studying, focus, or sleep. 1-2 sentences, no scare tactics, "
+                        "just helpful insight. This is fact number "
+                        f"{drink_count} in a series, avoid repeating earlier tips."
+                    ),
+                }
+            ],
+            max_tokens=60,
+            temperature=0.7,
+            name="quick_fact",
+        )
+        return fact.strip()
+    except Exception as e:
+        print(f"[Quick Fact Error] {e}")
+        return None
+
+
+# -----------------------------
+# VISION WORKERS (MULTIPROCESSING)
+# -----------------------------
+
+VisionResult = namedtuple("VisionResult", "seq ts face_present ear drink snack")
+
+
+class SharedFrameRing:
+    """
+    Fixed number of frame-sized slots in one shared-memory block. Frames are
+    written into a slot and only the slot index crosses the process boundary,
+    so pixel data is never pickled.
+    """
+
+    def __init__(self, shape: tuple, slots: int, name: str | None = None):
+        self.shape = tuple(shape)
+        self.slots = slots
+        size = slots * int(np.prod(self.shape))
+        self.shm = shared_memory.SharedMemory(name=name, create=name is None, size=size)
+        self.frames = np.ndarray((slots,) + self.shape, dtype=np.uint8, buffer=self.shm.buf)
+
+    @property
+    def name(self) -> str:
+        return self.shm.name
+
+    def close(self):
+        del self.frames
+        try:
+            self.shm.close()
+        except BufferError:
+            pass  # a view is still alive; the mapping goes away with the process
+
+    def unlink(self):
+        self.shm.unlink()
+
+
+def _vision_worker(shm_name, shape, slots, tasks, results):
+    """Worker process: FaceMesh + EAR (+ YOLO when asked) on frames from the ring."""
+    ring = SharedFrameRing(shape, slots, name=shm_name)
+    h, w = shape[:2]
+    rgb = np.empty(shape, dtype=np.uint8)
+    try:
+        with mp_face_mesh.FaceMesh(
+            max_num_faces=1,
+            refine_landmarks=True,
+            min_detection_confidence=0.5,
+            min_tracking_confidence=0.5
+        ) as face_mesh:
+            while True:
+                task = tasks.get()
+                if task is None:
+                    break
+                seq, slot, ts, want_detection = task
+                frame = ring.frames[slot]
+
+                cv2.cvtColor(frame, cv2.COLOR_BGR2RGB, dst=rgb)
+                mesh = face_mesh.process(rgb)
+                face_present = bool(mesh.multi_face_landmarks)
+                ear = None
+                if face_present:
+                    ear = compute_ear(mesh.multi_face_landmarks[0].landmark, LEFT_EYE_IDX, w, h)
+
+                drink = snack = None
+                if want_detection:
+                    drink, snack = detect_items(frame)
+                results.put((seq, slot, ts, face_present, ear, drink, snack))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        ring.close()
+
+
+class VisionWorkerPool:
+    """
+    Runs FaceMesh/EAR/YOLO in separate processes to use more than one core.
+
+    submit() copies a frame into a free ring slot and queues its index;
+    results() returns finished VisionResults in submission order. When every
+    slot is busy a non-blocking submit() drops the frame, so the capture loop
+    never waits on the workers.
+
+    A worker that dies is restarted (up to max_restarts times) and the frames
+    still in flight are queued again, since the one it held would otherwise
+    never come back and stall every later result. results() raises
+    RuntimeError when the restarts are used up or the oldest frame has waited
+    longer than result_timeout.
+    """
+
+    def __init__(self, shape: tuple, workers: int, slots_per_worker: int = 2,
+                 max_restarts: int = 3, result_timeout: float = 30.0):
+        # "spawn": forking a process that already runs MediaPipe/torch threads can deadlock or crash
+        self._ctx = multiprocessing.get_context("spawn")
+        self.workers = workers
+        self.max_restarts = max_restarts
+        self.result_timeout = result_timeout
+        self.restarts = 0
+        self.ring = SharedFrameRing(shape, workers * slots_per_worker)
+        self._free = deque(range(self.ring.slots))
+        self._tasks = self._ctx.Queue()
+        self._results = self._ctx.Queue()
+        self._inflight = {}  # seq -> (slot, ts, detect, submitted_at)
+        self._reorder = {}
+        self._next_seq = 0
+        self._next_emit = 0
+        self.dropped = 0
+        self._procs = [self._start_worker(i) for i in range(workers)]
+
+    def _start_worker(self, i: int):
+        proc = self._ctx.Process(
+            target=_vision_worker,
+            args=(self.ring.name, self.ring.shape, self.ring.slots, self._tasks, self._results),
+            name=f"vision-worker-{i}",
+            daemon=True,
+        )
+        proc.start()
+        return proc
+
+    @property
+    def outstanding(self) -> int:
+        return self._next_seq - self._next_emit
+
+    def submit(self, frame, ts: float, detect: bool = False, block: bool = False) -> bool:
+        """Queue a frame for analysis. Returns False if it was dropped (no free slot)."""
+        while not self._free:
+            if not block:
+                self.dropped += 1
+                return False
+            self._collect(block=True)
+            self._check_workers()
+
+        slot = self._free.popleft()
+        np.copyto(self.ring.frames[slot], frame)
+        self._inflight[self._next_seq] = (slot, ts, detect, time.monotonic())
+        self._tasks.put((self._next_seq, slot, ts, detect))
+        self._next_seq += 1
+        return True
+
+    def _collect(self, block: bool):
+        try:
+            item = self._results.get(timeout=1.0) if block else self._results.get_nowait()
+        except queue.Empty:
+            return
+        while True:
+            seq, slot, ts, face_present, ear, drink, snack = item
+            # A frame queued again after a restart can come back twice; the first answer wins
+            if self._inflight.pop(seq, None) is not None:
+                self._free.append(slot)
+                self._reorder[seq] = VisionResult(seq, ts, face_present, ear, drink, snack)
+            try:
+                item = self._results.get_nowait()
+            except queue.Empty:
+                return
+
+    def _check_workers(self):
+        """Restart dead workers and requeue in-flight frames; raise if the pool is stuck."""
+        dead = [i for i, proc in enumerate(self._procs) if not proc.is_alive()]
+        if dead:
+            if self.restarts + len(dead) > self.max_restarts:
+                raise RuntimeError(f"Vision worker processes keep exiting ({self.restarts} restarts).")
+            for i in dead:
+                print(f"[VISION] Worker {i} exited (code {self._procs[i].exitcode}); restarting it.")
+                self._procs[i] = self._start_worker(i)
+                self.restarts += 1
+            # Which frame the dead worker held is unknown, so queue every unanswered one again
+            for seq, (slot, ts, detect, _) in sorted(self._inflight.items()):
+                self._tasks.put((seq, slot, ts, detect))
+            now = time.monotonic()
+            self._inflight = {seq: (slot, ts, detect, now)
+                              for seq, (slot, ts, detect, _) in self._inflight.items()}
+        elif self._next_emit in self._inflight:
+            waited = time.monotonic() - self._inflight[self._next_emit][3]
+            if waited > self.result_timeout:
+                raise RuntimeError(f"No vision result for frame {self._next_emit} after {waited:.0f}s.")
+
+    def results(self, block: bool = False) -> list:
+        """Finished results, in submission order."""
+        self._collect(block=block and self.outstanding > 0)
+        self._check_workers()
+        out = []
+        while self._next_emit in self._reorder:
+            out.append(self._reorder.pop(self._next_emit))
+            self._next_emit += 1
+        return out
+
+    def drain(self) -> list:
+        """Wait for every submitted frame and return the remaining results."""
+        out = []
+        while self.outstanding:
+            out.extend(self.results(block=True))
+        return out
+
+    def close(self):
+        for _ in self._procs:
+            self._tasks.put(None)
+        for proc in self._procs:
+            proc.join(timeout=5.0)
+            if proc.is_alive():
+                proc.terminate()
+        self.ring.close()
+        self.ring.unlink()
+
+
+# -----------------------------
+# SPACED-REPETITION REVIEW QUEUE
+# -----------------------------
+
+REVIEW_DB = os.path.join(LOCAL_DATA_DIR, "review.sqlite3")
+REVIEW_BATCH = 5   # due items asked at the start of a post-session quiz
+DAY_SECONDS = 24 * 3600
+
+
+def sm2_update(quality: int, easiness: float, interval_days: float, repetitions: int):
+    """
+    One SM-2 step. quality is 0-5 (>= 3 means recalled).
+    Returns (easiness, interval_days, repetitions).
+    """
+    if quality >= 3:
+        if repetitions == 0:
+            interval_days = 1.0
+        elif repetitions == 1:
+            interval_days = 6.0
+        else:
+            interval_days = interval_days * easiness
+        repetitions += 1
+    else:
+        repetitions = 0
+        interval_days = 1.0
+    easiness = max(1.3, easiness + 0.1 - (5 - quality) * (0.08 + (5 - quality) * 0.02))
+    return easiness, interval_days, repetitions
+
+
+class ReviewStore:
+    """
+    Persistent review queue of missed quiz questions, scheduled with SM-2.
+
+    Items are indexed by (user_id, due_ts), so pulling the due items for the
+    next session is an index range scan regardless of how many items a user
+    has, and no new questions need to be generated for them.
+    """
+
+    def __init__(self, path: str = REVIEW_DB):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.db = sqlite3.connect(path)
+        with self.db:
+            self.db.executescript("""
+                CREATE TABLE IF NOT EXISTS review_items (
+                    user_id       TEXT NOT NULL,
+                    item_id       TEXT NOT NULL,
+                    topic         TEXT,
+                    question      TEXT NOT NULL,
+                    easiness      REAL NOT NULL DEFAULT 2.5,
+                    interval_days REAL NOT NULL DEFAULT 0,
+                    repetitions   INTEGER NOT NULL DEFAULT 0,
+                    lapses        INTEGER NOT NULL DEFAULT 0,
+                    due_ts        REAL NOT NULL,
+                    PRIMARY KEY (user_id, item_id)
+                );
+                CREATE INDEX IF NOT EXISTS idx_review_due ON review_items (user_id, due_ts);
+            """)
+
+    def close(self):
+        self.db.close()
+
+    @staticmethod
+    def item_id(question: dict) -> str:
+        text = " ".join(question["question"].lower().split())
+        return hashlib.sha1(text.encode("utf-8")).hexdigest()[:16]
+
+    def add_missed(self, user_id: str, question: dict, now: float | None = None):
+        """Record a missed question; known items are reviewed with a failing grade."""
+        now = time.time() if now is None else now
+        item_id = self.item_id(question)
+        with self.db:
+            cur = self.db.execute(
+                "INSERT OR IGNORE INTO review_items (user_id, item_id, topic, question, interval_days, lapses, due_ts) "
+                "VALUES (?, ?, ?, ?, 1, 1, ?)",
+                (user_id, item_id, question.get("topic"), json.dumps(question), now + DAY_SECONDS),
+            )
+        if cur.rowcount == 0:
+            self.review(user_id, item_id, quality=1, now=now)
+
+    def due(self, user_id: str, limit: int = REVIEW_BATCH, now: float | None = None) -> list:
+        """Items due by `now`, most overdue first. Each is the question dict plus item_id."""
+        now = time.time() if now is None else now
+        cur = self.db.execute(
+            "SELECT item_id, question FROM review_items WHERE user_id = ? AND due_ts <= ? "
+            "ORDER BY due_ts LIMIT ?",
+            (user_id, now, limit),
+        )
+        return [dict(json.loads(question), item_id=item_id) for item_id, question in cur]
+
+    def count_due(self, user_id: str, now: float | None = None) -> int:
+        now = time.time() if now is None else now
+        return self.db.execute(
+            "SELECT COUNT(*) FROM review_items WHERE user_id = ? AND due_ts <= ?", (user_id, now)
+        ).fetchone()[0]
+
+    def review(self, user_id: str, item_id: str, quality: int, now: float | None = None):
+        """Apply an SM-2 grade (0-5) to an item and reschedule it."""
+        now = time.time() if now is None else now
+        row = self.db.execute(
+            "SELECT easiness, interval_days, repetitions FROM review_items WHERE user_id = ? AND item_id = ?",
+            (user_id, item_id),
+        ).fetchone()
+        if row is None:
+            return
+        easiness, interval_days, repetitions = sm2_update(quality, *row)
+        with self.db:
+            self.db.execute(
+                "UPDATE review_items SET easiness = ?, interval_days = ?, repetitions = ?, "
+                "lapses = lapses + ?, due_ts = ? WHERE user_id = ? AND item_id = ?",
+                (easiness, interval_days, repetitions, int(quality < 3),
+                 now + interval_days * DAY_SECONDS, user_id, item_id),
+            )
+
+
+# -----------------------------
+# LOCAL QUIZ GENERATOR
 # -----------------------------
 
-def detect_items(frame):
+LOCAL_QUIZ_MAX_CHARS = 60000   # keeps the sentence-similarity matrix small for book-length PDFs
+
+_STOPWORDS = frozenset("""
+a about above after again against all also am an and any are as at be because been before being below
+between both but by can could did do does doing down during each either etc few for from further had has
+have having he her here hers herself him himself his how however i if in into is it its itself just
+like made make many may me might more most much must my myself no nor not now of off on once one only or
+other our ours ourselves out over own same she should so some such than that the their theirs them
+themselves then there these they this those through thus to too two under until up upon use used uses
+using very was way we were what when where which while who whom why will with within without would you
+your yours
+""".split())
+
+_TOKEN_RE = re.compile(r"[A-Za-z][A-Za-z'-]*[A-Za-z]|\d+(?:\.\d+)?")
+
+
+def _split_sentences(text: str) -> list:
+    """Split notes into sentences; blank lines and bullet markers also end a sentence."""
+    sentences = []
+    for block in re.split(r"\n\s*\n|\n\s*(?:[-*\u2022]|\d+[.)])\s+", text):
+        block = " ".join(block.split())
+        for sent in re.split(r"(?<=[.!?])\s+(?=[A-Z0-9\"'(])", block):
+            sent = sent.strip(" -*\u2022")
+            if sent:
+                sentences.append(sent)
+    return sentences
+
+
+def _term_kind(term: str, form: str, seen_lowercase: bool) -> str:
+    """Rough word class so distractors look like the answer (no POS tagger needed)."""
+    if term[0].isdigit():
+        return "number"
+    if any(c.isupper() for c in form[1:]):
+        return "acronym"       # ATP, NADPH, RuBisCO
+    if not seen_lowercase:
+        return "name"          # only ever written capitalized
+    if term.endswith(("ed", "ing")):
+        return "verb"
+    return "word"
+
+
+def _key_terms(sentence: str) -> list:
+    """Lower-cased content words (and multi-digit numbers) in order of appearance."""
+    terms = []
+    for tok in _TOKEN_RE.findall(sentence):
+        low = tok.lower()
+        if low in _STOPWORDS or len(low) < 2 or (len(low) < 3 and not low[0].isdigit()):
+            continue
+        terms.append(low)
+    return terms
+
+
+def _textrank(weights: np.ndarray, damping: float = 0.85, iterations: int = 30) -> np.ndarray:
+    """PageRank over the cosine-similarity graph of the (L2-normalized) sentence rows."""
+    n = weights.shape[0]
+    sim = weights @ weights.T
+    np.fill_diagonal(sim, 0.0)
+    out = sim.sum(axis=1, keepdims=True)
+    trans = np.divide(sim, out, out=np.full_like(sim, 1.0 / n), where=out > 0)
+    scores = np.full(n, 1.0 / n)
+    for _ in range(iterations):
+        scores = (1.0 - damping) / n + damping * (trans.T @ scores)
+    return scores
+
+
+def _number_distractors(answer: str, rng: random.Random) -> list:
+    value = float(answer)
+    is_int = "." not in answer
+    out = []
+    for factor in rng.sample([0.5, 0.75, 1.5, 2.0, 10.0, 0.1], 6):
+        v = value * factor
+        text = str(int(round(v))) if is_int else f"{v:.{len(answer.split('.')[1])}f}"
+        if text != answer and text not in out:
+            out.append(text)
+    return out
+
+
+def generate_local_quiz(material_text: str, num_questions: int = 5):
     """
-    Run YOLO on the frame and return (drink_detected, snack_detected).
-    If YOLO is unavailable or errors, returns (False, False).
+    Build cloze-style multiple-choice questions from the material itself, on
+    the CPU and without network access. Same schema as the OpenAI quiz.
+
+    Sentences are ranked with TextRank over TF-IDF vectors; each chosen
+    sentence loses its highest-weighted key term, and the distractors are
+    other key terms of the same document (numbers get numeric distractors).
+    Output is deterministic for a given text. Returns None if the material
+    is too short to build any question.
     """
-    if not YOLO_AVAILABLE or yolo_model is None:
-        return False, False
-
-    try:
-        results = yolo_model(frame, verbose=False)[0]
-        drink_detected = False
-        snack_detected = False
+    with profiler.span("quiz.local"):
+        text = material_text[:LOCAL_QUIZ_MAX_CHARS]
+        sentences = _split_sentences(text)
+        sent_terms = [_key_terms(s) for s in sentences]
+
+        vocab = {}
+        for terms in sent_terms:
+            for t in terms:
+                vocab.setdefault(t, len(vocab))
+        if len(sentences) < 2 or len(vocab) < 4:
+            print("[QUIZ] Not enough material for an offline quiz.")
+            return None
 
-        for box in results.boxes:
-            cls_id = int(box.cls.item())
-            cls_name = results.names[cls_id]
-            conf = float(box.conf.item())
-            if conf < 0.5:
+        counts = np.zeros((len(sentences), len(vocab)))
+        for i, terms in enumerate(sent_terms):
+            for t in terms:
+                counts[i, vocab[t]] += 1.0
+        df = np.count_nonzero(counts, axis=0)
+        idf = np.log((1.0 + len(sentences)) / (1.0 + df)) + 1.0
+        weights = counts * idf
+        norms = np.linalg.norm(weights, axis=1, keepdims=True)
+        weights = np.divide(weights, norms, out=np.zeros_like(weights), where=norms > 0)
+        rank = _textrank(weights)
+
+        surface, lowercase = {}, set()
+        for tok in _TOKEN_RE.findall(text):
+            low = tok.lower()
+            surface.setdefault(low, tok)
+            if tok == low:
+                lowercase.add(low)
+        kinds = {t: _term_kind(t, surface[t], t in lowercase) for t in vocab}
+        # Keyword score: specific (idf) and repeated (total count); names and
+        # acronyms are usually the facts worth testing, -ed/-ing words rarely
+        boost = {"acronym": 1.5, "name": 1.3, "number": 1.2, "word": 1.0, "verb": 0.3}
+        score = idf * np.log1p(counts.sum(axis=0))
+        for t, j in vocab.items():
+            score[j] *= boost[kinds[t]]
+        by_score = sorted(vocab, key=lambda t: -score[vocab[t]])
+
+        rng = random.Random(int(hashlib.sha256(text.encode("utf-8")).hexdigest()[:16], 16))
+        chosen = []      # (sentence index, question)
+        used_answers = set()
+        for i in np.argsort(-rank, kind="stable"):
+            if len(chosen) >= num_questions:
+                break
+            sentence, terms = sentences[i], set(sent_terms[i])
+            if not 6 <= len(sentence.split()) <= 45 or not terms:
                 continue
+            if any(float(weights[i] @ weights[j]) > 0.8 for j, _ in chosen):
+                continue  # near-duplicate of a sentence already asked about
 
-            if cls_name in ENERGY_DRINK_CLASSES:
-                drink_detected = True
-            if cls_name in SNACK_CLASSES:
-                snack_detected = True
-
-        return drink_detected, snack_detected
-    except Exception as e:
-        # Just log and fall back to "no detections" so the app doesn't crash
-        print(f"[YOLO] Error during detection: {e}")
-        return False, False
-
+            answer = max((t for t in terms if t not in used_answers),
+                         key=lambda t: score[vocab[t]], default=None)
+            if answer is None:
+                continue
+            pattern = re.compile(rf"(?<![\w'-]){re.escape(answer)}(?![\w'-])", re.IGNORECASE)
+            if not pattern.search(sentence):
+                continue
 
-def get_quick_fact_for_energy_drink(drink_count: int) -> str | None:
-    """
-    Use OpenAI to get a short, student-friendly fact about
-    energy drinks & studying. Returns None if API key missing or error.
-    """
-    if not client or OPENAI_API_KEY in (None, "", "YOUR_OPENAI_API_KEY_HERE"):
-        return None
+            kind, stem, plural = kinds[answer], answer.rstrip("s"), answer.endswith("s")
+            candidates = [t for t in by_score if t not in terms and t.rstrip("s") != stem]
+            pool = [t for t in candidates if kinds[t] == kind]
+            if len(pool) < 3 and kind in ("acronym", "name", "word"):
+                pool += [t for t in candidates if kinds[t] in ("acronym", "name", "word") and kinds[t] != kind]
+            # Same singular/plural form first, so the blank doesn't give the answer away
+            pool = sorted(pool[:16], key=lambda t: t.endswith("s") != plural)[:8]
+            if len(pool) >= 3:
+                distractors = [surface[t] for t in rng.sample(pool, 3)]
+            elif kind == "number":
+                distractors = ([surface[t] for t in pool] + _number_distractors(answer, rng))[:3]
+            else:
+                continue
+            if len(distractors) < 3:
+                continue
 
-    try:
-        resp = client.chat.completions.create(
-            model="gpt-4.1-mini",  # or another supported model
-            messages=[
-                {
-                    "role": "user",
-                    "content": (
-                        "Give me one short, student-friendly fact about how energy drinks "
-                        "affect studying, focus, or sleep. 1-2 sentences, no scare tactics, "
-                        "just helpful insight. This is fact number "
-                        f"{drink_count} in a series, avoid repeating earlier tips."
-                    ),
-                }
-            ],
-            max_tokens=60,
-            temperature=0.7,
-        )
-        return resp.choices[0].message.content.strip()
-    except Exception as e:
-        print(f"[Quick Fact Error] {e}")
+            options = distractors + [surface[answer]]
+            rng.shuffle(options)
+            labels = ["A", "B", "C", "D"]
+            blanked = pattern.sub("_____", sentence)
+            excerpt = sentence if len(sentence) <= 140 else sentence[:137] + "..."
+            chosen.append((i, {
+                "question": f"Fill in the blank: {blanked}",
+                "options": dict(zip(labels, options)),
+                "answer": labels[options.index(surface[answer])],
+                "topic": surface[answer],
+                "review_hint": f'Re-read the part of your notes that says: "{excerpt}"',
+            }))
+            used_answers.add(answer)
+
+    if not chosen:
+        print("[QUIZ] Could not build any offline questions from this material.")
         return None
+    chosen.sort(key=lambda item: item[0])  # ask in the order the material presents them
+    return [q for _, q in chosen]
 
 
 # -----------------------------
@@ -389,7 +2582,7 @@ def get_study_material_from_user() -> str | None:
     print("3) Skip quiz for now")
 
     while True:
-        choice = input("Choose an option (1-3): ").strip()
+        choice = console_input("Choose an option (1-3): ").strip()
         if choice in {"1", "2", "3"}:
             break
         print("Please enter 1, 2, or 3.")
@@ -403,7 +2596,7 @@ def get_study_material_from_user() -> str | None:
         print("(Press Enter on an empty line when you're done.)")
         lines = []
         while True:
-            line = input()
+            line = console_input()
             if line.strip() == "":
                 break
             lines.append(line)
@@ -414,7 +2607,7 @@ def get_study_material_from_user() -> str | None:
         return summary
 
     if choice == "2":
-        path = input("Enter the full path to your PDF or text file: ").strip()
+        path = console_input("Enter the full path to your PDF or text file: ").strip()
         content = extract_text_from_file(path)
         if not content:
             print("[QUIZ] Could not read content from file. Skipping quiz.")
@@ -426,9 +2619,14 @@ def get_study_material_from_user() -> str | None:
 
 def generate_quiz_from_material(material_text: str, num_questions: int = 5):
     """
-    Use OpenAI to generate multiple-choice questions (A-D).
+    Generate multiple-choice questions (A-D) from study material.
     Returns a list of question dicts or None on error.
 
+    QUIZ_BACKEND picks the generator: "openai", "local" (offline, see
+    generate_local_quiz) or "auto", which asks OpenAI and falls back to the
+    local generator when there is no key, the request fails or it takes
+    longer than QUIZ_DEADLINE seconds.
+
     Each question dict has:
       - question: str
       - options: { "A": str, "B": str, "C": str, "D": str }
@@ -436,10 +2634,26 @@ def generate_quiz_from_material(material_text: str, num_questions: int = 5):
       - topic: short string about the subtopic
       - review_hint: 1–2 sentence suggestion for review
     """
-    if not client or OPENAI_API_KEY in (None, "", "YOUR_OPENAI_API_KEY_HERE"):
-        print("[QUIZ] OPENAI_API_KEY not set. Cannot generate quiz.")
-        return None
+    if QUIZ_BACKEND == "local":
+        return generate_local_quiz(material_text, num_questions)
+
+    if llm is None:
+        if QUIZ_BACKEND == "openai":
+            print("[QUIZ] OPENAI_API_KEY not set. Cannot generate quiz.")
+            return None
+        print("[QUIZ] OPENAI_API_KEY not set. Using the offline quiz generator.")
+        return generate_local_quiz(material_text, num_questions)
+
+    deadline = QUIZ_DEADLINE if QUIZ_BACKEND == "auto" else None
+    questions = _generate_quiz_openai(material_text, num_questions, deadline)
+    if questions or QUIZ_BACKEND == "openai":
+        return questions
+    print("[QUIZ] Falling back to the offline quiz generator.")
+    return generate_local_quiz(material_text, num_questions)
 
+
+def _generate_quiz_openai(material_text: str, num_questions: int, deadline: float | None = None):
+    """Ask OpenAI for the quiz. Returns the question list or None on any failure."""
     # Trim very long material to keep token usage reasonable
     trimmed = material_text
     max_chars = 4000
@@ -488,16 +2702,16 @@ STUDY MATERIAL:
     """.strip()
 
     try:
-        resp = client.chat.completions.create(
-            model="gpt-4.1-mini",
-            messages=[
+        content = llm.complete(
+            [
                 {"role": "system", "content": system_prompt},
                 {"role": "user", "content": user_prompt},
             ],
             max_tokens=1200,
             temperature=0.7,
+            name="quiz",
+            deadline=deadline,
         )
-        content = resp.choices[0].message.content
         data = json.loads(content)
         questions = data.get("questions", [])
         if not isinstance(questions, list) or not questions:
@@ -522,21 +2736,75 @@ STUDY MATERIAL:
     except json.JSONDecodeError:
         print("[QUIZ] Failed to parse quiz JSON from OpenAI response.")
         return None
+    except FutureTimeoutError:
+        print(f"[QUIZ] OpenAI did not answer within {deadline:g}s.")
+        return None
     except Exception as e:
         print(f"[QUIZ] Error generating quiz: {e}")
         return None
 
 
-def run_post_session_quiz() -> bool:
+def ask_quiz_question(number: int, q: dict) -> bool:
+    """Print one multiple-choice question, read the answer, return True if correct."""
+    print(f"Question {number}:")
+    print(textwrap.fill(q["question"], width=80))
+    print()
+    opts = q["options"]
+    for label in ["A", "B", "C", "D"]:
+        if label in opts:
+            print(f"  {label}. {opts[label]}")
+    print()
+
+    # Get user answer
+    while True:
+        ans = console_input("Your answer (A-D): ").strip().upper()
+        if ans in {"A", "B", "C", "D"}:
+            break
+        print("Please enter A, B, C, or D.")
+
+    correct = q["answer"].strip().upper()
+    if ans == correct:
+        print("✅ Correct!\n")
+        return True
+    print(f"❌ Incorrect. The correct answer is {correct}.")
+    print(f"   {q.get('review_hint', '').strip()}\n")
+    return False
+
+
+def run_due_reviews(user: dict, store: ReviewStore):
+    """Ask the questions that are due for spaced-repetition review, if any."""
+    due = store.due(user["localId"])
+    if not due:
+        return
+    print(f"\n🔁 {len(due)} question(s) from earlier quizzes are due for review.")
+    for i, q in enumerate(due, start=1):
+        recalled = ask_quiz_question(i, q)
+        store.review(user["localId"], q["item_id"], quality=4 if recalled else 1)
+
+
+def run_post_session_quiz(user: dict | None = None) -> bool:
     """
     Full flow:
+    - Review questions due from earlier quizzes (spaced repetition)
     - Ask user how to provide material (summary/file/skip)
     - Generate quiz with OpenAI
     - Ask questions in terminal
-    - Suggest topics to review based on incorrect answers
+    - Suggest topics to review based on incorrect answers, and queue missed
+      questions for spaced-repetition review
     - If score is low, ask if they want to resume a new study session.
     Returns True if user wants to resume, else False.
     """
+    store = ReviewStore() if user else None
+    try:
+        if store:
+            run_due_reviews(user, store)
+        return _run_new_quiz(user, store)
+    finally:
+        if store:
+            store.close()
+
+
+def _run_new_quiz(user: dict | None, store: ReviewStore | None) -> bool:
     material = get_study_material_from_user()
     if not material:
         return False
@@ -553,35 +2821,17 @@ def run_post_session_quiz() -> bool:
     correct_count = 0
 
     for i, q in enumerate(questions, start=1):
-        print(f"Question {i}:")
-        print(textwrap.fill(q["question"], width=80))
-        print()
-        opts = q["options"]
-        for label in ["A", "B", "C", "D"]:
-            if label in opts:
-                print(f"  {label}. {opts[label]}")
-        print()
-
-        # Get user answer
-        while True:
-            ans = input("Your answer (A-D): ").strip().upper()
-            if ans in {"A", "B", "C", "D"}:
-                break
-            print("Please enter A, B, C, or D.")
-
-        correct = q["answer"].strip().upper()
-        if ans == correct:
+        if ask_quiz_question(i, q):
             correct_count += 1
-            print("✅ Correct!\n")
         else:
-            print(f"❌ Incorrect. The correct answer is {correct}.")
-            print(f"   {q.get('review_hint', '').strip()}\n")
             wrong_topics.append(
                 {
                     "topic": q.get("topic", "Unlabeled topic"),
                     "review_hint": q.get("review_hint", "").strip(),
                 }
             )
+            if store:
+                store.add_missed(user["localId"], q)
 
     if total_q == 0:
         return False
@@ -606,35 +2856,859 @@ def run_post_session_quiz() -> bool:
     for item in unique_hints:
         print(f"- {item['topic']}: {item['review_hint']}")
     print()
+    if store:
+        print(f"[REVIEW] {len(wrong_topics)} missed question(s) queued for spaced review; "
+              "they'll come back after your next session.\n")
 
     # If they "failed" (e.g., <70%), offer to resume previous session
     if score < 0.7:
         print(f"Your quiz score was {correct_count}/{total_q} "
               f"({score*100:.0f}%).")
-        choice = input("Do you want to start another focused study session on this same topic now? (y/n): ").strip().lower()
+        choice = console_input("Do you want to start another focused study session on this same topic now? (y/n): ").strip().lower()
         if choice == "y":
             return True
 
     return False
 
 
+# -----------------------------
+# NOTIFICATIONS & CONSOLE INPUT
+# -----------------------------
+
+class ConsoleInput:
+    """
+    Reads stdin on a background thread so the session loop never blocks on input().
+    Lines are queued; poll() returns immediately, readline() waits.
+    """
+
+    def __init__(self):
+        self._lines = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+        self._eof = False
+
+    def _ensure_started(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="stdin-reader", daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        for line in sys.stdin:
+            self._lines.put(line.rstrip("\r\n"))
+        self._lines.put(None)  # EOF marker
+
+    def poll(self) -> str | None:
+        """Return the next typed line, or None if nothing is waiting."""
+        self._ensure_started()
+        if self._eof:
+            return None
+        try:
+            line = self._lines.get_nowait()
+        except queue.Empty:
+            return None
+        if line is None:
+            self._eof = True
+        return line
+
+    def readline(self, prompt: str = "") -> str:
+        """Blocking read of one line, like input()."""
+        self._ensure_started()
+        if prompt:
+            print(prompt, end="", flush=True)
+        if self._eof:
+            raise EOFError
+        line = self._lines.get()
+        if line is None:
+            self._eof = True
+            raise EOFError
+        return line
+
+
+console = ConsoleInput()
+
+
+def console_input(prompt: str = "") -> str:
+    """
+    Drop-in replacement for input(). All terminal input goes through the shared
+    background reader so it never competes with the session loop for stdin.
+    """
+    return console.readline(prompt)
+
+
+class NotificationBus:
+    """
+    Delivers notifications and prompts off the frame loop.
+    publish() only enqueues; a daemon thread prints each event and forwards it
+    to subscribers (e.g. a desktop UI channel).
+    """
+
+    def __init__(self):
+        self._queue = queue.Queue()
+        self._subscribers = []
+        self._thread = threading.Thread(target=self._run, name="notify", daemon=True)
+        self._thread.start()
+
+    def subscribe(self, callback):
+        """callback(event: dict) is called on the notification thread."""
+        self._subscribers.append(callback)
+
+    def publish(self, kind: str, message: str, **data):
+        event = {"type": kind, "message": message, "ts": time.time()}
+        event.update(data)
+        self._queue.put(event)
+
+    def prompt(self, prompt_id: str, message: str):
+        """Ask the user something; the answer arrives later via console.poll()."""
+        self.publish("prompt", message, prompt_id=prompt_id)
+
+    def flush(self):
+        """Wait until every queued event has been delivered."""
+        self._queue.join()
+
+    def _run(self):
+        while True:
+            event = self._queue.get()
+            try:
+                if event["type"] == "prompt":
+                    print(f"\n{event['message']} ", end="", flush=True)
+                else:
+                    print(f"\n[NOTIFY] {event['message']}", flush=True)
+                for callback in list(self._subscribers):
+                    try:
+                        callback(event)
+                    except Exception as e:
+                        print(f"[NOTIFY] Subscriber error: {e}")
+            finally:
+                self._queue.task_done()
+
+
+_notifications = None
+_notifications_lock = threading.Lock()
+
+
+def get_notifications() -> NotificationBus:
+    """The shared NotificationBus, started on first use so importers don't spawn its thread."""
+    global _notifications
+    with _notifications_lock:
+        if _notifications is None:
+            _notifications = NotificationBus()
+        return _notifications
+
+
+# -----------------------------
+# LIVE STREAM (DESKTOP UI IPC)
+# -----------------------------
+
+def _compact_json(obj) -> str:
+    return json.dumps(obj, separators=(",", ":"), ensure_ascii=False)
+
+
+class _StreamSubscriber:
+    def __init__(self, max_events: int):
+        self.events = deque(maxlen=max_events)  # oldest events drop first
+        self.state_seq = 0
+        self.dropped = 0
+
+
+class LiveStream:
+    """
+    Local server-sent-events endpoint (GET /events) pushing live session data.
+
+    Two message types are sent:
+      - "state": latest live state, coalesced. Keys: t=timestamp, f=focus score,
+        e=EAR, p=face present (0/1), c=eyes closed (0/1), d=energy drinks,
+        s=snacks, m=elapsed minutes.
+      - "notify": notification events from the NotificationBus.
+
+    Publishing never touches a socket: state overwrites a single slot and events
+    go into bounded per-client queues. Each client is served by its own thread at
+    most `hz` times per second, so a slow client only drops intermediate states
+    and its oldest events; the vision loop is never blocked.
+    """
+
+    def __init__(self, port: int, hz: float = STREAM_HZ, host: str = "127.0.0.1", max_events: int = 64,
+                 origins: set = STREAM_ORIGINS):
+        self.host = host
+        self.origins = set(origins)
+        self.port = port
+        self.interval = 1.0 / hz if hz > 0 else 0.0
+        self.max_events = max_events
+        self._cond = threading.Condition()
+        self._state = None
+        self._state_seq = 0
+        self._subscribers = set()
+        self._server = None
+        self._closed = False
+
+    def start(self):
+        stream = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?", 1)[0] != "/events":
+                    self.send_error(404)
+                    return
+                # A rebound DNS name makes another site's page same-origin (no Origin header),
+                # but its Host header still names that site
+                if self.headers.get("Host") not in stream.hosts:
+                    self.send_error(403)
+                    return
+                # Browsers send Origin on cross-origin requests; any other page must not read the stream
+                origin = self.headers.get("Origin")
+                if origin is not None and origin not in stream.origins:
+                    self.send_error(403)
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Cache-Control", "no-cache")
+                if origin is not None:
+                    self.send_header("Access-Control-Allow-Origin", origin)
+                    self.send_header("Vary", "Origin")
+                self.end_headers()
+                stream._serve(self.wfile)
+
+            def log_message(self, format, *args):
+                pass  # keep the terminal for session output
+
+        self._server = ThreadingHTTPServer((self.host, self.port), Handler)
+        self._server.daemon_threads = True
+        self.port = self._server.server_address[1]
+        self.hosts = {f"127.0.0.1:{self.port}", f"localhost:{self.port}"}
+        threading.Thread(target=self._server.serve_forever, name="live-stream", daemon=True).start()
+        print(f"[STREAM] Live session stream at http://{self.host}:{self.port}/events")
+
+    def stop(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+
+    def publish_state(self, state: dict):
+        with self._cond:
+            self._state = state
+            self._state_seq += 1
+            self._cond.notify_all()
+
+    def publish_event(self, event: dict):
+        with self._cond:
+            for sub in self._subscribers:
+                if len(sub.events) == sub.events.maxlen:
+                    sub.dropped += 1
+                sub.events.append(event)
+            self._cond.notify_all()
+
+    def _serve(self, wfile):
+        sub = _StreamSubscriber(self.max_events)
+        with self._cond:
+            self._subscribers.add(sub)
+        try:
+            while True:
+                with self._cond:
+                    self._cond.wait_for(
+                        lambda: self._closed or sub.events or sub.state_seq != self._state_seq,
+                        timeout=15.0,
+                    )
+                    if self._closed:
+                        return
+                    events = list(sub.events)
+                    sub.events.clear()
+                    state = None
+                    if sub.state_seq != self._state_seq:
+                        state = self._state
+                        sub.state_seq = self._state_seq
+
+                chunks = [f"event: notify\ndata: {_compact_json(e)}\n\n" for e in events]
+                if state is not None:
+                    chunks.append(f"event: state\ndata: {_compact_json(state)}\n\n")
+                if not chunks:
+                    chunks.append(": keepalive\n\n")
+                wfile.write("".join(chunks).encode("utf-8"))
+                wfile.flush()
+                time.sleep(self.interval)  # anything published meanwhile is coalesced
+        except (BrokenPipeError, ConnectionResetError, OSError):
+            pass
+        finally:
+            with self._cond:
+                self._subscribers.discard(sub)
+
+
+_live_stream = None
+
+
+def get_live_stream() -> LiveStream | None:
+    """Start the live stream on first use unless STREAM_PORT is 0; None if disabled or it failed."""
+    global _live_stream
+    if _live_stream is None and STREAM_PORT:
+        try:
+            stream = LiveStream(STREAM_PORT)
+            stream.start()
+        except OSError as e:
+            print(f"[STREAM] Could not start live stream on port {STREAM_PORT}: {e}")
+            return None
+        get_notifications().subscribe(stream.publish_event)
+        _live_stream = stream
+    return _live_stream
+
+
+# -----------------------------
+# SESSION ENGINE
+# -----------------------------
+
+# kind: "observation" (data: VisionResult), "clock", "input" (console line),
+# "quit" (q pressed in the window), "interrupt" (Ctrl+C), "fact" (quick fact text)
+SessionEvent = namedtuple("SessionEvent", "ts kind data")
+# action: "notify" / "prompt" (NotificationBus), "fetch_fact" (data: drink count)
+SessionEffect = namedtuple("SessionEffect", "action kind message data")
+
+
+class SessionEngine:
+    """
+    The session rules as a deterministic state machine. step() takes one
+    timestamped event and returns the effects to carry out; time comes only
+    from event timestamps, so the same engine runs live, replays a recorded
+    trace faster than real time, or drives many sessions side by side.
+
+    state: "studying" -> "time_up" (waiting for e/x/Enter) -> "extend_minutes"
+    -> "studying"; any state -> "ended", with end_reason saying why.
+    """
+
+    def __init__(self, start_ts: float, planned_minutes: float, open_ear_baseline: float,
+                 no_face_timeout: float = NO_FACE_TIMEOUT, eyes_closed_timeout: float = EYES_CLOSED_TIMEOUT):
+        self.started_at = start_ts   # wall-clock start; start_ts moves past pauses on restore()
+        self.start_ts = start_ts
+        self.last_ts = start_ts
+        self.planned_minutes = planned_minutes
+        self.planned_end_ts = start_ts + planned_minutes * 60
+        self.no_face_timeout = no_face_timeout
+        self.eyes_closed_timeout = eyes_closed_timeout
+        self.ear_estimator = EarBaselineEstimator(open_ear_baseline)
+        self.closed_threshold = open_ear_baseline * 0.5
+
+        self.state = "studying"
+        self.end_reason = None
+        self.face_present = False
+        self.ear = None
+        self.focus_score = 0.0
+        self.focus_total = 0.0
+        self.focus_count = 0
+        self.last_face_seen_ts = start_ts
+        self.eyes_closed_since = None
+        self.drowsiness = DrowsinessAnalyzer()
+        self.energy_drinks = 0
+        self.snacks = 0
+        self.last_quick_fact = None
+        self._open_eye_focus = 0.0
+        self._last_drowsy_alert = None
+        self._drink_prev = False
+        self._snack_prev = False
+        self._time_up_notified = False
+
+    @property
+    def active(self) -> bool:
+        return self.state != "ended"
+
+    @property
+    def open_ear_baseline(self) -> float:
+        return self.ear_estimator.baseline
+
+    @property
+    def avg_focus(self) -> float:
+        return self.focus_total / self.focus_count if self.focus_count else 0.0
+
+    def snapshot(self) -> dict:
+        """The counters needed to resume or finalize this session (see restore())."""
+        return {
+            "started_at": self.started_at,
+            "start_ts": self.start_ts,
+            "last_ts": self.last_ts,
+            "planned_minutes": self.planned_minutes,
+            "planned_end_ts": self.planned_end_ts,
+            "open_ear_baseline": self.ear_estimator.baseline,
+            "focus_total": self.focus_total,
+            "focus_count": self.focus_count,
+            "energy_drinks": self.energy_drinks,
+            "snacks": self.snacks,
+            "last_quick_fact": self.last_quick_fact,
+            "eye_totals": list(self.drowsiness.totals),
+            "peak_perclos": self.drowsiness.peak_perclos,
+            "state": self.state,
+            "end_reason": self.end_reason,
+            "time_up_notified": self._time_up_notified,
+        }
+
+    @classmethod
+    def restore(cls, snap: dict, now: float | None = None) -> "SessionEngine":
+        """
+        Rebuild an engine from snapshot(). With `now`, it carries on from
+        there, leaving the time between the snapshot and now out of the
+        session as if it had been paused. Windowed eye metrics start afresh,
+        and a question left open by the crash (time up / extend) is dropped.
+        """
+        gap = 0.0 if now is None else max(0.0, now - snap["last_ts"])
+        engine = cls(snap["start_ts"] + gap, snap["planned_minutes"], snap["open_ear_baseline"])
+        engine.started_at = snap["started_at"]
+        engine.last_ts = engine.last_face_seen_ts = snap["last_ts"] + gap
+        engine.planned_end_ts = snap["planned_end_ts"] + gap
+        engine.focus_total = snap["focus_total"]
+        engine.focus_count = snap["focus_count"]
+        engine.energy_drinks = snap["energy_drinks"]
+        engine.snacks = snap["snacks"]
+        engine.last_quick_fact = snap["last_quick_fact"]
+        engine.drowsiness.totals = list(snap["eye_totals"])
+        engine.drowsiness.peak_perclos = snap["peak_perclos"]
+        engine.state = "ended" if snap.get("state") == "ended" else "studying"
+        engine.end_reason = snap.get("end_reason")
+        engine._time_up_notified = snap.get("time_up_notified", False)
+        return engine
+
+    def step(self, event: SessionEvent) -> list:
+        if self.state == "ended":
+            return []
+        self.last_ts = max(self.last_ts, event.ts)
+        effects = []
+        self._handlers[event.kind](self, event, effects)
+        return effects
+
+    def run(self, events) -> list:
+        """Feed an iterable of events; returns all effects (stops once ended)."""
+        effects = []
+        for event in events:
+            effects.extend(self.step(event))
+            if self.state == "ended":
+                break
+        return effects
+
+    def _end(self, reason: str, kind: str, message: str, effects: list):
+        self.state = "ended"
+        self.end_reason = reason
+        effects.append(SessionEffect("notify", kind, message, {}))
+
+    def _on_observation(self, event, effects):
+        obs = event.data
+        self.face_present = obs.face_present
+        self.ear = obs.ear
+        if obs.face_present:
+            self.last_face_seen_ts = event.ts
+            if obs.ear is not None and self.ear_estimator.update(obs.ear):
+                self.closed_threshold = self.ear_estimator.baseline * 0.5
+
+            if obs.ear is not None and obs.ear < self.closed_threshold:
+                if self.eyes_closed_since is None:
+                    self.eyes_closed_since = event.ts
+                elif event.ts - self.eyes_closed_since > self.eyes_closed_timeout:
+                    self._end("eyes_closed", "sleep",
+                              "Eyes closed for 5+ minutes. Assuming sleep, ending session.", effects)
+            else:
+                self.eyes_closed_since = None
+        elif event.ts - self.last_face_seen_ts > self.no_face_timeout:
+            self._end("no_face", "sleep", "No face in view for 20+ minutes. Assuming sleep, ending session.", effects)
+
+        drowsiness = self.drowsiness
+        drowsiness.update(event.ts, obs.ear if obs.face_present else None, self.closed_threshold)
+        score = compute_focus_score(obs.ear, obs.face_present, self.ear_estimator.baseline)
+        if drowsiness.closed_since is None:
+            self._open_eye_focus = score
+        elif drowsiness.in_blink(event.ts):
+            score = self._open_eye_focus  # a blink is not a lapse in focus
+        self.focus_score = score * drowsiness.focus_factor()
+        self.focus_total += self.focus_score
+        self.focus_count += 1
+
+        if drowsiness.perclos >= PERCLOS_DROWSY and self.state != "ended" and (
+                self._last_drowsy_alert is None or event.ts - self._last_drowsy_alert >= DROWSY_ALERT_COOLDOWN):
+            self._last_drowsy_alert = event.ts
+            effects.append(SessionEffect(
+                "notify", "drowsy",
+                f"😴 Your eyes were closed {drowsiness.perclos:.0%} of the last minute. Consider a short break.",
+                {"perclos": round(drowsiness.perclos, 3)},
+            ))
+
+        if obs.drink is not None:
+            if obs.drink and not self._drink_prev:
+                self.energy_drinks += 1
+                effects.append(SessionEffect("notify", "energy_drink",
+                                             f"🥤 Detected an energy drink (count = {self.energy_drinks}).",
+                                             {"count": self.energy_drinks}))
+                effects.append(SessionEffect("fetch_fact", "quick_fact", None, {"count": self.energy_drinks}))
+            if obs.snack and not self._snack_prev:
+                self.snacks += 1
+                effects.append(SessionEffect("notify", "snack", f"🍎 Detected a snack (count = {self.snacks}).",
+                                             {"count": self.snacks}))
+            self._drink_prev = obs.drink
+            self._snack_prev = obs.snack
+
+    def _on_clock(self, event, effects):
+        if event.ts >= self.planned_end_ts and not self._time_up_notified:
+            effects.append(SessionEffect(
+                "notify", "time_up",
+                f"⏰ Your planned study time is up! You planned {self.planned_minutes} minutes and have reached that.",
+                {"planned_minutes": self.planned_minutes},
+            ))
+            effects.append(SessionEffect(
+                "prompt", "time_up", "Type 'e' to extend, 'x' to end session, or Enter to keep going silently:", {}))
+            self.state = "time_up"
+            self._time_up_notified = True
+        elif event.ts < self.planned_end_ts:
+            self._time_up_notified = False
+
+    def _on_input(self, event, effects):
+        answer = event.data.strip().lower()
+        if self.state == "time_up":
+            self.state = "studying"
+            if answer == "e":
+                self.state = "extend_minutes"
+                effects.append(SessionEffect("prompt", "extend_minutes",
+                                             "How many extra minutes would you like to add?", {}))
+            elif answer == "x":
+                self._end("user", "session_end", "Ending session at your request.", effects)
+        elif self.state == "extend_minutes":
+            try:
+                extra_min = int(answer)
+                if extra_min <= 0:
+                    raise ValueError
+            except ValueError:
+                effects.append(SessionEffect("prompt", "extend_minutes", "Please enter a positive integer.", {}))
+            else:
+                self.state = "studying"
+                self.planned_minutes += extra_min
+                self.planned_end_ts = event.ts + extra_min * 60
+                effects.append(SessionEffect("notify", "extended", f"✅ Extended session by {extra_min} minutes.",
+                                             {"extra_minutes": extra_min}))
+        elif answer == "q":
+            self._end("user", "session_end", "Manual end requested. Ending session.", effects)
+
+    def _on_quit(self, event, effects):
+        self._end("user", "session_end", "Manual end requested. Ending session.", effects)
+
+    def _on_interrupt(self, event, effects):
+        self._end("interrupt", "session_end", "Interrupted. Ending session.", effects)
+
+    def _on_fact(self, event, effects):
+        if event.data:
+            self.last_quick_fact = event.data
+            effects.append(SessionEffect("notify", "quick_fact", f"Quick fact: {event.data}", {}))
+
+    _handlers = {
+        "observation": _on_observation,
+        "clock": _on_clock,
+        "input": _on_input,
+        "quit": _on_quit,
+        "interrupt": _on_interrupt,
+        "fact": _on_fact,
+    }
+
+    def live_state(self, now: float) -> dict:
+        """Compact state for the live stream (see LiveStream)."""
+        blink_rate = self.drowsiness.blink_rate
+        return {
+            "t": round(now, 3),
+            "f": round(self.focus_score, 1),
+            "e": round(self.ear, 4) if self.ear is not None else None,
+            "p": int(self.face_present),
+            "c": int(self.eyes_closed_since is not None),
+            "d": self.energy_drinks,
+            "s": self.snacks,
+            "m": round((now - self.start_ts) / 60.0, 2),
+            "b": round(blink_rate, 1) if blink_rate is not None else None,
+            "pc": round(self.drowsiness.perclos, 3),
+        }
+
+
+def dispatch_session_effects(effects: list, fetch_fact=None):
+    """Carry out engine effects live: notifications, prompts and quick-fact requests."""
+    for effect in effects:
+        if effect.action == "notify":
+            get_notifications().publish(effect.kind, effect.message, **effect.data)
+        elif effect.action == "prompt":
+            get_notifications().prompt(effect.kind, effect.message)
+        elif effect.action == "fetch_fact" and fetch_fact is not None:
+            fetch_fact(effect.data["count"])
+
+
+class SessionTraceWriter:
+    """
+    Append session events to a JSONL trace: a header line with the engine
+    parameters and its starting snapshot (under "engine"), then one compact
+    line per event.
+    """
+
+    def __init__(self, path: str, header: dict):
+        self.path = path
+        self._f = open(path, "w", encoding="utf-8")
+        self._f.write(_compact_json({"session": header}) + "\n")
+
+    def write(self, event: SessionEvent):
+        data = event.data
+        if event.kind == "observation":
+            data = [int(data.face_present), data.ear, data.drink, data.snack]
+        # Full-precision timestamps: rounding them would make replayed durations drift from the live run
+        self._f.write(_compact_json({"ts": event.ts, "kind": event.kind, "data": data}) + "\n")
+
+    def close(self):
+        self._f.close()
+
+
+def read_session_trace(path: str):
+    """Return (header, events) for a trace written by SessionTraceWriter."""
+    with open(path, "r", encoding="utf-8") as f:
+        header = json.loads(f.readline())["session"]
+        events = []
+        for seq, line in enumerate(f):
+            rec = json.loads(line)
+            data = rec["data"]
+            if rec["kind"] == "observation":
+                face, ear, drink, snack = data
+                data = VisionResult(seq, rec["ts"], bool(face), ear, drink, snack)
+            events.append(SessionEvent(rec["ts"], rec["kind"], data))
+    return header, events
+
+
+def engine_for_trace(header: dict) -> SessionEngine:
+    """The engine a trace started from: restored from its snapshot (resumed sessions included)."""
+    if "engine" in header:
+        return SessionEngine.restore(header["engine"])
+    # Traces from before snapshots were recorded: always a fresh session
+    return SessionEngine(header["start"], header["planned_minutes"], header["open_ear_baseline"])
+
+
+def replay_session_trace(path: str):
+    """Re-run a recorded session through the engine it started from. Returns (engine, effects)."""
+    header, events = read_session_trace(path)
+    engine = engine_for_trace(header)
+    return engine, engine.run(events)
+
+
+# -----------------------------
+# SESSION CHECKPOINTS (CRASH RECOVERY)
+# -----------------------------
+
+RESUME_MAX_AGE_SEC = 6 * 3600   # older interrupted sessions are saved as they stand, not resumed
+
+
+class SessionJournal:
+    """
+    Append-only JSONL journal of one session under CHECKPOINT_DIR: a "start"
+    record (user, session_meta), a small "checkpoint" record with the engine
+    snapshot every CHECKPOINT_SEC, and a "final" record with the session
+    payload once it ends. Each record is one appended, fsynced line, so a
+    checkpoint costs one short write and nothing is ever rewritten. The file
+    is deleted once the session is uploaded; any file still present at
+    launch belongs to a session that crashed or was never uploaded.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.start = None
+        self.last_snapshot = None
+        self.final = None
+        self._f = None
+
+    def _apply(self, record: dict):
+        kind = record.get("type")
+        if kind == "start":
+            self.start = record
+        elif kind == "checkpoint":
+            self.last_snapshot = record["state"]
+        elif kind == "final":
+            self.final = record["payload"]
+
+    @classmethod
+    def create(cls, user: dict, session_meta: dict, start_ts: float) -> "SessionJournal":
+        os.makedirs(CHECKPOINT_DIR, exist_ok=True)
+        journal = cls(os.path.join(CHECKPOINT_DIR, f"{user['localId']}-{int(start_ts * 1000)}.jsonl"))
+        meta = {k: v.isoformat() if isinstance(v, datetime) else v for k, v in session_meta.items()}
+        journal.append({
+            "type": "start",
+            "ts": start_ts,
+            "user": {"localId": user["localId"], "email": user["email"]},
+            "meta": meta,
+            "datetime_keys": [k for k, v in session_meta.items() if isinstance(v, datetime)],
+        })
+        return journal
+
+    @classmethod
+    def load(cls, path: str) -> "SessionJournal":
+        """Read a journal; a line torn by a crash mid-write is cut off so appending can continue."""
+        journal = cls(path)
+        good_bytes = 0
+        with open(path, "rb") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    break
+                if not line.endswith(b"\n"):
+                    break
+                journal._apply(record)
+                good_bytes += len(line)
+        if good_bytes < os.path.getsize(path):
+            with open(path, "r+b") as f:
+                f.truncate(good_bytes)
+        return journal
+
+    @staticmethod
+    def pending(user_id: str) -> list:
+        """Journal paths left behind for this user, oldest first."""
+        if not os.path.isdir(CHECKPOINT_DIR):
+            return []
+        prefix = f"{user_id}-"
+        started = []
+        for name in os.listdir(CHECKPOINT_DIR):
+            stamp = name[len(prefix):-len(".jsonl")]
+            if name.startswith(prefix) and name.endswith(".jsonl") and stamp.isdigit():
+                started.append((int(stamp), name))  # anything else in the directory isn't ours
+        return [os.path.join(CHECKPOINT_DIR, name) for _, name in sorted(started)]
+
+    @property
+    def session_meta(self) -> dict:
+        meta = dict(self.start["meta"])
+        for key in self.start.get("datetime_keys", []):
+            if meta.get(key):
+                meta[key] = datetime.fromisoformat(meta[key])
+        return meta
+
+    def append(self, record: dict):
+        if self._f is None:
+            self._f = open(self.path, "a", encoding="utf-8")
+        self._f.write(_compact_json(record) + "\n")
+        self._f.flush()
+        os.fsync(self._f.fileno())
+        self._apply(record)
+
+    def checkpoint(self, ts: float, snapshot: dict):
+        self.append({"type": "checkpoint", "ts": ts, "state": snapshot})
+
+    def finalize(self, payload: dict):
+        self.append({"type": "final", "payload": payload})
+
+    def close(self):
+        if self._f is not None:
+            self._f.close()
+            self._f = None
+
+    def remove(self):
+        self.close()
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+
+def upload_finalized_session(user: dict, journal: SessionJournal) -> bool:
+    """Upload a journal's final payload; the journal is deleted unless the upload failed."""
+    if firebase_save_session(user, journal.final) or not DB_URL:
+        journal.remove()
+        return True
+    journal.close()
+    print(f"[CHECKPOINT] Upload failed; will retry on next launch ({journal.path}).")
+    return False
+
+
+def recover_interrupted_sessions(user: dict) -> SessionJournal | None:
+    """
+    Handle journals left by sessions that did not finish normally. Sessions
+    that ended but were not uploaded are uploaded. The most recent
+    interrupted one (if under RESUME_MAX_AGE_SEC old) can be resumed - its
+    journal is returned for run_study_session - saved as it stands, or
+    discarded; older ones are saved as they stand.
+    """
+    paths = SessionJournal.pending(user["localId"])
+    to_resume = None
+    for i, path in enumerate(paths):
+        journal = SessionJournal.load(path)
+        if journal.start is None or (journal.final is None and journal.last_snapshot is None):
+            journal.remove()  # died before the first checkpoint: nothing worth keeping
+            continue
+
+        interrupted = journal.final is None
+        if interrupted:
+            snap = journal.last_snapshot
+            meta = journal.session_meta
+            engine = SessionEngine.restore(snap)
+            minutes = (snap["last_ts"] - snap["start_ts"]) / 60.0
+            print(f"\n[CHECKPOINT] Found an {'interrupted' if engine.active else 'unsaved'} "
+                  f"{meta['category']} session from {datetime.fromtimestamp(snap['started_at']):%Y-%m-%d %H:%M} "
+                  f"({minutes:.1f} min, average focus {engine.avg_focus:.1f}).")
+            # A session that had already ended only missed its final record: save it, don't offer it again
+            resumable = (engine.active and i == len(paths) - 1
+                         and time.time() - snap["last_ts"] < RESUME_MAX_AGE_SEC)
+            if resumable:
+                while True:
+                    choice = console_input("Resume it (r), save it as it stands (s) or discard it (d)? ").strip().lower()
+                    if choice in {"r", "s", "d"}:
+                        break
+                    print("Please enter r, s, or d.")
+                if choice == "r":
+                    to_resume = journal
+                    continue
+                if choice == "d":
+                    journal.remove()
+                    print("[CHECKPOINT] Discarded.")
+                    continue
+            journal.finalize(build_session_payload(meta, engine, snap["last_ts"], recovered=engine.active))
+
+        if upload_finalized_session(user, journal):
+            print("[CHECKPOINT] Saved the session." if interrupted
+                  else "[CHECKPOINT] Uploaded a session that failed to save last time.")
+    return to_resume
+
+
 # -----------------------------
 # SESSION LOOP
 # -----------------------------
 
-def run_study_session(user: dict, session_meta: dict):
+def build_session_payload(session_meta: dict, engine: SessionEngine, end_ts: float,
+                          recovered: bool = False) -> dict:
+    """The session record saved to Firebase, from the engine's counters."""
+    eyes = engine.drowsiness.summary()
+    test_datetime = session_meta.get("test_datetime")
+    payload = {
+        "reason": session_meta["reason"],
+        "category": session_meta["category"],
+        "planned_minutes": session_meta["planned_minutes"],
+        "actual_minutes": (end_ts - engine.start_ts) / 60.0,
+        "avg_focus_score": engine.avg_focus,
+        "blink_rate": eyes["blink_rate"],
+        "mean_blink_ms": eyes["mean_blink_ms"],
+        "perclos": eyes["perclos"],
+        "long_closures": eyes["long_closures"],
+        "energy_drinks": engine.energy_drinks,
+        "snacks": engine.snacks,
+        "prior_knowledge": session_meta["prior_knowledge"],
+        "interest": session_meta["interest"],
+        "start_time": datetime.fromtimestamp(engine.started_at).isoformat(),
+        "end_time": datetime.fromtimestamp(end_ts).isoformat(),
+        "test_datetime": test_datetime.isoformat() if test_datetime else None,
+        "created_at": datetime.now().isoformat(),
+        "play_music": session_meta.get("play_music", False),
+    }
+    if recovered:
+        payload["recovered"] = True  # finalized from a checkpoint after a crash
+    return payload
+
+
+def run_study_session(user: dict, session_meta: dict, journal: SessionJournal | None = None) -> bool:
     """
+    Capture frames and feed the observations, console answers and clock ticks
+    to a SessionEngine, carrying out the notifications it emits. The engine is
+    checkpointed to a SessionJournal every CHECKPOINT_SEC so a crash loses at
+    most that much of the session.
+
     user: dict from firebase_sign_in (idToken, localId, email)
     session_meta: dict with reason, category, planned_minutes, test_datetime, etc.
+    journal: an interrupted session's journal to resume (from recover_interrupted_sessions)
+    Returns True if the user wants another session after the quiz.
     """
     planned_minutes = session_meta["planned_minutes"]
-    test_datetime = session_meta.get("test_datetime")
     play_music = session_meta.get("play_music", False)
 
-    cap = cv2.VideoCapture(0)
-    if not cap.isOpened():
+    cap = Camera()
+    if not cap.open():
         print("Error: Could not open webcam.")
-        return
+        return False
 
     # Start music if requested
     if play_music:
@@ -647,229 +3721,209 @@ def run_study_session(user: dict, session_meta: dict):
         min_tracking_confidence=0.5
     ) as face_mesh:
 
-        # Calibrate open-eye EAR
-        open_ear_baseline = calibrate_open_ear(cap, face_mesh)
-        closed_threshold = open_ear_baseline * 0.5
-
-        session_active = True
+        # Reused capture/RGB buffers; resized on the first frame if the driver disagrees
+        frame_pool = FramePool((int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)) or 480,
+                                int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)) or 640, 3))
+
+        # Calibrate open-eye EAR, or reuse this user's profile for this camera
+        camera_id = (f"cam{cap.source}:{int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))}"
+                     f"x{int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))}")
+        resumed = journal is not None and journal.last_snapshot is not None
+        profile = load_calibration_profile(user["localId"], camera_id)
+        calibrated_now = not resumed and (profile is None or profile.get("needs_recalibration", False))
+        calibration_ok = True
+        if resumed:
+            open_ear_baseline = journal.last_snapshot["open_ear_baseline"]
+        elif calibrated_now:
+            open_ear_baseline, calibration_ok = calibrate_open_ear(cap, face_mesh, frame_pool=frame_pool)
+        else:
+            open_ear_baseline = profile["open_ear_baseline"]
+            print(f"[CALIBRATION] Using saved EAR baseline {open_ear_baseline:.3f} for {camera_id}.")
         session_start = time.time()
-        last_face_seen_time = session_start
-        eyes_closed_start_time = None
-        focus_scores = []
-
-        # YOLO & energy drink/snack tracking
-        energy_drinks = 0
-        snacks = 0
-        energy_drink_present_prev = False
-        snack_present_prev = False
-        last_quick_fact = None
-
-        # Study duration notification
-        planned_end_time = session_start + planned_minutes * 60
-        time_up_prompt_cooldown = False
-
-        # Test reminders
-        reminder_1_shown = False
-        reminder_2_shown = False
-        if test_datetime is not None:
-            rem1_ts = test_datetime.timestamp() - 3600     # 1 hour before
-            rem2_ts = test_datetime.timestamp() - 600      # 10 minutes before
+        if resumed:
+            engine = SessionEngine.restore(journal.last_snapshot, now=session_start)
+            print(f"[CHECKPOINT] Resuming at {(engine.last_ts - engine.start_ts) / 60.0:.1f} min "
+                  f"with EAR baseline {open_ear_baseline:.3f}.")
         else:
-            rem1_ts = rem2_ts = None
-
-        frame_count = 0
-
-        print("\nSession started. Press 'q' to end manually.")
-        print("If no face for 20 min OR eyes closed 5 min, session auto-ends (sleep detected).\n")
-
-        while session_active:
-            now = time.time()
-            ret, frame = cap.read()
-            if not ret:
-                print("Error reading frame. Ending session.")
-                break
-
-            h, w, _ = frame.shape
-            rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-            results = face_mesh.process(rgb)
-
-            face_present = False
-            ear = None
-
-            if results.multi_face_landmarks:
-                face_present = True
-                last_face_seen_time = now
-                face_landmarks = results.multi_face_landmarks[0].landmark
-
-                ear = compute_ear(face_landmarks, LEFT_EYE_IDX, w, h)
-
-                # Draw landmarks (optional)
-                mp_drawing.draw_landmarks(
-                    frame,
-                    results.multi_face_landmarks[0],
-                    mp_face_mesh.FACEMESH_TESSELATION,
-                    landmark_drawing_spec=None,
-                    connection_drawing_spec=mp_drawing.DrawingSpec(
-                        thickness=1, circle_radius=1)
-                )
-
-            # Sleep condition: no face
-            if not face_present:
-                if now - last_face_seen_time > NO_FACE_TIMEOUT:
-                    print("[NOTIFY] No face in view for 20+ minutes. Assuming sleep, ending session.")
-                    session_active = False
-            else:
-                # Eyes closed logic
-                if ear is not None and ear < closed_threshold:
-                    if eyes_closed_start_time is None:
-                        eyes_closed_start_time = now
-                    else:
-                        if now - eyes_closed_start_time > EYES_CLOSED_TIMEOUT:
-                            print("[NOTIFY] Eyes closed for 5+ minutes. Assuming sleep, ending session.")
-                            session_active = False
-                else:
-                    eyes_closed_start_time = None
-
-            # Focus score
-            focus_score = compute_focus_score(ear, face_present, open_ear_baseline)
-            focus_scores.append(focus_score)
-
-            # -------------------------
-            # Study time notification
-            # -------------------------
-            if now >= planned_end_time and not time_up_prompt_cooldown:
-                print("\n[NOTIFY] ⏰ Your planned study time is up!")
-                print(f"You planned {planned_minutes} minutes and have reached that.")
-                choice = input("Type 'e' to extend, 'x' to end session, or Enter to keep going silently: ").strip().lower()
-                if choice == "e":
-                    while True:
-                        extra_str = input("How many extra minutes would you like to add? ").strip()
-                        try:
-                            extra_min = int(extra_str)
-                            if extra_min <= 0:
-                                raise ValueError
-                            break
-                        except ValueError:
-                            print("Please enter a positive integer.")
-                    planned_minutes += extra_min
-                    planned_end_time = now + extra_min * 60
-                    print(f"[NOTIFY] ✅ Extended session by {extra_min} minutes.")
-                elif choice == "x":
-                    print("[NOTIFY] Ending session at your request.")
-                    session_active = False
-                time_up_prompt_cooldown = True
-            elif now < planned_end_time:
-                time_up_prompt_cooldown = False
-
-            # -------------------------
-            # Test reminders
-            # -------------------------
-            if test_datetime is not None:
-                if rem1_ts and now >= rem1_ts and not reminder_1_shown:
-                    print("\n[NOTIFY] 📅 Reminder: Your test is in about 1 hour.")
-                    reminder_1_shown = True
-                if rem2_ts and now >= rem2_ts and not reminder_2_shown:
-                    print("\n[NOTIFY] 📅 Reminder: Your test is in about 10 minutes.")
-                    reminder_2_shown = True
-
-            # -------------------------
-            # YOLO energy drink & snack detection (every N frames)
-            # -------------------------
-            frame_count += 1
-            if frame_count % 15 == 0:
-                drink_detected, snack_detected = detect_items(frame)
-
-                if drink_detected and not energy_drink_present_prev:
-                    energy_drinks += 1
-                    print(f"\n[NOTIFY] 🥤 Detected an energy drink (count = {energy_drinks}).")
-                    fact = get_quick_fact_for_energy_drink(energy_drinks)
-                    if fact:
-                        last_quick_fact = fact
-                        print(f"[NOTIFY] Quick fact: {fact}")
-
-                if snack_detected and not snack_present_prev:
-                    snacks += 1
-                    print(f"\n[NOTIFY] 🍎 Detected a snack (count = {snacks}).")
-
-                energy_drink_present_prev = drink_detected
-                snack_present_prev = snack_detected
-
-            # Overlay info on frame
-            ear_display = ear if ear is not None else 0.0
-            status_text = (
-                f"Face: {'Yes' if face_present else 'No'} | "
-                f"EAR: {ear_display:.3f} | "
-                f"Focus: {focus_score:.1f}"
-            )
-            cv2.putText(
-                frame,
-                status_text,
-                (10, 30),
-                cv2.FONT_HERSHEY_SIMPLEX,
-                0.6,
-                (0, 255, 0),
-                2
+            engine = SessionEngine(session_start, planned_minutes, open_ear_baseline)
+            journal = SessionJournal.create(user, session_meta, session_start)
+        last_checkpoint = session_start
+        trace = None
+        if SESSION_TRACE_DIR:
+            os.makedirs(SESSION_TRACE_DIR, exist_ok=True)
+            trace = SessionTraceWriter(
+                os.path.join(SESSION_TRACE_DIR, f"session-{datetime.fromtimestamp(session_start):%Y%m%d-%H%M%S}.jsonl"),
+                {"start": engine.start_ts, "planned_minutes": engine.planned_minutes,
+                 "open_ear_baseline": open_ear_baseline, "user": user["localId"],
+                 "category": session_meta["category"], "engine": engine.snapshot()},
             )
 
-            elapsed_min = (now - session_start) / 60.0
-            cv2.putText(
-                frame,
-                f"Session time: {elapsed_min:.1f} min",
-                (10, 60),
-                cv2.FONT_HERSHEY_SIMPLEX,
-                0.6,
-                (255, 255, 0),
-                2
-            )
+        # Network calls (quick facts) run off the frame loop
+        background = ThreadPoolExecutor(max_workers=1, thread_name_prefix="session-bg")
+        pending_facts = []
 
-            if energy_drinks > 0:
-                cv2.putText(
-                    frame,
-                    f"Energy drinks: {energy_drinks}",
-                    (10, 90),
-                    cv2.FONT_HERSHEY_SIMPLEX,
-                    0.6,
-                    (0, 200, 255),
-                    2
-                )
+        def fetch_fact(count):
+            pending_facts.append(background.submit(get_quick_fact_for_energy_drink, count))
 
-            if snacks > 0:
-                cv2.putText(
-                    frame,
-                    f"Snacks: {snacks}",
-                    (10, 120),
-                    cv2.FONT_HERSHEY_SIMPLEX,
-                    0.6,
-                    (0, 150, 255),
-                    2
-                )
+        def feed(event):
+            if trace is not None:
+                trace.write(event)
+            dispatch_session_effects(engine.step(event), fetch_fact)
 
-            if last_quick_fact:
-                fact_text = last_quick_fact
-                if len(fact_text) > 80:
-                    fact_text = fact_text[:77] + "..."
-                cv2.putText(
-                    frame,
-                    f"Tip: {fact_text}",
-                    (10, 150),
-                    cv2.FONT_HERSHEY_SIMPLEX,
-                    0.5,
-                    (255, 255, 255),
-                    2
-                )
+        frame_count = 0
+        vision_pool = None  # created on the first frame, once the frame size is known
+        use_workers = VISION_WORKERS > 0
+
+        def close_vision_pool():
+            nonlocal vision_pool
+            if vision_pool is not None:
+                vision_pool.close()
+                if vision_pool.dropped:
+                    print(f"[VISION] {vision_pool.dropped} frames dropped while all workers were busy.")
+                vision_pool = None
+
+        frame_buf = None    # pooled buffer holding the current frame
+        renderer = OverlayRenderer()
+        stream = get_live_stream()
+        last_stream_publish = 0.0
+        loop_cpu_start = time.process_time()
+
+        if renderer.mode == "off":
+            print("\nSession started (headless). Type 'q' + Enter or press Ctrl+C to end manually.")
+        else:
+            print("\nSession started. Press 'q' in the window (or type 'q' + Enter) to end manually.")
+        print("If no face for 20 min OR eyes closed 5 min, session auto-ends (sleep detected).\n")
 
-            cv2.imshow("Mind in Focus - Session", frame)
-            key = cv2.waitKey(1) & 0xFF
-            if key == ord('q'):
-                print("[NOTIFY] Manual end requested. Ending session.")
-                session_active = False
+        try:
+            while engine.active:
+                if frame_buf is not None:
+                    frame_buf.release()
+                    frame_buf = None
+                with profiler.span("capture"):
+                    frame_buf = frame_pool.read(cap)
+                if frame_buf is None:
+                    print("Error reading frame. Ending session.")
+                    break
+                frame = frame_buf.bgr
+                now = cap.capture_ts
+
+                frame_count += 1
+                want_detection = frame_count % DETECT_EVERY_N_FRAMES == 0
+
+                if use_workers:
+                    if vision_pool is None:
+                        vision_pool = VisionWorkerPool(frame.shape, VISION_WORKERS)
+                        print(f"[VISION] Analyzing frames in {VISION_WORKERS} worker processes.")
+                    try:
+                        vision_pool.submit(frame, now, want_detection)
+                        observations = vision_pool.results()
+                    except RuntimeError as e:
+                        # Keep the session going on this process rather than losing it
+                        print(f"[VISION] {e} Falling back to in-process analysis.")
+                        close_vision_pool()
+                        use_workers = False
+                    mesh = None  # landmarks stay in the workers; the overlay shows text only
+                if not use_workers:
+                    h, w, _ = frame.shape
+                    with profiler.span("color"):
+                        rgb = frame_buf.to_rgb()
+                    with profiler.span("facemesh"):
+                        results = face_mesh.process(rgb)
+
+                    mesh = None
+                    obs_ear = None
+                    if results.multi_face_landmarks:
+                        mesh = results.multi_face_landmarks[0]
+                        with profiler.span("ear"):
+                            obs_ear = compute_ear(mesh.landmark, LEFT_EYE_IDX, w, h)
+
+                    drink = snack = None
+                    if want_detection:
+                        with profiler.span("detect"):
+                            drink, snack = detect_items(frame)
+                    observations = [VisionResult(frame_count, now, mesh is not None, obs_ear, drink, snack)]
+
+                for obs in observations:
+                    cap.analyzed(obs.ts)
+                    feed(SessionEvent(obs.ts, "observation", obs))
+
+                # Answers to pending prompts (non-blocking)
+                line = console.poll()
+                if line is not None:
+                    feed(SessionEvent(now, "input", line))
+
+                # Study time notification
+                feed(SessionEvent(now, "clock", None))
+
+                while pending_facts and pending_facts[0].done():
+                    feed(SessionEvent(now, "fact", pending_facts.pop(0).result()))
+
+                # Live state for the desktop UI (coalesced, at the stream rate only)
+                if stream is not None and now - last_stream_publish >= stream.interval:
+                    last_stream_publish = now
+                    stream.publish_state(engine.live_state(now))
+
+                # Overlay info on frame (at the capped display rate only)
+                if renderer.due(now):
+                    ear_display = engine.ear if engine.ear is not None else 0.0
+                    elapsed_min = (now - engine.start_ts) / 60.0
+                    fact_text = engine.last_quick_fact
+                    if fact_text and len(fact_text) > 80:
+                        fact_text = fact_text[:77] + "..."
+                    overlay_lines = [
+                        (f"Face: {'Yes' if engine.face_present else 'No'} | "
+                         f"EAR: {ear_display:.3f} | "
+                         f"Focus: {engine.focus_score:.1f}", 0.6, (0, 255, 0)),
+                        (f"Session time: {elapsed_min:.1f} min", 0.6, (255, 255, 0)),
+                        (f"Energy drinks: {engine.energy_drinks}", 0.6, (0, 200, 255)) if engine.energy_drinks > 0 else None,
+                        (f"Snacks: {engine.snacks}", 0.6, (0, 150, 255)) if engine.snacks > 0 else None,
+                        (f"Tip: {fact_text}", 0.5, (255, 255, 255)) if fact_text else None,
+                    ]
+                    with profiler.span("render"):
+                        key = renderer.render(frame, overlay_lines, now, face_landmarks=mesh)
+                    if key == ord('q'):
+                        feed(SessionEvent(now, "quit", None))
+
+                if now - last_checkpoint >= CHECKPOINT_SEC:
+                    last_checkpoint = now
+                    journal.checkpoint(now, engine.snapshot())
+
+                profiler.maybe_report(now)
+        except KeyboardInterrupt:
+            feed(SessionEvent(time.time(), "interrupt", None))
+        finally:
+            journal.checkpoint(time.time(), engine.snapshot())
+            if frame_buf is not None:
+                frame_buf.release()
+            close_vision_pool()
+            if trace is not None:
+                trace.close()
+                print(f"[TRACE] Session events recorded to {trace.path}")
+
+        background.shutdown(wait=False, cancel_futures=True)
+        get_notifications().flush()
+        if profiler.enabled:
+            print(profiler.summary_line())
 
         cap.release()
         cv2.destroyAllWindows()
 
-    session_end = time.time()
-    avg_focus = sum(focus_scores) / len(focus_scores) if focus_scores else 0.0
-    actual_minutes = (session_end - session_start) / 60.0
+        ear_estimator = engine.ear_estimator
+        # A failed calibration's stand-in baseline is never stored as if it had been measured
+        if (calibrated_now and calibration_ok) or ear_estimator.samples >= EAR_MIN_SAMPLES:
+            save_calibration_profile(user["localId"], camera_id, ear_estimator.baseline, ear_estimator.drifted)
+
+        loop_cpu = time.process_time() - loop_cpu_start
+        print(cap.summary_line())
+        print(renderer.summary())
+        if frame_count:
+            print(f"[RENDER] Session loop CPU: {loop_cpu * 1000.0 / frame_count:.2f} ms/frame analyzed "
+                  f"({frame_count} frames)")
+
+    session_payload = build_session_payload(session_meta, engine, time.time())
+    journal.finalize(session_payload)
+    eyes = engine.drowsiness.summary()
+    last_quick_fact = engine.last_quick_fact
 
     # -------------------------
     # End-of-session summary (terminal)
@@ -878,10 +3932,15 @@ def run_study_session(user: dict, session_meta: dict):
     print(f"User:            {user['email']}")
     print(f"Reason:          {session_meta['reason']}")
     print(f"Category:        {session_meta['category']}")
-    print(f"Duration:        {actual_minutes:.1f} minutes")
-    print(f"Average focus:   {avg_focus:.1f}/100")
-    print(f"Energy drinks:   {energy_drinks}")
-    print(f"Snacks:          {snacks}")
+    print(f"Duration:        {session_payload['actual_minutes']:.1f} minutes")
+    print(f"Average focus:   {session_payload['avg_focus_score']:.1f}/100")
+    if eyes["blink_rate"] is not None:
+        print(f"Blinks:          {eyes['blinks']} ({eyes['blink_rate']:.1f}/min"
+              + (f", {eyes['mean_blink_ms']:.0f} ms avg)" if eyes["mean_blink_ms"] is not None else ")"))
+        print(f"Eyes closed:     {eyes['perclos'] * 100:.1f}% of the time (PERCLOS), "
+              f"peak {eyes['peak_perclos'] * 100:.1f}% in a minute, {eyes['long_closures']} long closures")
+    print(f"Energy drinks:   {engine.energy_drinks}")
+    print(f"Snacks:          {engine.snacks}")
     print(f"Prior knowledge: {session_meta['prior_knowledge']}/10")
     print(f"Interest:        {session_meta['interest']}/10")
     print(f"Background music:{'Yes' if session_meta.get('play_music', False) else 'No'}")
@@ -890,41 +3949,27 @@ def run_study_session(user: dict, session_meta: dict):
         print(f"  {last_quick_fact}")
     print("=================================================\n")
 
-    # Save to Firebase
-    session_payload = {
-        "reason": session_meta["reason"],
-        "category": session_meta["category"],
-        "planned_minutes": session_meta["planned_minutes"],
-        "actual_minutes": actual_minutes,
-        "avg_focus_score": avg_focus,
-        "energy_drinks": energy_drinks,
-        "snacks": snacks,
-        "prior_knowledge": session_meta["prior_knowledge"],
-        "interest": session_meta["interest"],
-        "start_time": datetime.fromtimestamp(session_start).isoformat(),
-        "end_time": datetime.fromtimestamp(session_end).isoformat(),
-        "test_datetime": test_datetime.isoformat() if test_datetime else None,
-        "created_at": datetime.now().isoformat(),
-        "play_music": session_meta.get("play_music", False),
-    }
-    firebase_save_session(user, session_payload)
+    # Save to Firebase; the journal stays behind for a retry on next launch if this fails
+    upload_finalized_session(user, journal)
+    refresh_history_analytics(user)
 
     # Also print a JSON summary for frontend integration
     session_stats = {
-        "duration": actual_minutes,
-        "avgFocus": avg_focus,
-        "energyDrinks": energy_drinks,
-        "snacks": snacks,
+        "duration": session_payload["actual_minutes"],
+        "avgFocus": session_payload["avg_focus_score"],
+        "blinkRate": eyes["blink_rate"],
+        "perclos": eyes["perclos"],
+        "energyDrinks": engine.energy_drinks,
+        "snacks": engine.snacks,
     }
     print("SESSION_STATS:", json.dumps(session_stats))
+    if stream is not None:
+        stream.publish_event({"type": "session_stats", "ts": time.time(), "stats": session_stats})
 
     # -------------------------
     # Optional post-session quiz
     # -------------------------
-    resume = run_post_session_quiz()
-    if resume:
-        print("\n🔁 Starting another study session on the same topic based on your quiz results.\n")
-        run_study_session(user, session_meta)
+    return run_post_session_quiz(user)
 
 
 # -----------------------------
@@ -937,7 +3982,7 @@ def chatbot_intake(user_email: str):
     print("1) Test\n2) Homework\n3) Project\n4) Reading\n5) Other")
 
     while True:
-        choice = input("Choose an option (1-5): ").strip()
+        choice = console_input("Choose an option (1-5): ").strip()
         if choice in {"1", "2", "3", "4", "5"}:
             break
         print("Please enter a number between 1 and 5.")
@@ -955,10 +4000,10 @@ def chatbot_intake(user_email: str):
     reason = ""
 
     if category == "Test":
-        test_title = input("What test is this for? (e.g., 'CS midterm'): ").strip() or "Unnamed Test"
+        test_title = console_input("What test is this for? (e.g., 'CS midterm'): ").strip() or "Unnamed Test"
         print("When is this test? (example: 2025-11-20 14:00)")
         while True:
-            test_dt_str = input("Enter test date & time [YYYY-MM-DD HH:MM]: ").strip()
+            test_dt_str = console_input("Enter test date & time [YYYY-MM-DD HH:MM]: ").strip()
             try:
                 test_dt = datetime.strptime(test_dt_str, "%Y-%m-%d %H:%M")
                 break
@@ -966,19 +4011,19 @@ def chatbot_intake(user_email: str):
                 print("Invalid format. Please use YYYY-MM-DD HH:MM.")
         reason = f"Study for test: {test_title}"
 
-        # Just print reminders conceptually
+        # Reminders are scheduled once the test is saved (see main)
         rem1 = test_dt - timedelta(hours=1)
         rem2 = test_dt - timedelta(minutes=10)
-        print("\nI will remember these reminder times (in this session):")
+        print("\nI will remind you at these times (even if you restart the app):")
         print(f" - 1 hour before:      {rem1}")
         print(f" - 10 minutes before:  {rem2}")
     else:
-        reason = input("Briefly describe what you're working on: ").strip()
+        reason = console_input("Briefly describe what you're working on: ").strip()
         if not reason:
             reason = category
 
     while True:
-        planned_str = input("How many minutes do you plan to study this session? (e.g., 25, 45, 60): ").strip()
+        planned_str = console_input("How many minutes do you plan to study this session? (e.g., 25, 45, 60): ").strip()
         try:
             planned_minutes = int(planned_str)
             if planned_minutes <= 0:
@@ -989,7 +4034,7 @@ def chatbot_intake(user_email: str):
 
     # Prior knowledge (1–10)
     while True:
-        pk_str = input("On a scale of 1-10, what's your current knowledge level on this topic? ").strip()
+        pk_str = console_input("On a scale of 1-10, what's your current knowledge level on this topic? ").strip()
         try:
             prior_knowledge = int(pk_str)
             if 1 <= prior_knowledge <= 10:
@@ -1001,7 +4046,7 @@ def chatbot_intake(user_email: str):
 
     # Interest (1–10)
     while True:
-        interest_str = input("On a scale of 1-10, how interested are you in this subject? ").strip()
+        interest_str = console_input("On a scale of 1-10, how interested are you in this subject? ").strip()
         try:
             interest = int(interest_str)
             if 1 <= interest <= 10:
@@ -1013,7 +4058,7 @@ def chatbot_intake(user_email: str):
 
     # Ask about background music
     play_music = False
-    music_ans = input("Would you like relaxing lofi music during this session? (y/n): ").strip().lower()
+    music_ans = console_input("Would you like relaxing lofi music during this session? (y/n): ").strip().lower()
     if music_ans == "y":
         play_music = True
 
@@ -1024,7 +4069,7 @@ def chatbot_intake(user_email: str):
     print(f"- Prior knowledge: {prior_knowledge}/10")
     print(f"- Interest:        {interest}/10")
     print(f"- Background music:{'Yes' if play_music else 'No'}")
-    confirm = input("Start this session now? (y/n): ").strip().lower()
+    confirm = console_input("Start this session now? (y/n): ").strip().lower()
     if confirm != "y":
         print("Okay, not starting a session.")
         return None
@@ -1047,32 +4092,51 @@ def chatbot_intake(user_email: str):
 def main():
     # 1) User login
     print("=== Mind in Focus Login ===")
-    email = input("Email: ").strip()
-    password = input("Password: ").strip()  # for real app, hide input
+    email = console_input("Email: ").strip()
+    password = console_input("Password: ").strip()  # for real app, hide input
 
     user = firebase_sign_in(email, password)
     if not user:
         print("Login failed. Exiting.")
         return
 
-    # 2) Session setup via chatbot
-    intake = chatbot_intake(user["email"])
-    if intake is None:
-        return
+    # 2) Pick up sessions a crash left behind, or set up a new one via chatbot
+    journal = recover_interrupted_sessions(user)
+    if journal is not None:
+        intake = journal.session_meta
+    else:
+        intake = chatbot_intake(user["email"])
+        if intake is None:
+            return
+
+    analytics = refresh_history_analytics(user)
+    scheduler = schedule_saved_test_reminders(user)
 
-    # optionally save test metadata to Firebase
-    if intake["category"] == "Test" and intake["test_datetime"] is not None:
-        firebase_save_test(
+    # optionally save test metadata to Firebase (a resumed session saved it already)
+    if journal is None and intake["category"] == "Test" and intake["test_datetime"] is not None:
+        created_at = datetime.now().isoformat()
+        test_key = firebase_save_test(
             user,
             {
                 "title": intake["reason"],
                 "test_datetime": intake["test_datetime"].isoformat(),
-                "created_at": datetime.now().isoformat(),
+                "created_at": created_at,
             }
         )
-
-    print("\nSession starting...")
-    run_study_session(user, intake)
+        scheduler.schedule_test(user["localId"], test_key or f"local-{created_at}",
+                                intake["reason"], intake["test_datetime"])
+
+    model = analytics.get("success_model")
+    if model and journal is None:
+        chance = predict_success(model, intake)
+        print(f"[ANALYTICS] Based on your last {model['samples']} sessions, "
+              f"estimated chance of a focused, complete session: {chance * 100:.0f}%")
+
+    print("\nSession resuming..." if journal is not None else "\nSession starting...")
+    another = run_study_session(user, intake, journal=journal)
+    while another:
+        print("\n🔁 Starting another study session on the same topic based on your quiz results.\n")
+        another = run_study_session(user, intake)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,411 @@
+"""
+Local stand-ins for the remote services the backend talks to, for offline
+testing and load runs.
+
+RTDBStub implements the part of the Firebase Realtime Database REST API the
+backend uses: POST (push) and GET on /users/{localId}/{collection}.json,
+including orderBy="<child>" with startAt/endAt filters.
+
+    stub = RTDBStub().start()
+    mind_in_focus.DB_URL = stub.url
+
+OpenAIStub answers POST /v1/chat/completions with canned replies (a quiz in
+the expected JSON format, or a short tip):
+
+    stub = OpenAIStub().start()
+    llm = mind_in_focus.LLMClient("test-key", base_url=stub.url + "/v1")
+
+AuthStub answers the Firebase Auth accounts:signInWithPassword call:
+
+    stub = AuthStub().start()
+    mind_in_focus.FIREBASE_AUTH_URL = stub.url + "/v1"
+
+Every stub can inject faults: `latency` seconds per request (plus up to
+`jitter` more, uniformly) and an `error_rate` fraction of requests answered
+with `error_status` before doing anything. load_test.py drives them.
+
+Run this file to check history sync and the LLM client against the stubs
+(and the local reminder scheduler):
+
+    python stub_servers.py
+"""
+
+import itertools
+import json
+import hashlib
+import os
+import random
+import re
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+
+class _HTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 512  # the default backlog of 5 drops connections under load
+
+    def handle_error(self, request, client_address):
+        if isinstance(sys.exc_info()[1], (BrokenPipeError, ConnectionResetError)):
+            return  # the client gave up (timeout or cancelled request)
+        super().handle_error(request, client_address)
+
+
+class _StubServer:
+    """Threaded HTTP server on 127.0.0.1 with a random free port by default."""
+
+    def __init__(self, port: int = 0, latency: float = 0.0, jitter: float = 0.0,
+                 error_rate: float = 0.0, error_status: int = 503, seed: int = 0):
+        self.port = port
+        self.requests = 0
+        self.injected_errors = 0
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self._rng = random.Random(seed)
+        self._server = None
+        self._lock = threading.Lock()
+
+    def fault(self):
+        """Count a request and apply the injected latency. Returns an error status or None."""
+        with self._lock:
+            self.requests += 1
+            delay = self.latency + self._rng.uniform(0.0, self.jitter)
+            fail = self._rng.random() < self.error_rate
+            if fail:
+                self.injected_errors += 1
+        if delay > 0:
+            time.sleep(delay)
+        return self.error_status if fail else None
+
+    def handler_class(self):
+        raise NotImplementedError
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.port}"
+
+    def start(self):
+        self._server = _HTTPServer(("127.0.0.1", self.port), self.handler_class())
+        self.port = self._server.server_address[1]
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+
+
+class _JSONHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status: int, body):
+        payload = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _read_json(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        return json.loads(self.rfile.read(length) or b"null")
+
+    def _injected_fault(self, stub) -> bool:
+        """Apply the stub's latency/error injection; True if an error was sent."""
+        status = stub.fault()
+        if status is None:
+            return False
+        self._read_json()  # drain the body so the client sees the response
+        self._send_json(status, {"error": {"message": "injected failure", "code": status}})
+        return True
+
+
+class RTDBStub(_StubServer):
+    """
+    In-memory Realtime Database. Push keys increase with insertion order like
+    Firebase push IDs. With require_index=True, orderBy queries fail with the
+    same 400 "Index not defined" error Firebase returns without .indexOn.
+    """
+
+    def __init__(self, port: int = 0, require_index: bool = False, **faults):
+        super().__init__(port, **faults)
+        self.data = {}             # path tuple -> {key: record}
+        self.records_sent = 0
+        self.require_index = require_index
+        self._keys = itertools.count(1)
+
+    def push(self, path: str, record: dict) -> str:
+        key = f"-stub{next(self._keys):016d}"
+        with self._lock:
+            self.data.setdefault(self._split(path), {})[key] = record
+        return key
+
+    @staticmethod
+    def _split(path: str) -> tuple:
+        path = path.split("?", 1)[0].strip("/")
+        if path.endswith(".json"):
+            path = path[:-5]
+        return tuple(p for p in path.split("/") if p)
+
+    def query(self, path: str, params: dict) -> dict:
+        with self._lock:
+            children = dict(self.data.get(self._split(path), {}))
+        order_by = params.get("orderBy")
+        if order_by is None:
+            return children
+
+        child = json.loads(order_by)
+        start_at = json.loads(params["startAt"]) if "startAt" in params else None
+        end_at = json.loads(params["endAt"]) if "endAt" in params else None
+        out = {}
+        for key, rec in children.items():
+            value = rec.get(child) if isinstance(rec, dict) else None
+            if value is None and (start_at is not None or end_at is not None):
+                continue
+            if start_at is not None and value < start_at:
+                continue
+            if end_at is not None and value > end_at:
+                continue
+            out[key] = rec
+        return out
+
+    def handler_class(self):
+        stub = self
+
+        class Handler(_JSONHandler):
+            def do_GET(self):
+                if self._injected_fault(stub):
+                    return
+                parts = urlsplit(self.path)
+                params = {k: v[0] for k, v in parse_qs(parts.query).items()}
+                if "orderBy" in params and stub.require_index:
+                    self._send_json(400, {"error": "Index not defined, add \".indexOn\""})
+                    return
+                result = stub.query(parts.path, params)
+                with stub._lock:
+                    stub.records_sent += len(result)
+                self._send_json(200, result or None)
+
+            def do_POST(self):
+                if self._injected_fault(stub):
+                    return
+                key = stub.push(urlsplit(self.path).path, self._read_json())
+                self._send_json(200, {"name": key})
+
+        return Handler
+
+
+class OpenAIStub(_StubServer):
+    """
+    Fake chat-completions endpoint. `reply(messages) -> str` builds the
+    answer; by default a quiz is returned when the prompt asks for
+    multiple-choice questions. fail_next makes the next N requests return 500.
+    """
+
+    def __init__(self, port: int = 0, reply=None, **faults):
+        super().__init__(port, **faults)
+        self.reply = reply or self.default_reply
+        self.fail_next = 0
+
+    @staticmethod
+    def default_reply(messages: list) -> str:
+        prompt = messages[-1]["content"]
+        match = re.search(r"create (\d+) multiple-choice questions", prompt)
+        if not match:
+            return "Caffeine peaks about 30-45 minutes after drinking it, so time it before hard material."
+        questions = [
+            {
+                "question": f"Stub question {i}?",
+                "options": {"A": "Right", "B": "Wrong", "C": "Wrong", "D": "Wrong"},
+                "answer": "A",
+                "topic": f"Stub topic {i}",
+                "review_hint": "Re-read the stub notes.",
+            }
+            for i in range(1, int(match.group(1)) + 1)
+        ]
+        return json.dumps({"questions": questions})
+
+    def handler_class(self):
+        stub = self
+
+        class Handler(_JSONHandler):
+            def do_POST(self):
+                if self._injected_fault(stub):
+                    return
+                with stub._lock:
+                    fail = stub.fail_next > 0
+                    if fail:
+                        stub.fail_next -= 1
+                body = self._read_json()
+                if fail:
+                    self._send_json(500, {"error": {"message": "stub failure", "type": "server_error"}})
+                    return
+                if not urlsplit(self.path).path.endswith("/chat/completions"):
+                    self._send_json(404, {"error": {"message": "not found"}})
+                    return
+                content = stub.reply(body["messages"])
+                prompt_tokens = sum(len(m["content"].split()) for m in body["messages"])
+                completion_tokens = len(content.split())
+                self._send_json(200, {
+                    "id": f"chatcmpl-stub{stub.requests}",
+                    "object": "chat.completion",
+                    "created": int(time.time()),
+                    "model": body.get("model", "stub"),
+                    "choices": [{
+                        "index": 0,
+                        "message": {"role": "assistant", "content": content},
+                        "finish_reason": "stop",
+                    }],
+                    "usage": {
+                        "prompt_tokens": prompt_tokens,
+                        "completion_tokens": completion_tokens,
+                        "total_tokens": prompt_tokens + completion_tokens,
+                    },
+                })
+
+        return Handler
+
+
+class AuthStub(_StubServer):
+    """
+    Firebase Auth email/password sign-in. Any password is accepted except
+    `bad_password`, which gets Firebase's INVALID_PASSWORD 400. localId is
+    derived from the email, so repeated sign-ins return the same user.
+    """
+
+    def __init__(self, port: int = 0, bad_password: str = "wrong", **faults):
+        super().__init__(port, **faults)
+        self.bad_password = bad_password
+
+    def handler_class(self):
+        stub = self
+
+        class Handler(_JSONHandler):
+            def do_POST(self):
+                if self._injected_fault(stub):
+                    return
+                body = self._read_json()
+                if not urlsplit(self.path).path.endswith("/accounts:signInWithPassword"):
+                    self._send_json(404, {"error": {"message": "NOT_FOUND"}})
+                    return
+                if body.get("password") == stub.bad_password:
+                    self._send_json(400, {"error": {"code": 400, "message": "INVALID_PASSWORD"}})
+                    return
+                local_id = hashlib.sha1(body["email"].encode("utf-8")).hexdigest()[:28]
+                self._send_json(200, {
+                    "kind": "identitytoolkit#VerifyPasswordResponse",
+                    "localId": local_id,
+                    "email": body["email"],
+                    "idToken": f"stub-token-{local_id}",
+                    "refreshToken": f"stub-refresh-{local_id}",
+                    "expiresIn": "3600",
+                    "registered": True,
+                })
+
+        return Handler
+
+
+def _check_history_sync():
+    import mind_in_focus as mif
+
+    stub = RTDBStub().start()
+    user = {"localId": "user-1", "idToken": "token", "email": "student@example.com"}
+    try:
+        for day in range(1, 4):
+            stub.push("/users/user-1/sessions", {
+                "category": "Test", "avg_focus_score": 60 + day,
+                "start_time": f"2025-11-0{day}T10:00:00", "created_at": f"2025-11-0{day}T11:00:00",
+            })
+        stub.push("/users/user-1/tests", {
+            "title": "CS midterm", "test_datetime": "2025-11-20T14:00:00", "created_at": "2025-11-01T09:00:00",
+        })
+
+        with tempfile.TemporaryDirectory() as tmp:
+            replica = mif.HistoryReplica(os.path.join(tmp, "history.sqlite3"), db_url=stub.url)
+            first = replica.sync_all(user)
+            assert first == {"sessions": 3, "tests": 1}, first
+
+            stub.push("/users/user-1/sessions", {
+                "category": "Reading", "avg_focus_score": 80,
+                "start_time": "2025-11-04T10:00:00", "created_at": "2025-11-04T11:00:00",
+            })
+            sent_before = stub.records_sent
+            second = replica.sync_all(user)
+            # Only the new session plus the inclusive startAt boundary record of each collection
+            assert stub.records_sent - sent_before == 3, stub.records_sent - sent_before
+            assert second == {"sessions": 2, "tests": 1}, second
+
+            sessions = replica.sessions("user-1")
+            assert [s["avg_focus_score"] for s in sessions] == [61, 62, 63, 80]
+            assert len(replica.sessions("user-1", category="Reading")) == 1
+            assert len(replica.sessions("user-1", since="2025-11-03")) == 2
+            assert replica.tests("user-1", after="2025-11-10")[0]["title"] == "CS midterm"
+            replica.close()
+
+        print("[STUB] History sync check passed.")
+    finally:
+        stub.stop()
+
+
+def _check_llm_client():
+    import mind_in_focus as mif
+
+    stub = OpenAIStub().start()
+    try:
+        llm = mif.LLMClient("test-key", base_url=stub.url + "/v1", backoff_base=0.01)
+        messages = [{"role": "user", "content": "From the material below, create 3 multiple-choice questions."}]
+
+        stub.fail_next = 2
+        reply = llm.complete(messages, max_tokens=100, name="quiz")
+        assert len(json.loads(reply)["questions"]) == 3
+        assert llm.metrics["quiz"].retries == 2
+
+        requests_before = stub.requests
+        assert llm.complete(messages, max_tokens=100, name="quiz") == reply
+        assert stub.requests == requests_before and llm.metrics["quiz"].cache_hits == 1
+
+        tips = llm.complete_many([
+            {"messages": [{"role": "user", "content": f"Tip {i}"}], "max_tokens": 60, "name": "quick_fact"}
+            for i in range(4)
+        ])
+        assert all(isinstance(t, str) for t in tips), tips
+        print(llm.summary_line())
+        print("[STUB] LLM client check passed.")
+    finally:
+        stub.stop()
+
+
+def _check_reminder_scheduler():
+    import mind_in_focus as mif
+
+    fired = []
+    with tempfile.TemporaryDirectory() as tmp:
+        scheduler = mif.ReminderScheduler(lambda r: fired.append((r["id"], time.time())),
+                                          path=os.path.join(tmp, "reminders.sqlite3")).start()
+        try:
+            start = time.time()
+            scheduler.schedule("a", "user-1", start + 0.2, start + 3600, "first")
+            scheduler.schedule("b", "user-1", start + 0.3, start + 3600, "other")
+            scheduler.cancel("a")
+            # The cancelled entry for "a" is still in the heap and must not fire the new one early
+            scheduler.schedule("a", "user-1", start + 0.6, start + 3600, "rescheduled")
+            time.sleep(1.0)
+            assert [rid for rid, _ in fired] == ["b", "a"], fired
+            assert fired[1][1] - start >= 0.6, fired[1][1] - start
+            assert len(scheduler) == 0
+        finally:
+            scheduler.stop()
+    print("[STUB] Reminder scheduler check passed.")
+
+
+if __name__ == "__main__":
+    _check_history_sync()
+    _check_llm_client()
+    _check_reminder_scheduler()
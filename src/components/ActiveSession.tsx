@@ -1,4 +1,4 @@
-import { useState, useEffect } from "react";
+import { useState, useEffect, useRef } from "react";
 import { Button } from "./ui/button";
 import { Card } from "./ui/card";
 import { Pause, Play, FileText, X } from "lucide-react";
@@ -8,6 +8,7 @@ import { NotificationDialog } from "./NotificationDialog";
 import { PostSessionQuiz } from "./PostSessionQuiz";
 import { MusicPlayer } from "./MusicPlayer";
 import { getRandomFoodFact, getRandomBreakReminder, generateQuizQuestion } from "../utils/studyFacts";
+import { subscribeToLiveSession, LiveSessionState } from "../utils/liveSession";
 import { toast } from "sonner@2.0.3";
 
 interface ActiveSessionProps {
@@ -34,6 +35,10 @@ export function ActiveSession({ sessionData, onEnd, onResumeSession }: ActiveSes
   ]);
   const [energyDrinks, setEnergyDrinks] = useState(0);
   const [snacks, setSnacks] = useState(0);
+
+  // Live data from the Python backend; the simulation below only runs until it connects
+  const [liveState, setLiveState] = useState<LiveSessionState | null>(null);
+  const liveRef = useRef(false);
   
   // Notification state
   const [notificationOpen, setNotificationOpen] = useState(false);
@@ -70,6 +75,47 @@ export function ActiveSession({ sessionData, onEnd, onResumeSession }: ActiveSes
     });
   };
 
+  useEffect(() => {
+    return subscribeToLiveSession(
+      (state) => {
+        if (!liveRef.current) {
+          liveRef.current = true;
+          setFocusData([]);  // drop the mock history
+        }
+        setLiveState(state);
+        setFocusScore(Math.round(state.focusScore));
+        setCurrentStatus(!state.facePresent ? "Not in view" : state.eyesClosed ? "Eyes closed" : "Watching screen");
+        setEnergyDrinks(state.energyDrinks);
+        setSnacks(state.snacks);
+        const minute = Math.floor(state.elapsedMinutes);
+        setFocusData(prev =>
+          prev.length && prev[prev.length - 1].time === minute
+            ? prev
+            : [...prev.slice(-59), { time: minute, focus: Math.round(state.focusScore) }]
+        );
+      },
+      (event) => {
+        const message = event.message ?? "";
+        if (event.type === "energy_drink" || event.type === "quick_fact") {
+          if (event.type === "energy_drink") setEatingStatus("Energy drink detected");
+          showNotification("drink", message);
+        } else if (event.type === "snack") {
+          setEatingStatus("Snack detected");
+          showNotification("food", message);
+        } else if (message) {
+          toast.info(message);
+        }
+        if (event.type === "energy_drink" || event.type === "snack") {
+          setTimeout(() => setEatingStatus("None detected"), 3000);
+        }
+        if (message) {
+          const timestamp = new Date(event.ts * 1000).toLocaleTimeString([], { hour12: false });
+          setEvents(prev => [...prev, { time: timestamp, text: message }]);
+        }
+      }
+    );
+  }, []);
+
   useEffect(() => {
     if (isPaused) return;
 
@@ -95,6 +141,8 @@ export function ActiveSession({ sessionData, onEnd, onResumeSession }: ActiveSes
         return newElapsed;
       });
       
+      if (liveRef.current) return;
+
       // Simulate focus changes
       if (Math.random() > 0.95) {
         const newFocus = Math.floor(75 + Math.random() * 20);
@@ -238,7 +286,7 @@ export function ActiveSession({ sessionData, onEnd, onResumeSession }: ActiveSes
             <span className="text-sm text-zinc-400">Tracking:</span>
             <div className="flex items-center gap-2 bg-green-500/10 text-green-500 px-3 py-1 rounded-full text-sm">
               <div className="w-2 h-2 bg-green-500 rounded-full"></div>
-              Active
+              {liveState ? "Active" : "Simulated"}
             </div>
           </div>
         </div>
@@ -349,6 +397,20 @@ export function ActiveSession({ sessionData, onEnd, onResumeSession }: ActiveSes
                   <span className="text-zinc-400">Snacks:</span>
                   <span className="text-white">{snacks}</span>
                 </div>
+                {liveState && (
+                  <>
+                    <div className="flex justify-between">
+                      <span className="text-zinc-400">Blinks/min:</span>
+                      <span className="text-white">
+                        {liveState.blinksPerMinute !== null ? liveState.blinksPerMinute.toFixed(1) : "–"}
+                      </span>
+                    </div>
+                    <div className="flex justify-between">
+                      <span className="text-zinc-400">Eyes closed:</span>
+                      <span className="text-white">{(liveState.perclos * 100).toFixed(1)}%</span>
+                    </div>
+                  </>
+                )}
               </div>
               <p className="text-xs text-zinc-500 mt-4">
                 We only count when objects appear for more than 5 seconds.
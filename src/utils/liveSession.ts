@@ -0,0 +1,67 @@
+// Client for the Python backend's live session stream (STREAM_PORT, default 8765).
+// The backend pushes server-sent events with compact keys to keep frames small.
+
+export interface LiveSessionState {
+  timestamp: number;
+  focusScore: number;
+  ear: number | null;
+  facePresent: boolean;
+  eyesClosed: boolean;
+  energyDrinks: number;
+  snacks: number;
+  elapsedMinutes: number;
+  blinksPerMinute: number | null;
+  perclos: number;
+}
+
+export interface LiveSessionEvent {
+  type: string;
+  message?: string;
+  ts: number;
+  [key: string]: unknown;
+}
+
+interface RawState {
+  t: number;
+  f: number;
+  e: number | null;
+  p: number;
+  c: number;
+  d: number;
+  s: number;
+  m: number;
+  b: number | null;
+  pc: number;
+}
+
+function decodeState(raw: RawState): LiveSessionState {
+  return {
+    timestamp: raw.t,
+    focusScore: raw.f,
+    ear: raw.e,
+    facePresent: raw.p === 1,
+    eyesClosed: raw.c === 1,
+    energyDrinks: raw.d,
+    snacks: raw.s,
+    elapsedMinutes: raw.m,
+    blinksPerMinute: raw.b,
+    perclos: raw.pc,
+  };
+}
+
+export function subscribeToLiveSession(
+  onState: (state: LiveSessionState) => void,
+  onEvent: (event: LiveSessionEvent) => void,
+  url = "http://127.0.0.1:8765/events"
+): () => void {
+  const source = new EventSource(url);
+
+  source.addEventListener("state", (e) => {
+    onState(decodeState(JSON.parse((e as MessageEvent).data)));
+  });
+  source.addEventListener("notify", (e) => {
+    onEvent(JSON.parse((e as MessageEvent).data));
+  });
+
+  return () => source.close();
+}